@@ -3,6 +3,7 @@ import sys
 import datetime
 import json
 import logging
+import threading
 from pathlib import Path
 from typing import Dict, Optional
 
@@ -11,8 +12,12 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 try:
     from utility_classes.video_analysis import Analytics_Generator
     from utility_classes.caption_generation import Caption_Generator
+    from utility_classes.transcription_backends import BACKENDS, create_backend
     from utility_classes.video_enchancers import Video_Enhancement_Pipeline
     from utility_classes.packaging_generator import HLS_Packaging_Generator
+    from utility_classes.frame_io import probe_has_audio
+    from utility_classes.output_sinks import create_sink
+    from utility_classes.preset_scheduler import Preset_Scheduler
     from utility_classes.VMAF import VMAF_Calculator, Quality_Metrics_Generator
 except ImportError as e:
     if "pytest" not in sys.modules:
@@ -33,15 +38,31 @@ logging.basicConfig(
 logger = logging.getLogger('VideoPipeline')
 
 class VideoPipeline:
-    def __init__(self, video_path: str, combine_output_dir: Optional[str] = None):
+    def __init__(self, video_path: str, combine_output_dir: Optional[str] = None, progressive: bool = False,
+                 deadline_seconds: Optional[float] = None, output: Optional[str] = None,
+                 caption_backend: str = "whisper", compute_type: Optional[str] = None,
+                 caption_threads: Optional[int] = None, caption_device: str = "cpu"):
         self.video_path = video_path
         self.path = Path(video_path)
         self.combine_output_dir = combine_output_dir
+        # progressive packages the enhancement output while it is still being encoded
+        self.progressive = progressive
+        # With a deadline, every encode's x264 preset is chosen to finish the job in time
+        self.scheduler = Preset_Scheduler(deadline_seconds) if deadline_seconds else None
+        self.caption_backend = caption_backend
+        self.compute_type = compute_type
+        self.caption_threads = caption_threads
+        self.caption_device = caption_device
         
         if not self.path.exists():
             raise FileNotFoundError(f"Video file not found: {video_path}")
             
         self.video_name = self.path.stem
+        # Results go to output (a directory or s3://bucket/prefix), by default next to the input video;
+        # only an explicit output also receives the HLS package, published while it is encoded
+        target = output or str(self.path.parent)
+        self.output_sink = create_sink(f"{target.rstrip('/')}/lucera_results_{self.video_name}")
+        self.publish_package = output is not None
         self.results = {
             'original_video': str(self.path.absolute()),
             'start_time': datetime.datetime.now().isoformat(),
@@ -56,12 +77,19 @@ class VideoPipeline:
             
             self._run_captioning()
             
-            enhanced_video_path = self._run_enhancement()
+            if self.scheduler is not None:
+                self._plan_encodes()
+            
+            if self.progressive:
+                enhanced_video_path = self._run_progressive_packaging()
+            else:
+                enhanced_video_path = self._run_enhancement()
             
             if self.combine_output_dir:
                 self._run_combine(enhanced_video_path, self.combine_output_dir)
             
-            self._run_packaging(enhanced_video_path)
+            if not self.progressive:
+                self._run_packaging(enhanced_video_path)
             
             self._run_quality_check(enhanced_video_path)
             
@@ -114,14 +142,9 @@ class VideoPipeline:
             logger.error(f"Failed to combine video and subtitles: {e.stderr.decode()}")
 
     def _export_artifacts(self):
-        import shutil
-        
-        logger.info("Finalizing: Exporting artifacts to video directory")
+        logger.info("Finalizing: Exporting artifacts")
         base_src = Path(__file__).parent / "utility_classes"
         
-        output_dir = self.path.parent / f"lucera_results_{self.video_name}"
-        output_dir.mkdir(exist_ok=True)
-        
         artifact_folders = [
             "analysis_results",
             "caption_results",
@@ -131,20 +154,20 @@ class VideoPipeline:
         
         for folder in artifact_folders:
             src = base_src / folder
-            dst = output_dir / folder
             
             if src.exists():
-                shutil.copytree(src, dst, dirs_exist_ok=True)
+                self.output_sink.publish_directory(str(src), folder)
                 logger.info(f"Exported: {folder}")
                 
         report_path = self.results.get('final_report_path')
         if report_path and os.path.exists(report_path):
-             p_report = Path(report_path)
-             if output_dir not in p_report.parents:
-                 shutil.copy2(p_report, output_dir)
+             p_report = Path(report_path).absolute()
+             if not any(base_src / folder in p_report.parents for folder in artifact_folders):
+                 self.output_sink.put_files([(str(p_report), p_report.name)])
                  logger.info(f"Exported final report: {p_report.name}")
-                 
-        logger.info(f"All results available in: {output_dir}")
+        
+        self.output_sink.close()
+        logger.info(f"All results available in: {self.output_sink.url('')}")
 
     def _run_analysis(self):
         logger.info("STAGE 1: Video Analysis")
@@ -155,14 +178,29 @@ class VideoPipeline:
 
     def _run_captioning(self):
         logger.info("STAGE 2: Caption Generation")
-        captions = Caption_Generator(self.video_path, model_size="base")
+        captions = Caption_Generator(self.video_path, model_size="base", backend=self.caption_backend,
+                                     device=self.caption_device, compute_type=self.compute_type,
+                                     threads=self.caption_threads)
         caption_result = captions.run_full_analysis(keep_audio=False)
         self.results['stages']['captioning'] = caption_result
         logger.info("Captioning complete")
 
-    def _run_enhancement(self) -> str:
+    def preload_caption_models(self, model_sizes):
+        """Loads models under the backend, device and compute type captioning will request,
+        so that the warm entries are the ones it finds."""
+        for model_size in model_sizes:
+            create_backend(self.caption_backend, model_size=model_size, device=self.caption_device,
+                           compute_type=self.compute_type, threads=self.caption_threads).load()
+
+    def _plan_encodes(self):
+        # Enhancement presets must leave time for the ladder encode at the end
+        ladder = HLS_Packaging_Generator.profile_resolutions(HLS_Packaging_Generator.ENCODING_PROFILES)
+        frames = HLS_Packaging_Generator.output_frame_count(self.video_path, HLS_Packaging_Generator.ENHANCEMENT_FILTER)
+        self.scheduler.plan("ladder", ladder, frames)
+
+    def _run_enhancement(self, live_path: Optional[str] = None) -> str:
         logger.info("STAGE 3: Video Enhancement")
-        enhancer = Video_Enhancement_Pipeline(self.video_path)
+        enhancer = Video_Enhancement_Pipeline(self.video_path, live_path=live_path, scheduler=self.scheduler)
         enhancement_result = enhancer.run_full_enhancement()
         self.results['stages']['enhancement'] = enhancement_result
         
@@ -177,11 +215,55 @@ class VideoPipeline:
 
     def _run_packaging(self, video_path: str):
         logger.info("STAGE 4: HLS Packaging")
-        packager = HLS_Packaging_Generator(video_path)
+        packager = HLS_Packaging_Generator(
+            video_path,
+            content_aware=True,
+            analysis_metrics=self.results['stages'].get('analysis'),
+            audio_source=self.video_path,
+            ladder_source=self.video_path,
+            scheduler=self.scheduler,
+            output_sink=self.output_sink if self.publish_package else None
+        )
         package_result = packager.run_full_analysis()
         self.results['stages']['packaging'] = package_result
         logger.info("Packaging complete")
 
+    def _run_progressive_packaging(self) -> str:
+        logger.info("STAGE 3+4: Video Enhancement with progressive HLS Packaging")
+        packager = HLS_Packaging_Generator(
+            self.video_path,
+            content_aware=True,
+            analysis_metrics=self.results['stages'].get('analysis'),
+            scheduler=self.scheduler,
+            output_sink=self.output_sink if self.publish_package else None
+        )
+        live_path = packager.create_live_input()
+        has_audio = probe_has_audio(self.video_path)
+        outcome = {}
+        
+        def package():
+            try:
+                outcome['result'] = packager.run_progressive(live_path, has_audio)
+            except (RuntimeError, OSError) as e:
+                outcome['error'] = e
+        
+        thread = threading.Thread(target=package, name="progressive-packaging", daemon=True)
+        thread.start()
+        try:
+            enhanced_video = self._run_enhancement(live_path)
+        finally:
+            packager.close_live_input(live_path)
+            thread.join()
+        
+        if 'result' in outcome:
+            self.results['stages']['packaging'] = outcome['result']
+            logger.info("Progressive packaging complete")
+        else:
+            # e.g. the last enhancement stage was skipped and never wrote the live stream
+            logger.warning(f"Progressive packaging unavailable ({outcome.get('error')}); packaging the file instead")
+            self._run_packaging(enhanced_video)
+        return enhanced_video
+
     def _run_quality_check(self, enhanced_video_path: str):
         logger.info("STAGE 5: Quality Verification (VMAF)")
         if os.path.abspath(self.video_path) == os.path.abspath(enhanced_video_path):
@@ -199,6 +281,8 @@ class VideoPipeline:
 
     def _generate_report(self):
         logger.info("STAGE 6: Final Reporting")
+        if self.scheduler is not None:
+            self.results['preset_schedule'] = self.scheduler.decisions
         enhanced_res = self.results['stages'].get('enhancement', {})
         enhanced_video = enhanced_res.get('final_video', self.video_path)
         
@@ -239,6 +323,23 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Lucera Video Processing Pipeline")
     parser.add_argument("video_file", help="Path to the input video file")
     parser.add_argument("--combine", help="Directory to save the enhanced video combined with captions", default=None)
+    parser.add_argument("--progressive", action="store_true",
+                        help="Publish HLS segments while enhancement is still running")
+    parser.add_argument("--deadline", type=float, default=None, metavar="SECONDS",
+                        help="Wall-clock budget for the job; x264 presets are chosen to meet it")
+    parser.add_argument("--output", default=None, metavar="TARGET",
+                        help="Directory or s3://bucket/prefix to publish results and the HLS package to "
+                             "(S3 endpoint and credentials come from the AWS_* environment variables)")
+    parser.add_argument("--preload-whisper", nargs="*", default=[], metavar="MODEL",
+                        help="Whisper model sizes to load before processing starts")
+    parser.add_argument("--caption-backend", default="whisper", choices=sorted(BACKENDS),
+                        help="Transcription backend used for captioning")
+    parser.add_argument("--compute-type", default=None,
+                        help="Transcription compute type, e.g. float32, float16 (cuda only) or int8")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="CPU threads used by the transcription backend")
+    parser.add_argument("--caption-device", default="cpu",
+                        help="Device the transcription backend runs on, e.g. cpu or cuda")
     
     args = parser.parse_args()
     
@@ -248,5 +349,10 @@ if __name__ == "__main__":
         print(f"Error: File {video_file} not found.")
         sys.exit(1)
         
-    pipeline = VideoPipeline(video_file, combine_output_dir=args.combine)
+    pipeline = VideoPipeline(video_file, combine_output_dir=args.combine, progressive=args.progressive,
+                             deadline_seconds=args.deadline, output=args.output,
+                             caption_backend=args.caption_backend, compute_type=args.compute_type,
+                             caption_threads=args.threads, caption_device=args.caption_device)
+    if args.preload_whisper:
+        pipeline.preload_caption_models(args.preload_whisper)
     pipeline.run()
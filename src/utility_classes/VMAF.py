@@ -5,14 +5,21 @@ import datetime
 import hashlib
 import json
 import csv
+import math
 import os
 
 
 class VMAF_Calculator:
     
-    def __init__(self, reference_video: str, enhanced_video: str):
+    # libvmaf features computed next to the VMAF model in the same pass
+    VMAF_FEATURES = ["psnr", "float_ssim", "float_ms_ssim"]
+    
+    def __init__(self, reference_video: str, enhanced_video: str, extra_metrics: Optional[List[str]] = None):
         self.reference_video = reference_video
         self.enhanced_video = enhanced_video
+        # extra_metrics are further two-input ffmpeg filters (e.g. "ssim=stats_file=ssim.log") fed from
+        # the same decode of both videos
+        self.extra_metrics = extra_metrics or []
         
         ref_path = Path(reference_video)
         self.video_name = ref_path.stem
@@ -154,6 +161,96 @@ class VMAF_Calculator:
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"SSIM calculation error: {e.stderr.decode()}")
     
+    def build_metrics_graph(self, log_path: str) -> str:
+        # Both videos are compared as 4:2:0, the delivery format, which also fixes the PSNR plane weights
+        branches = 1 + len(self.extra_metrics)
+        graph = [
+            f"[0:v]setpts=PTS-STARTPTS,format=yuv420p,split={branches}" + "".join(f"[main{i}]" for i in range(branches)),
+            f"[1:v]setpts=PTS-STARTPTS,format=yuv420p,split={branches}" + "".join(f"[ref{i}]" for i in range(branches)),
+            f"[main0][ref0]libvmaf=log_fmt=json:log_path={log_path}:n_threads=4:"
+            f"feature='{'|'.join(f'name={name}' for name in self.VMAF_FEATURES)}'[vmaf]"
+        ]
+        for i, metric in enumerate(self.extra_metrics, start=1):
+            graph.append(f"[main{i}][ref{i}]{metric}[metric{i}]")
+        return ";".join(graph)
+    
+    @staticmethod
+    def parse_metrics_log(log_path: str) -> Dict:
+        """Pooled and per-frame VMAF, PSNR, SSIM and MS-SSIM from a libvmaf JSON log.
+        
+        PSNR combines the Y, Cb and Cr errors weighted by 4:1:1 plane size
+        and pools the mean squared error over all frames, as ffmpeg's psnr
+        filter reports its average. SSIM and MS-SSIM are computed on luma.
+        """
+        with open(log_path, 'r') as f:
+            vmaf_data = json.load(f)
+        
+        frames = []
+        mse_total = 0.0
+        for frame in vmaf_data.get('frames', []):
+            metrics = frame['metrics']
+            plane_mse = [255.0 ** 2 / 10 ** (metrics.get(f"psnr_{plane}", 0.0) / 10) for plane in ("y", "cb", "cr")]
+            mse = (4 * plane_mse[0] + plane_mse[1] + plane_mse[2]) / 6
+            mse_total += mse
+            frames.append({
+                'frame': frame['frameNum'],
+                'vmaf': metrics.get('vmaf', 0.0),
+                'psnr': 10 * math.log10(255.0 ** 2 / mse) if mse > 0 else 0.0,
+                'ssim': metrics.get('float_ssim', 0.0),
+                'ms_ssim': metrics.get('float_ms_ssim', 0.0)
+            })
+        
+        pooled_metrics = vmaf_data.get('pooled_metrics', {})
+        mean_mse = mse_total / len(frames) if frames else 0.0
+        return {
+            'vmaf': pooled_metrics.get('vmaf', {}).get('mean', 0),
+            'vmaf_min': pooled_metrics.get('vmaf', {}).get('min', 0),
+            'psnr': 10 * math.log10(255.0 ** 2 / mean_mse) if mean_mse > 0 else 0.0,
+            'ssim': pooled_metrics.get('float_ssim', {}).get('mean', 0),
+            'ms_ssim': pooled_metrics.get('float_ms_ssim', {}).get('mean', 0),
+            'pooled_metrics': pooled_metrics,
+            'frames': frames
+        }
+    
+    def calculate_quality_metrics(self):
+        """VMAF, PSNR, SSIM and MS-SSIM from one ffmpeg pass that decodes each video once."""
+        vmaf_dir = self.vmaf_root / "vmaf_scores"
+        vmaf_dir.mkdir(exist_ok=True)
+        
+        current_time_string = datetime.datetime.now().isoformat()
+        time_bits = current_time_string.encode('utf-8')
+        hash_object = hashlib.sha256(time_bits)
+        current_time_hash = hash_object.hexdigest()[:8]
+        
+        vmaf_json = vmaf_dir / f"{self.video_name}_vmaf_{current_time_hash}.json"
+        
+        print("Calculating VMAF, PSNR and SSIM in one pass...")
+        
+        command = [
+            "ffmpeg",
+            "-i", self.enhanced_video,
+            "-i", self.reference_video,
+            "-filter_complex", self.build_metrics_graph(str(vmaf_json)),
+            "-map", "[vmaf]"
+        ]
+        for i in range(1, 1 + len(self.extra_metrics)):
+            command.extend(["-map", f"[metric{i}]"])
+        command.extend(["-f", "null", "-"])
+        
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Quality metrics error: {e.stderr.decode()}")
+        
+        metrics = self.parse_metrics_log(str(vmaf_json))
+        metrics['log_path'] = str(vmaf_json)
+        
+        print(f"VMAF Score: {metrics['vmaf']:.2f} (lowest frame {metrics['vmaf_min']:.2f})")
+        print(f"PSNR Score: {metrics['psnr']:.2f} dB")
+        print(f"SSIM Score: {metrics['ssim']:.4f} (MS-SSIM {metrics['ms_ssim']:.4f})")
+        
+        return metrics
+    
     def generate_vmaf_report(self, vmaf_json: str, vmaf_score: float, psnr_score: float, ssim_score: float):
         report_dir = self.vmaf_root / "quality_reports"
         report_dir.mkdir(exist_ok=True)
@@ -210,16 +307,12 @@ class VMAF_Calculator:
         print("Starting quality metrics analysis")
         print("="*60)
         
-        print("\n[1/4] Calculating VMAF")
-        vmaf_json, vmaf_score = self.calculate_vmaf()
-        
-        print("\n[2/4] Calculating PSNR")
-        psnr_log, psnr_score = self.calculate_psnr()
-        
-        print("\n[3/4] Calculating SSIM")
-        ssim_log, ssim_score = self.calculate_ssim()
+        print("\n[1/2] Calculating VMAF, PSNR and SSIM")
+        metrics = self.calculate_quality_metrics()
+        vmaf_json = metrics['log_path']
+        vmaf_score, psnr_score, ssim_score = metrics['vmaf'], metrics['psnr'], metrics['ssim']
         
-        print("\n[4/4] Generating quality report")
+        print("\n[2/2] Generating quality report")
         json_report, csv_report, report_data = self.generate_vmaf_report(
             vmaf_json, vmaf_score, psnr_score, ssim_score
         )
@@ -235,6 +328,8 @@ class VMAF_Calculator:
             'vmaf_score': vmaf_score,
             'psnr_score': psnr_score,
             'ssim_score': ssim_score,
+            'ms_ssim_score': metrics['ms_ssim'],
+            'vmaf_min': metrics['vmaf_min'],
             'json_report': json_report,
             'csv_report': csv_report,
             'overall_status': report_data
@@ -0,0 +1,185 @@
+import subprocess
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+class Audio_Source:
+    """Decodes a media file's audio to 16 kHz mono float32 through an ffmpeg s16le pipe.
+
+    Nothing touches the disk: load() returns the whole track as one array,
+    and windows() yields bounded consecutive slices so that hour-long inputs
+    never have to be held in memory at once.
+    """
+
+    def __init__(self, media_path: str, sample_rate: int = SAMPLE_RATE, window_seconds: float = 1200.0,
+                 max_seconds: Optional[float] = None):
+        self.media_path = str(media_path)
+        self.sample_rate = sample_rate
+        self.window_seconds = window_seconds
+        self.max_seconds = max_seconds
+        self.samples_read = 0
+
+    def _command(self):
+        command = [
+            "ffmpeg",
+            "-v", "error",
+            "-nostdin",
+            "-i", self.media_path
+        ]
+        if self.max_seconds:
+            command.extend(["-t", str(self.max_seconds)])
+        return command + [
+            "-vn",
+            "-f", "s16le",
+            "-acodec", "pcm_s16le",
+            "-ar", str(self.sample_rate),
+            "-ac", "1",
+            "-"
+        ]
+
+    @staticmethod
+    def to_float32(buffer: bytes) -> np.ndarray:
+        return np.frombuffer(buffer, dtype=np.int16).astype(np.float32) / 32768.0
+
+    @property
+    def duration(self) -> float:
+        return self.samples_read / self.sample_rate
+
+    def load(self) -> np.ndarray:
+        try:
+            result = subprocess.run(self._command(), check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"FFmpeg error: {e.stderr.decode()}")
+        audio = self.to_float32(result.stdout)
+        self.samples_read = len(audio)
+        return audio
+
+    def windows(self) -> Iterator[Tuple[float, np.ndarray]]:
+        """Yields (offset_seconds, samples) windows of at most window_seconds each."""
+        window_bytes = int(self.window_seconds * self.sample_rate) * 2
+        process = subprocess.Popen(self._command(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.samples_read = 0
+        try:
+            while True:
+                buffer = process.stdout.read(window_bytes)
+                if not buffer:
+                    break
+                # An odd trailing byte can only be a truncated sample
+                audio = self.to_float32(buffer[:len(buffer) // 2 * 2])
+                offset = self.samples_read / self.sample_rate
+                self.samples_read += len(audio)
+                yield offset, audio
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            returncode = process.wait()
+
+        if returncode != 0:
+            raise RuntimeError(f"FFmpeg error: {stderr.decode(errors='replace')}")
+
+
+def frame_energy(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, frame_ms: float = 30.0) -> np.ndarray:
+    """RMS energy of consecutive non-overlapping frames (trailing partial frame dropped)."""
+    frame_length = int(sample_rate * frame_ms / 1000)
+    frame_count = len(audio) // frame_length
+    if frame_count == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:frame_count * frame_length].reshape(frame_count, frame_length)
+    return np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+
+
+def split_at_silences(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, min_seconds: float = 20.0,
+                      max_seconds: float = 29.0, frame_ms: float = 30.0):
+    """Splits audio into (start, end) sample ranges of at most max_seconds.
+
+    Each cut is placed at the quietest frame between min_seconds and
+    max_seconds after the previous cut, so with max_seconds inside Whisper's
+    30 s context every chunk is decoded in a single window and cuts fall
+    in pauses rather than mid-word whenever the speech allows it.
+    """
+    total = len(audio)
+    if total <= max_seconds * sample_rate:
+        return [(0, total)]
+
+    energy = frame_energy(audio, sample_rate, frame_ms)
+    frame_length = int(sample_rate * frame_ms / 1000)
+    min_frames = int(min_seconds * 1000 / frame_ms)
+    max_frames = int(max_seconds * 1000 / frame_ms)
+
+    ranges = []
+    start_frame = 0
+    while (len(energy) - start_frame) > max_frames:
+        window = energy[start_frame + min_frames:start_frame + max_frames]
+        cut_frame = start_frame + min_frames + int(np.argmin(window))
+        ranges.append((start_frame * frame_length, cut_frame * frame_length))
+        start_frame = cut_frame
+    ranges.append((start_frame * frame_length, total))
+    return ranges
+
+
+def _runs(mask: np.ndarray):
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def detect_speech_regions(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, frame_ms: float = 30.0,
+                          energy_margin_db: float = 12.0, energy_floor_db: float = -50.0,
+                          flatness_max: float = 0.45, zcr_range: Tuple[float, float] = (0.01, 0.35),
+                          modulation_block_seconds: float = 1.0, min_modulation_db: float = 4.0,
+                          pad_seconds: float = 0.3, merge_gap_seconds: float = 1.5,
+                          min_region_seconds: float = 0.3):
+    """Cheap speech-presence detection; returns (start, end) sample ranges.
+
+    A frame counts as voiced when it is well above the noise floor, tonal
+    (low spectral flatness, which rejects hiss and broadband noise) and has
+    a zero-crossing rate in the speech range. Voiced frames are then only
+    kept inside blocks whose energy shows syllabic modulation; sustained
+    music beds are loud and tonal but comparatively flat in level.
+    Modulation needs at least two consecutive blocks to count.
+    """
+    frame_length = int(sample_rate * frame_ms / 1000)
+    frame_count = len(audio) // frame_length
+    if frame_count == 0:
+        return []
+    frames = audio[:frame_count * frame_length].reshape(frame_count, frame_length).astype(np.float32)
+
+    energy_db = 10 * np.log10(np.mean(np.square(frames), axis=1) + 1e-10)
+    power = np.square(np.abs(np.fft.rfft(frames * np.hanning(frame_length), axis=1))) + 1e-10
+    flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    zcr = np.mean(np.abs(np.diff(np.signbit(frames), axis=1)), axis=1)
+
+    threshold = max(np.percentile(energy_db, 10) + energy_margin_db, energy_floor_db)
+    voiced = ((energy_db > threshold) & (flatness < flatness_max)
+              & (zcr >= zcr_range[0]) & (zcr <= zcr_range[1]))
+
+    block = max(int(modulation_block_seconds * 1000 / frame_ms), 1)
+    block_count = -(-frame_count // block)
+    padded = np.pad(energy_db, (0, block_count * block - frame_count), mode='edge').reshape(block_count, block)
+    block_modulated = padded.std(axis=1) >= min_modulation_db
+    # A lone modulated block is usually an onset or a hit, not speech
+    for start, end in _runs(block_modulated):
+        if end - start < 2:
+            block_modulated[start:end] = False
+    voiced &= np.repeat(block_modulated, block)[:frame_count]
+
+    pad = int(pad_seconds * 1000 / frame_ms)
+    if pad:
+        voiced = np.convolve(voiced, np.ones(2 * pad + 1), mode='same') > 0
+
+    regions = []
+    merge_gap = merge_gap_seconds * 1000 / frame_ms
+    for start, end in _runs(voiced):
+        if regions and start - regions[-1][1] <= merge_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    min_frames = min_region_seconds * 1000 / frame_ms
+    return [(int(start * frame_length), int(min(end * frame_length, len(audio))))
+            for start, end in regions if end - start >= min_frames]
@@ -0,0 +1,179 @@
+import re
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from .frame_io import probe_video
+
+# Candidate rungs, highest first; base bitrates (kbps) are for moderate content
+CANDIDATE_RUNGS = [
+    {'name': '1080p', 'width': 1920, 'height': 1080, 'bitrate': 4500},
+    {'name': '720p', 'width': 1280, 'height': 720, 'bitrate': 2500},
+    {'name': '480p', 'width': 854, 'height': 480, 'bitrate': 1200},
+    {'name': '360p', 'width': 640, 'height': 360, 'bitrate': 700},
+    {'name': '240p', 'width': 426, 'height': 240, 'bitrate': 400}
+]
+
+# Class name fragments from Analytics_Generator._classify_motion/_classify_complexity
+CLASS_FACTORS = {'Low': 0.6, 'Moderate': 1.0, 'High': 1.4}
+
+
+def content_factor(analysis_metrics: Optional[Dict]) -> float:
+    """Bitrate multiplier from the decision engine's motion and complexity classes."""
+    if not analysis_metrics:
+        return 1.0
+    metrics = analysis_metrics.get('metrics', analysis_metrics)
+    factor = 1.0
+    for key in ('motion', 'complexity'):
+        classification = metrics.get(key, {}).get('classification', '')
+        for fragment, value in CLASS_FACTORS.items():
+            if fragment in classification:
+                factor *= value
+                break
+    return min(max(factor, 0.4), 1.8)
+
+
+class Bitrate_Ladder_Generator:
+    """Builds a per-title encoding ladder for one source.
+
+    Rungs taller than the original source are dropped; video_path is what
+    the ladder actually encodes (an upscaled enhancement output, say) and
+    source_video the original whose resolution caps the ladder. Each
+    remaining rung is probed with a fast constant-quality encode of a short
+    sample, run through the same prefilter and lanczos scale as the real
+    ladder encode, which gives its bitrate and its PSNR against the
+    prefiltered sample at the top rung's size. Rungs that save too little
+    bitrate over their neighbour, or add too little quality over it, are
+    pruned, so every stored rendition buys a real step on the rate/quality
+    curve. Without probes, base bitrates are scaled by the analysis
+    motion/complexity classes and only the bitrate rule applies.
+    """
+
+    def __init__(self, video_path: str, analysis_metrics: Optional[Dict] = None, probe_encodes: bool = True,
+                 probe_seconds: float = 8.0, probe_crf: int = 23, min_step: float = 1.5, min_gain: float = 1.0,
+                 min_bitrate: int = 200, max_bitrate: int = 8000, source_video: Optional[str] = None,
+                 prefilter: Optional[str] = None):
+        self.video_path = video_path
+        self.analysis_metrics = analysis_metrics
+        self.probe_encodes = probe_encodes
+        self.probe_seconds = probe_seconds
+        self.probe_crf = probe_crf
+        self.min_step = min_step
+        self.min_gain = min_gain
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.source_video = source_video or video_path
+        self.prefilter = prefilter
+
+    def candidate_rungs(self, source_height: int) -> List[Dict]:
+        rungs = [dict(rung) for rung in CANDIDATE_RUNGS if rung['height'] <= source_height]
+        return rungs or [dict(CANDIDATE_RUNGS[-1])]
+
+    def _sample_filter(self, width: int, height: int) -> str:
+        return (f"{self.prefilter}," if self.prefilter else "") + f"scale={width}x{height}:flags=lanczos"
+
+    def probe_rung(self, rung: Dict, start: float, duration: float, reference: Tuple[int, int]) -> Dict:
+        """Bitrate (kbps) and PSNR (dB) of a veryfast CRF encode of the sample at the rung's resolution.
+
+        The encode is scaled back up to the reference size and compared with
+        the prefiltered sample; both sides are renumbered so that frames pair
+        by index, as the raw H.264 probe carries no timestamps.
+        """
+        sample_args = ["-ss", str(start), "-t", str(duration), "-i", self.video_path]
+        command = [
+            "ffmpeg",
+            "-v", "error",
+            "-nostdin",
+            *sample_args,
+            "-an",
+            "-vf", self._sample_filter(rung['width'], rung['height']),
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+            "-crf", str(self.probe_crf),
+            "-f", "h264",
+            "-"
+        ]
+        try:
+            encoded = subprocess.run(command, check=True, capture_output=True).stdout
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Probe encode error: {e.stderr.decode()}")
+
+        width, height = reference
+        command = [
+            "ffmpeg",
+            "-v", "info",
+            "-f", "h264",
+            "-i", "-",
+            *sample_args,
+            "-filter_complex",
+            f"[0:v]scale={width}x{height}:flags=bicubic,settb=AVTB,setpts=N[probe];"
+            f"[1:v]{self._sample_filter(width, height)},settb=AVTB,setpts=N[sample];"
+            f"[probe][sample]psnr",
+            "-f", "null",
+            "-"
+        ]
+        try:
+            result = subprocess.run(command, input=encoded, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Probe quality error: {e.stderr.decode()}")
+        match = re.search(r"PSNR .*average:(\S+)", result.stderr.decode())
+        if match is None:
+            raise RuntimeError("Probe quality error: no PSNR reported")
+        psnr = float(match.group(1)) if match.group(1) != "inf" else 100.0
+
+        # veryfast spends roughly a quarter more bits than the ladder's medium preset
+        return {'bitrate': int(len(encoded) * 8 / 1000 / duration * 0.8), 'psnr': psnr}
+
+    def _round(self, bitrate: float) -> int:
+        bitrate = min(max(bitrate, self.min_bitrate), self.max_bitrate)
+        return int(round(bitrate / 50.0) * 50)
+
+    def prune(self, rungs: List[Dict]) -> List[Dict]:
+        """Walks up from the lowest rung keeping rungs at least min_step above the last kept one
+        in bitrate and, when probed, at least min_gain dB above it in PSNR.
+
+        The top rung is always kept; if it is too close to the rung below,
+        that rung is the one dropped.
+        """
+        ascending = sorted(rungs, key=lambda rung: rung['height'])
+        kept = [ascending[0]]
+        for rung in ascending[1:]:
+            gains_quality = 'psnr' not in rung or rung['psnr'] >= kept[-1]['psnr'] + self.min_gain
+            if rung['bitrate'] >= kept[-1]['bitrate'] * self.min_step and gains_quality:
+                kept.append(rung)
+            elif rung is ascending[-1]:
+                kept[-1] = rung
+        return list(reversed(kept))
+
+    def build(self) -> List[Dict]:
+        info = probe_video(self.video_path)
+        # The original source caps the ladder; an upscaled input would keep every rung
+        source_info = info if self.source_video == self.video_path else probe_video(self.source_video)
+        rungs = self.candidate_rungs(source_info['height'])
+        factor = content_factor(self.analysis_metrics)
+
+        probed = None
+        if self.probe_encodes:
+            duration = min(self.probe_seconds, info['duration']) or self.probe_seconds
+            start = max((info['duration'] - duration) / 2, 0.0)
+            reference = (rungs[0]['width'], rungs[0]['height'])
+            print(f"Probe encoding {len(rungs)} rungs on a {duration:.1f}s sample...")
+            try:
+                probed = [self.probe_rung(rung, start, duration, reference) for rung in rungs]
+            except RuntimeError as e:
+                print(f"Probe encodes failed, using analysis estimates: {e}")
+        for i, rung in enumerate(rungs):
+            rung['bitrate'] = self._round(probed[i]['bitrate'] if probed else rung['bitrate'] * factor)
+            if probed:
+                rung['psnr'] = probed[i]['psnr']
+        # Probe rates are noisy; a lower rung never gets more bits than the one above it
+        for higher, lower in zip(rungs, rungs[1:]):
+            lower['bitrate'] = min(lower['bitrate'], higher['bitrate'])
+
+        ladder = [{
+            'resolution': f"{rung['width']}x{rung['height']}",
+            'bitrate': f"{rung['bitrate']}k",
+            'name': rung['name']
+        } for rung in self.prune(rungs)]
+        for profile in ladder:
+            print(f"  {profile['name']}: {profile['bitrate']}")
+        return ladder
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+CACHE_VERSION = 1
+
+
+def audio_fingerprint(media_path: str) -> Optional[str]:
+    """SHA-256 over the first audio stream's compressed packets, without decoding.
+
+    The cache is meant for stream-copied derivatives: remuxes into another
+    container and enhanced videos whose audio was copied from the source
+    carry the same packets and hash identically. Decoded samples are not
+    stable across remuxes (edit lists trim encoder priming in some
+    containers and not others), and re-encoded audio is a different signal
+    whose transcript may differ, so both deliberately miss the cache.
+    Returns None when there is no audio stream to hash.
+    """
+    command = [
+        "ffmpeg",
+        "-v", "error",
+        "-nostdin",
+        "-i", str(media_path),
+        "-map", "0:a:0",
+        "-c", "copy",
+        "-f", "hash",
+        "-hash", "sha256",
+        "-"
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    for line in result.stdout.splitlines():
+        if line.startswith("SHA256="):
+            return "packets:" + line.split("=", 1)[1].strip()
+    return None
+
+
+class Caption_Cache:
+    """Transcripts stored as JSON under a key of audio packet hash + options.
+
+    Entry mtimes record last use; once more than max_entries are stored the
+    least recently used ones are deleted.
+    """
+
+    def __init__(self, cache_dir: Path, max_entries: int = 256):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+
+    @staticmethod
+    def make_key(fingerprint: str, options: Dict) -> str:
+        payload = json.dumps({'version': CACHE_VERSION, 'audio': fingerprint, 'options': options}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key: str, segments: List[Dict], metadata: Optional[Dict] = None):
+        # Each writer gets its own temp file, so concurrent jobs on the same key never rename a partial one
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.cache_dir, suffix=".tmp",
+                                         delete=False) as f:
+            try:
+                json.dump({'segments': segments, **(metadata or {})}, f)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, self._entry_path(key))
+        self.evict()
+
+    def entries(self) -> List[Path]:
+        return sorted(self.cache_dir.glob("*.json"), key=lambda p: p.stat().st_mtime_ns)
+
+    def evict(self):
+        entries = self.entries()
+        for path in entries[:max(len(entries) - self.max_entries, 0)]:
+            path.unlink(missing_ok=True)
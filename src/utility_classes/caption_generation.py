@@ -1,23 +1,38 @@
-import whisper
 import subprocess
 from pathlib import Path
-from typing import Optional, List, Dict
-from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, List, Dict, Tuple, Union
 import tempfile
 import os
 import datetime
 import hashlib
+import numpy as np
+import json
+from concurrent.futures import ProcessPoolExecutor
 
+from .caption_cache import Caption_Cache, audio_fingerprint
+from .audio_processing import SAMPLE_RATE, Audio_Source, detect_speech_regions, split_at_silences
+from .transcription_backends import TranscriptSegment, benchmark_backends, create_backend
 
-@dataclass
-class TranscriptSegment:
-    start: float
-    end: float
-    text: str
+
+_worker_backend = None
+
+
+def _init_transcription_worker(backend: str, model_size: str, device: str, compute_type: str, threads: int):
+    global _worker_backend
+    _worker_backend = create_backend(backend, model_size=model_size, device=device,
+                                     compute_type=compute_type, threads=threads)
+    _worker_backend.load()
+
+
+def _transcribe_chunk(audio: np.ndarray, offset: float) -> List[TranscriptSegment]:
+    return _worker_backend.transcribe(audio, offset=offset)
 
 
 class Caption_Generator:
-    def __init__(self, video_path, model_size: str = "base", device: str = "cpu"):
+    def __init__(self, video_path, model_size: str = "base", device: str = "cpu", backend: str = "whisper",
+                 compute_type: Optional[str] = None, threads: Optional[int] = None,
+                 window_seconds: float = 1200.0, chunked: bool = False, workers: Optional[int] = None,
+                 skip_non_speech: bool = True, use_cache: bool = True, cache_entries: int = 256):
         self.video_path = video_path
         path = Path(video_path)
         self.video_name = path.stem
@@ -29,15 +44,31 @@ class Caption_Generator:
         
         self.model_size = model_size
         self.device = device
+        self.backend = backend
+        self.compute_type = compute_type
+        self.threads = threads
+        self.transcriber = None
+        self.window_seconds = window_seconds
+        self.chunked = chunked
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
+        self.skip_non_speech = skip_non_speech
+        self.skipped_seconds = 0.0
         self.model = None
+        self.cache = Caption_Cache(self.captions_root / "cache", max_entries=cache_entries) if use_cache else None
         
         print("video name:", self.video_name)
-        print(f"Whisper model: {model_size}")
+        print(f"Whisper model: {model_size} ({backend})")
     
     def _load_model(self):
-        if self.model is None:
-            print("Loading Whisper model...")
-            self.model = whisper.load_model(self.model_size, device=self.device)
+        if self.transcriber is None:
+            self.transcriber = create_backend(
+                self.backend,
+                model_size=self.model_size,
+                device=self.device,
+                compute_type=self.compute_type,
+                threads=self.threads
+            )
+        self.model = self.transcriber.load()
     
     def extract_audio(self):
         audio_dir = self.captions_root / "audio_extraction"
@@ -74,26 +105,123 @@ class Caption_Generator:
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"FFmpeg error: {e.stderr.decode()}")
     
-    def transcribe_audio(self, audio_path: str):
+    def transcribe_audio(self, audio: Union[str, np.ndarray], offset: float = 0.0):
         self._load_model()
         
         transcription_dir = self.captions_root / "transcription"
         transcription_dir.mkdir(exist_ok=True)
         
-        print(f"Transcribing audio with Whisper ({self.model_size})...")
-        result = self.model.transcribe(audio_path, word_timestamps=False)
+        print(f"Transcribing audio with Whisper ({self.model_size}, {self.backend})...")
+        segments = self.transcriber.transcribe(audio, offset=offset)
         
-        segments = []
-        for seg in result['segments']:
-            segments.append(TranscriptSegment(
-                start=seg['start'],
-                end=seg['end'],
-                text=seg['text'].strip()
-            ))
+        print(f"Transcription complete: {len(segments)} segments")
+        return segments
+    
+    def speech_ranges(self, audio: np.ndarray):
+        if not self.skip_non_speech:
+            return [(0, len(audio))]
+        
+        ranges = detect_speech_regions(audio)
+        speech_seconds = sum(end - start for start, end in ranges) / SAMPLE_RATE
+        skipped = len(audio) / SAMPLE_RATE - speech_seconds
+        self.skipped_seconds += skipped
+        print(f"Speech detected: {speech_seconds:.1f}s in {len(ranges)} regions, skipping {skipped:.1f}s")
+        return ranges
+    
+    def _speech_chunks(self, audio: np.ndarray, offset: float, ranges) -> List[Tuple[np.ndarray, float]]:
+        chunks = []
+        for range_start, range_end in ranges if ranges is not None else [(0, len(audio))]:
+            region = audio[range_start:range_end]
+            for start, end in split_at_silences(region):
+                chunks.append((region[start:end], offset + (range_start + start) / SAMPLE_RATE))
+        return chunks
+    
+    def open_worker_pool(self) -> Optional[ProcessPoolExecutor]:
+        """One worker pool per job, or None when chunks are transcribed in-process.
+
+        Each worker loads the model once in its initializer and keeps it for
+        every window of the job, so the pool must outlive the windows.
+        """
+        if not self.chunked or self.workers == 1:
+            return None
+        threads = self.threads or max(1, (os.cpu_count() or 1) // self.workers)
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_transcription_worker,
+            initargs=(self.backend, self.model_size, self.device, self.compute_type, threads)
+        )
+    
+    def iter_chunk_segments(self, chunks: List[Tuple[np.ndarray, float]],
+                            pool: Optional[ProcessPoolExecutor] = None) -> Iterator[List[TranscriptSegment]]:
+        """Yields each chunk's segments in timeline order as soon as that chunk is decoded."""
+        if not chunks:
+            return
+        
+        if pool is None:
+            print(f"Transcribing {len(chunks)} chunks with 1 worker ({self.model_size})...")
+            self._load_model()
+            for chunk, chunk_offset in chunks:
+                yield self.transcriber.transcribe(chunk, offset=chunk_offset)
+            return
         
+        print(f"Transcribing {len(chunks)} chunks with {self.workers} worker(s) ({self.model_size})...")
+        futures = [pool.submit(_transcribe_chunk, chunk, chunk_offset) for chunk, chunk_offset in chunks]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Drops queued chunks when the consumer stops early; shutdown(cancel_futures=True) needs 3.9
+            for future in futures:
+                future.cancel()
+    
+    def transcribe_chunked(self, audio: np.ndarray, offset: float = 0.0, ranges=None,
+                           pool: Optional[ProcessPoolExecutor] = None):
+        """Transcribes silence-aligned ~30 s chunks in parallel, one model per worker process."""
+        chunks = self._speech_chunks(audio, offset, ranges)
+        own_pool = self.open_worker_pool() if pool is None else None
+        try:
+            segments = [seg for chunk_segments in self.iter_chunk_segments(chunks, pool or own_pool)
+                        for seg in chunk_segments]
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown()
         print(f"Transcription complete: {len(segments)} segments")
         return segments
     
+    def stream_segments(self, source: Optional[Audio_Source] = None) -> Iterator[TranscriptSegment]:
+        """Yields segments while transcription is still running, one ~30 s chunk at a time."""
+        if source is None:
+            source = Audio_Source(self.video_path, window_seconds=self.window_seconds)
+        self.skipped_seconds = 0.0
+        pool = self.open_worker_pool()
+        try:
+            for offset, audio in source.windows():
+                chunks = self._speech_chunks(audio, offset, self.speech_ranges(audio))
+                for chunk_segments in self.iter_chunk_segments(chunks, pool):
+                    yield from chunk_segments
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    
+    def transcribe_source(self, source: Audio_Source):
+        segments = []
+        self.skipped_seconds = 0.0
+        pool = self.open_worker_pool()
+        try:
+            for offset, audio in source.windows():
+                if offset > 0:
+                    print(f"Transcribing window at {offset:.0f}s...")
+                ranges = self.speech_ranges(audio)
+                if self.chunked:
+                    segments.extend(self.transcribe_chunked(audio, offset=offset, ranges=ranges, pool=pool))
+                    continue
+                for start, end in ranges:
+                    segments.extend(self.transcribe_audio(audio[start:end], offset=offset + start / SAMPLE_RATE))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return segments
+    
     def _format_timestamp_srt(self, seconds: float) -> str:
         hours = int(seconds // 3600)
         minutes = int((seconds % 3600) // 60)
@@ -108,6 +236,18 @@ class Caption_Generator:
         millis = int((seconds % 1) * 1000)
         return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
     
+    def open_caption_writer(self) -> "Incremental_Caption_Writer":
+        srt_dir = self.captions_root / "srt_captions"
+        srt_dir.mkdir(exist_ok=True)
+        vtt_dir = self.captions_root / "vtt_captions"
+        vtt_dir.mkdir(exist_ok=True)
+        return Incremental_Caption_Writer(
+            srt_dir / f"{self.video_name}.srt",
+            vtt_dir / f"{self.video_name}.vtt",
+            self._format_timestamp_srt,
+            self._format_timestamp_vtt
+        )
+    
     def generate_srt(self, segments: List[TranscriptSegment]):
         srt_dir = self.captions_root / "srt_captions"
         srt_dir.mkdir(exist_ok=True)
@@ -138,15 +278,117 @@ class Caption_Generator:
         print(f"VTT file saved: {vtt_file}")
         return str(vtt_file)
     
+    def benchmark_backends(self, seconds: float = 60.0, configs: Optional[List[Dict]] = None):
+        benchmark_dir = self.captions_root / "benchmarks"
+        benchmark_dir.mkdir(exist_ok=True)
+        
+        print(f"Benchmarking transcription backends on {seconds:.0f}s of audio...")
+        audio = Audio_Source(self.video_path, max_seconds=seconds).load()
+        results = benchmark_backends(audio, self.model_size, configs, device=self.device, threads=self.threads)
+        
+        benchmark_file = benchmark_dir / f"{self.video_name}_backends.json"
+        with open(benchmark_file, 'w') as f:
+            json.dump(results, f, indent=4)
+        
+        print(f"Benchmark saved: {benchmark_file}")
+        return results
+    
+    def cache_options(self, split_at_silences: bool) -> Dict:
+        # Everything that can change the transcript; threads and workers cannot.
+        # split_at_silences is the chunking the entry point actually applies:
+        # streaming always splits, a full run only when chunked
+        return {
+            'model_size': self.model_size,
+            'backend': self.backend,
+            'compute_type': self.compute_type,
+            'skip_non_speech': self.skip_non_speech,
+            'split_at_silences': split_at_silences,
+            'window_seconds': self.window_seconds
+        }
+    
+    def cache_key(self, split_at_silences: bool) -> Optional[str]:
+        if self.cache is None:
+            return None
+        fingerprint = audio_fingerprint(self.video_path)
+        if fingerprint is None:
+            print("Could not fingerprint audio, caption cache disabled for this run")
+            return None
+        return Caption_Cache.make_key(fingerprint, self.cache_options(split_at_silences))
+    
+    def run_streaming_analysis(self, callback: Optional[Callable[[TranscriptSegment], None]] = None):
+        """Transcribes and appends each segment to the SRT/VTT files as soon as it is decoded.
+
+        callback, when given, is called with every segment right after it is
+        written, so consumers can show the first captions of a long file
+        long before the job finishes.
+        """
+        print("Starting streaming caption generation")
+        print("="*60)
+        
+        cache_key = self.cache_key(split_at_silences=True)
+        cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            print("Caption cache hit, skipping transcription")
+            self.skipped_seconds = cached.get('skipped_seconds', 0.0)
+            segment_iter = (TranscriptSegment(**seg) for seg in cached['segments'])
+        else:
+            segment_iter = self.stream_segments()
+        
+        segments = []
+        with self.open_caption_writer() as writer:
+            for segment in segment_iter:
+                writer.append(segment)
+                segments.append(segment)
+                if callback is not None:
+                    callback(segment)
+        
+        if cache_key and cached is None:
+            self.cache.put(
+                cache_key,
+                [{'start': seg.start, 'end': seg.end, 'text': seg.text} for seg in segments],
+                {'skipped_seconds': self.skipped_seconds}
+            )
+        
+        print("\nCAPTION GENERATION COMPLETE!")
+        print(f"SRT: {writer.srt_path}")
+        print(f"VTT: {writer.vtt_path}")
+        
+        return {
+            'video_name': self.video_name,
+            'srt_path': str(writer.srt_path),
+            'vtt_path': str(writer.vtt_path),
+            'audio_path': None,
+            'segment_count': len(segments),
+            'skipped_seconds': round(self.skipped_seconds, 2),
+            'model_used': self.model_size,
+            'backend': self.backend,
+            'cache_hit': cached is not None
+        }
+    
     def run_full_analysis(self, keep_audio: bool = False):
         print("Starting full caption generation pipeline")
         print("="*60)
         
-        print("\n[1/4] Extracting audio")
-        audio_path = self.extract_audio()
+        # The audio is decoded straight into memory; a WAV is only written when it is kept
+        print("\n[1/4] Opening audio stream")
+        audio_path = self.extract_audio() if keep_audio else None
+        source = Audio_Source(audio_path or self.video_path, window_seconds=self.window_seconds)
         
         print("\n[2/4] Transcribing with Whisper")
-        segments = self.transcribe_audio(audio_path)
+        cache_key = self.cache_key(split_at_silences=self.chunked)
+        cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            print("Caption cache hit, skipping transcription")
+            segments = [TranscriptSegment(**seg) for seg in cached['segments']]
+            self.skipped_seconds = cached.get('skipped_seconds', 0.0)
+        else:
+            segments = self.transcribe_source(source)
+            if cache_key:
+                self.cache.put(
+                    cache_key,
+                    [{'start': seg.start, 'end': seg.end, 'text': seg.text} for seg in segments],
+                    {'skipped_seconds': self.skipped_seconds}
+                )
         
         print("\n[3/4] Generating SRT captions")
         srt_path = self.generate_srt(segments)
@@ -154,10 +396,6 @@ class Caption_Generator:
         print("\n[4/4] Generating VTT captions")
         vtt_path = self.generate_vtt(segments)
         
-        if not keep_audio and os.path.exists(audio_path):
-            os.remove(audio_path)
-            print(f"\nRemoved temporary audio file")
-        
         print("\nCAPTION GENERATION COMPLETE!")
         print(f"SRT: {srt_path}")
         print(f"VTT: {vtt_path}")
@@ -168,7 +406,52 @@ class Caption_Generator:
             'vtt_path': vtt_path,
             'audio_path': audio_path if keep_audio else None,
             'segment_count': len(segments),
-            'model_used': self.model_size
+            'skipped_seconds': round(self.skipped_seconds, 2),
+            'model_used': self.model_size,
+            'backend': self.backend,
+            'cache_hit': cached is not None
         }
         
         return result
+
+
+class Incremental_Caption_Writer:
+    """Appends cues to SRT and VTT files, flushing after each so readers can tail them."""
+
+    def __init__(self, srt_path: Path, vtt_path: Path,
+                 format_srt: Callable[[float], str], format_vtt: Callable[[float], str]):
+        self.srt_path = Path(srt_path)
+        self.vtt_path = Path(vtt_path)
+        self.format_srt = format_srt
+        self.format_vtt = format_vtt
+        self.count = 0
+        self.srt_file = None
+        self.vtt_file = None
+
+    def __enter__(self):
+        self.srt_file = open(self.srt_path, 'w', encoding='utf-8')
+        self.vtt_file = open(self.vtt_path, 'w', encoding='utf-8')
+        self.vtt_file.write("WEBVTT\n\n")
+        self.vtt_file.flush()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def append(self, seg: TranscriptSegment):
+        self.count += 1
+        self.srt_file.write(f"{self.count}\n")
+        self.srt_file.write(f"{self.format_srt(seg.start)} --> {self.format_srt(seg.end)}\n")
+        self.srt_file.write(f"{seg.text}\n\n")
+        self.srt_file.flush()
+        
+        self.vtt_file.write(f"{self.format_vtt(seg.start)} --> {self.format_vtt(seg.end)}\n")
+        self.vtt_file.write(f"{seg.text}\n\n")
+        self.vtt_file.flush()
+
+    def close(self):
+        for handle in (self.srt_file, self.vtt_file):
+            if handle is not None:
+                handle.close()
+        self.srt_file = None
+        self.vtt_file = None
@@ -0,0 +1,349 @@
+import json
+import struct
+import subprocess
+from fractions import Fraction
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+# Relative difference between the average and base frame rates above which a stream is VFR
+VFR_TOLERANCE = 0.01
+
+# Raw frames are sent to ffmpeg as V_UNCOMPRESSED Matroska when they carry their own timestamps
+RAW_FOURCC = {"rgb24": b"RGB\x18", "bgr24": b"BGR\x18"}
+
+
+def _ebml_size(size: int) -> bytes:
+    length = 1
+    while size >= (1 << (7 * length)) - 1:
+        length += 1
+    return ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def _ebml(element_id: int, payload: bytes) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + _ebml_size(len(payload)) + payload
+
+
+def _ebml_uint(element_id: int, value: int) -> bytes:
+    return _ebml(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def matroska_raw_header(width: int, height: int, pix_fmt: str) -> bytes:
+    """EBML header, an open-ended Segment, Info (1 us timestamps) and one raw video track."""
+    ebml = _ebml(0x1A45DFA3, _ebml_uint(0x4286, 1) + _ebml_uint(0x42F7, 1) + _ebml_uint(0x42F2, 4)
+                 + _ebml_uint(0x42F3, 8) + _ebml(0x4282, b"matroska") + _ebml_uint(0x4287, 4)
+                 + _ebml_uint(0x4285, 2))
+    segment = bytes.fromhex("1853806701ffffffffffffff")
+    info = _ebml(0x1549A966, _ebml_uint(0x2AD7B1, 1000) + _ebml(0x4D80, b"lucera") + _ebml(0x5741, b"lucera"))
+    video = _ebml(0xE0, _ebml_uint(0xB0, width) + _ebml_uint(0xBA, height) + _ebml(0x2EB524, RAW_FOURCC[pix_fmt]))
+    track = _ebml(0xAE, _ebml_uint(0xD7, 1) + _ebml_uint(0x73C5, 1) + _ebml_uint(0x83, 1)
+                  + _ebml(0x86, b"V_UNCOMPRESSED") + video)
+    return ebml + segment + info + _ebml(0x1654AE6B, track)
+
+
+def matroska_raw_frame(data: bytes, timestamp: float) -> bytes:
+    """One frame as its own Cluster, so each frame carries an absolute timestamp."""
+    block = b"\x81" + struct.pack(">hB", 0, 0x80) + data
+    return _ebml(0x1F43B675, _ebml_uint(0xE7, int(round(timestamp * 1e6))) + _ebml(0xA3, block))
+
+
+def probe_video(video_path: str) -> Dict:
+    command = [
+        "ffprobe",
+        "-v", "quiet",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,profile,level,pix_fmt,width,height,"
+                         "r_frame_rate,avg_frame_rate,nb_frames,duration",
+        "-of", "json",
+        video_path
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"FFprobe error: {e.stderr}")
+
+    streams = json.loads(result.stdout or "{}").get('streams', [])
+    if not streams:
+        raise RuntimeError(f"No video stream found in {video_path}")
+    stream = streams[0]
+
+    fps = Fraction(stream.get('r_frame_rate', '0/1'))
+    avg_fps = Fraction(stream.get('avg_frame_rate', '0/1') or '0/1')
+    duration = float(stream.get('duration', 0) or 0)
+    nb_frames = stream.get('nb_frames')
+    frame_count = int(nb_frames) if nb_frames and str(nb_frames).isdigit() else int(round(duration * fps))
+
+    return {
+        'codec': stream.get('codec_name'),
+        'profile': stream.get('profile'),
+        'level': stream.get('level'),
+        'pix_fmt': stream.get('pix_fmt'),
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'fps': float(fps) if fps else 0.0,
+        'fps_fraction': f"{fps.numerator}/{fps.denominator}" if fps else "0/1",
+        'frame_count': frame_count,
+        'duration': duration,
+        # avg_frame_rate is frames / duration, so a CFR file whose container duration is a
+        # little off (audio-driven, rounded edit lists) differs from r_frame_rate slightly
+        'variable_frame_rate': bool(avg_fps) and bool(fps) and abs(avg_fps - fps) / fps > VFR_TOLERANCE
+    }
+
+
+def probe_frame_timestamps(video_path: str) -> List[float]:
+    """Presentation timestamps of every video frame, in display order."""
+    command = [
+        "ffprobe",
+        "-v", "quiet",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time",
+        "-of", "csv=p=0",
+        video_path
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"FFprobe error: {e.stderr}")
+
+    timestamps = []
+    for line in result.stdout.splitlines():
+        value = line.strip().rstrip(',')
+        if value and value != "N/A":
+            timestamps.append(float(value))
+    return sorted(timestamps)
+
+
+def probe_keyframe_times(video_path: str) -> List[float]:
+    """Presentation timestamps of the video keyframes (the points a stream copy can cut at)."""
+    command = [
+        "ffprobe",
+        "-v", "quiet",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        video_path
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"FFprobe error: {e.stderr}")
+
+    keyframes = []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) >= 2 and fields[0] not in ("", "N/A") and 'K' in fields[1]:
+            keyframes.append(float(fields[0]))
+    return sorted(keyframes)
+
+
+class Frame_Reader:
+    """Decodes a video into numpy frames (RGB24 by default) through an ffmpeg rawvideo pipe."""
+
+    def __init__(self, video_path: str, width: int, height: int, pix_fmt: str = "rgb24"):
+        self.video_path = video_path
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+        self.frame_size = width * height * 3
+        self.process = None
+
+    def __enter__(self):
+        command = [
+            "ffmpeg",
+            "-v", "error",
+            "-nostats",
+            "-i", self.video_path,
+            "-f", "rawvideo",
+            "-pix_fmt", self.pix_fmt,
+            "-vsync", "passthrough",
+            "-"
+        ]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def read(self) -> Optional[np.ndarray]:
+        buffer = self.process.stdout.read(self.frame_size)
+        if not buffer or len(buffer) < self.frame_size:
+            return None
+        return np.frombuffer(buffer, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.process = None
+
+
+class Frame_Writer:
+    """Encodes numpy frames written to an ffmpeg pipe.
+
+    Frames go through a rawvideo pipe at fps. With timestamps (variable frame
+    rate sources) each frame is sent with its own source timestamp in a raw
+    Matroska stream instead and encoded with passthrough timing, so the output
+    keeps the source's frame times without duplicated frames. When an audio
+    source is given its audio is muxed in by stream copy. A live_path
+    receives the same encoded streams as MPEG-TS while they are produced
+    (for progressive packaging); if its reader goes away the file output
+    carries on.
+    """
+
+    def __init__(self, output_path: str, width: int, height: int, fps,
+                 crf: int = 18, preset: str = "medium", pix_fmt: str = "rgb24",
+                 timestamps: Optional[List[float]] = None, audio_source: Optional[str] = None,
+                 live_path: Optional[str] = None):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.crf = crf
+        self.preset = preset
+        self.pix_fmt = pix_fmt
+        self.audio_source = audio_source
+        self.live_path = live_path
+        self.frames_written = 0
+        self.process = None
+
+        self.timestamps = None
+        if timestamps:
+            self.timestamps = [t - timestamps[0] for t in timestamps]
+
+    def _build_command(self):
+        command = [
+            "ffmpeg",
+            "-v", "error",
+            "-nostats",
+            "-y"
+        ]
+        if self.timestamps:
+            command.extend(["-f", "matroska", "-i", "-"])
+        else:
+            command.extend([
+                "-f", "rawvideo",
+                "-pix_fmt", self.pix_fmt,
+                "-s", f"{self.width}x{self.height}",
+                "-r", str(self.fps),
+                "-i", "-"
+            ])
+        if self.audio_source:
+            command.extend(["-i", self.audio_source, "-map", "0:v:0", "-map", "1:a:0?", "-c:a", "copy"])
+        elif self.live_path:
+            command.extend(["-map", "0:v:0"])
+        if self.timestamps:
+            command.extend(["-fps_mode", "passthrough"])
+        command.extend([
+            "-c:v", "libx264",
+            "-preset", self.preset,
+            "-crf", str(self.crf),
+            "-pix_fmt", "yuv420p"
+        ])
+        if self.live_path:
+            command.extend(["-f", "tee", f"[f=mp4]{self.output_path}|[f=mpegts:onfail=ignore]{self.live_path}"])
+        else:
+            command.append(self.output_path)
+        return command
+
+    def _timestamp(self, index: int) -> float:
+        if index < len(self.timestamps):
+            return self.timestamps[index]
+        # More frames than probed timestamps: continue at the last frame interval (or the base rate)
+        last = self.timestamps[-1]
+        step = last - self.timestamps[-2] if len(self.timestamps) > 1 else 1 / float(Fraction(str(self.fps)))
+        return last + step * (index - len(self.timestamps) + 1)
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            self._build_command(), stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if self.timestamps:
+            self.process.stdin.write(matroska_raw_header(self.width, self.height, self.pix_fmt))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+            return
+        self.close()
+
+    def write(self, frame: np.ndarray):
+        data = np.ascontiguousarray(frame, dtype=np.uint8).tobytes()
+        if self.timestamps:
+            data = matroska_raw_frame(data, self._timestamp(self.frames_written))
+        self.process.stdin.write(data)
+        self.frames_written += 1
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        returncode = self.process.wait()
+        self.process = None
+        if returncode != 0:
+            raise RuntimeError(f"Video encoding error: {stderr.decode(errors='replace')}")
+
+
+def probe_has_audio(video_path: str) -> bool:
+    command = [
+        "ffprobe",
+        "-v", "quiet",
+        "-select_streams", "a",
+        "-show_entries", "stream=index",
+        "-of", "csv=p=0",
+        video_path
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"FFprobe error: {e.stderr}")
+    return bool(result.stdout.strip())
+
+
+def probe_audio(video_path: str) -> Optional[Dict]:
+    """Codec, bitrate and channel count of the first audio stream, or None without audio."""
+    command = [
+        "ffprobe",
+        "-v", "quiet",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name,bit_rate,channels",
+        "-of", "json",
+        video_path
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"FFprobe error: {e.stderr}")
+
+    streams = json.loads(result.stdout or "{}").get('streams', [])
+    if not streams:
+        return None
+    stream = streams[0]
+    bit_rate = stream.get('bit_rate')
+    return {
+        'codec': stream.get('codec_name'),
+        'profile': stream.get('profile'),
+        'level': stream.get('level'),
+        'pix_fmt': stream.get('pix_fmt'),
+        'bitrate': int(bit_rate) if bit_rate and str(bit_rate).isdigit() else None,
+        'channels': int(stream.get('channels', 0) or 0)
+    }
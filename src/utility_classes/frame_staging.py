@@ -0,0 +1,65 @@
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+TMPFS_ROOT = Path("/dev/shm")
+
+
+def select_staging_root(fallback_root: Path, required_bytes: int = 0) -> Path:
+    """Prefers tmpfs for staged frames when it is present and large enough."""
+    if TMPFS_ROOT.is_dir() and os.access(TMPFS_ROOT, os.W_OK):
+        if shutil.disk_usage(TMPFS_ROOT).free > required_bytes * 1.25:
+            return TMPFS_ROOT / "lucera"
+    return Path(fallback_root)
+
+
+class Image_Sequence_Stage:
+    """One image file per frame, for the external ncnn binaries.
+
+    BMP and PPM are uncompressed, so they cost a memcpy to write and read;
+    PNG is only kept for binaries that cannot write anything else.
+    """
+    FORMATS = ("bmp", "ppm", "png")
+
+    def __init__(self, directory: Path, fmt: str = "bmp", prefix: str = "frame_"):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unsupported staging format: {fmt}")
+        self.directory = Path(directory)
+        self.fmt = fmt
+        self.prefix = prefix
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def pattern(self) -> str:
+        return str(self.directory / f"{self.prefix}%06d.{self.fmt}")
+
+    def extract(self, video_path: str, frame_limit: Optional[int] = None) -> int:
+        command = ["ffmpeg", "-i", video_path, "-vsync", "0"]
+        if frame_limit:
+            command.extend(["-frames:v", str(frame_limit)])
+        if self.fmt == "png":
+            command.extend(["-compression_level", "0"])
+        command.extend(["-y", self.pattern])
+
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Frame extraction error: {e.stderr.decode()}")
+        return len(self)
+
+    def frame_paths(self) -> List[Path]:
+        return sorted(self.directory.glob(f"{self.prefix}*.{self.fmt}"))
+
+    def __len__(self):
+        return len(self.frame_paths())
+
+    def write(self, name: str, frame: np.ndarray):
+        cv2.imwrite(str(self.directory / f"{name}.{self.fmt}"), frame)
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
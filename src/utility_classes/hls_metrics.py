@@ -0,0 +1,215 @@
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+TS_PACKET_SIZE = 188
+# Enough transport stream to reach the first SPS and ADTS header of a segment
+CODEC_PROBE_BYTES = 1024 * 1024
+# Segments shorter than this (the tail of a title) would report a peak from a lone IDR frame
+MIN_PEAK_SEGMENT_SECONDS = 1.0
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_byterange(value: str, next_offset: int) -> Tuple[int, int]:
+    """(length, offset) of an EXT-X-BYTERANGE value; a missing offset continues from the previous range."""
+    length, _, offset = value.partition("@")
+    return int(length), int(offset) if offset else next_offset
+
+
+def parse_media_playlist(playlist_path: str) -> List[Dict]:
+    """Splits a VOD media playlist into runs of segments sharing one EXT-X-MAP init segment.
+
+    Segments are (duration, uri, byterange) tuples; byterange is a
+    (length, offset) pair for single-file playlists and None otherwise,
+    as is each run's init_range.
+    """
+    groups = []
+    byterange = None
+    next_offset = 0
+    with open(playlist_path) as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        if line.startswith("#EXT-X-MAP:"):
+            attributes = parse_attributes(line.split(":", 1)[1])
+            init_range = None
+            if 'BYTERANGE' in attributes:
+                init_range = parse_byterange(attributes['BYTERANGE'].strip('"'), 0)
+            groups.append({'init': attributes['URI'].strip('"'), 'init_range': init_range, 'segments': []})
+        elif line.startswith("#EXTINF:"):
+            if not groups:
+                groups.append({'init': None, 'init_range': None, 'segments': []})
+            duration = float(line.split(":", 1)[1].split(",", 1)[0])
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = parse_byterange(line.split(":", 1)[1], next_offset)
+            next_offset = byterange[0] + byterange[1]
+        elif line and not line.startswith("#"):
+            groups[-1]['segments'].append((duration, line, byterange))
+            byterange = None
+    return groups
+
+
+def parse_attributes(attribute_list: str) -> Dict[str, str]:
+    """Attribute list of a playlist tag, values kept as written (quoted strings keep their quotes)."""
+    return dict(ATTRIBUTE_PATTERN.findall(attribute_list))
+
+
+def _read_range(path: Path, byterange: Optional[Tuple[int, int]], limit: Optional[int] = None) -> bytes:
+    length, offset = byterange if byterange else (-1, 0)
+    if limit is not None:
+        length = limit if length < 0 else min(length, limit)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def cmaf_codecs(init_path: str, init_range: Optional[Tuple[int, int]] = None) -> str:
+    """RFC 6381 codecs string read from an fMP4 init segment's avcC/mp4a sample entries."""
+    data = _read_range(Path(init_path), init_range)
+    codecs = []
+    index = data.find(b"avcC")
+    if index != -1:
+        profile, compatibility, level = data[index + 5:index + 8]
+        codecs.append(f"avc1.{profile:02x}{compatibility:02x}{level:02x}")
+    if b"mp4a" in data:
+        codecs.append("mp4a.40.2")
+    return ",".join(codecs)
+
+
+def ts_elementary_streams(data: bytes) -> Dict[int, bytes]:
+    """PES payloads of an MPEG-TS buffer, keyed by PES stream id (0xE0.. video, 0xC0.. audio)."""
+    streams = {}
+    pid_streams = {}
+    for offset in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        packet = data[offset:offset + TS_PACKET_SIZE]
+        if packet[0] != 0x47:
+            continue
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        adaptation = (packet[3] >> 4) & 0x3
+        if not adaptation & 0x1:
+            continue
+        payload = packet[5 + packet[4]:] if adaptation & 0x2 else packet[4:]
+        if packet[1] & 0x40 and payload[:3] == b"\x00\x00\x01":
+            pid_streams[pid] = payload[3]
+            payload = payload[9 + payload[8]:]
+        if pid in pid_streams:
+            streams.setdefault(pid_streams[pid], bytearray()).extend(payload)
+    return {stream_id: bytes(payload) for stream_id, payload in streams.items()}
+
+
+def ts_codecs(data: bytes) -> str:
+    """RFC 6381 codecs string from the H.264 SPS and the ADTS header found in a TS segment."""
+    video, audio = None, None
+    for stream_id, payload in sorted(ts_elementary_streams(data).items(), reverse=True):
+        if 0xE0 <= stream_id <= 0xEF and video is None:
+            index = payload.find(b"\x00\x00\x01")
+            while index != -1 and index + 7 <= len(payload):
+                if payload[index + 3] & 0x1F == 7:
+                    profile, compatibility, level = payload[index + 4:index + 7]
+                    video = f"avc1.{profile:02x}{compatibility:02x}{level:02x}"
+                    break
+                index = payload.find(b"\x00\x00\x01", index + 3)
+        elif 0xC0 <= stream_id <= 0xDF and audio is None:
+            if len(payload) >= 3 and payload[0] == 0xFF and payload[1] & 0xF6 == 0xF0:
+                audio = f"mp4a.40.{(payload[2] >> 6) + 1}"
+    return ",".join(codec for codec in (video, audio) if codec)
+
+
+def measure_media_playlist(playlist_path: str) -> Optional[Dict]:
+    """Measured BANDWIDTH (peak segment bit rate), AVERAGE-BANDWIDTH and CODECS of a media playlist.
+
+    Segment sizes come from the byte ranges of single-file playlists or
+    from the segment files; codecs from the init segment (fMP4) or the
+    first segment's SPS and ADTS headers (MPEG-TS). Returns None when the
+    playlist or its media is missing.
+    """
+    playlist_path = Path(playlist_path)
+    try:
+        groups = parse_media_playlist(str(playlist_path))
+        segments = [segment for group in groups for segment in group['segments']]
+        if not segments:
+            return None
+        rates = []
+        total_bits = 0
+        total_duration = 0.0
+        for duration, uri, byterange in segments:
+            size = byterange[0] if byterange else os.path.getsize(playlist_path.parent / uri)
+            total_bits += size * 8
+            total_duration += duration
+            if duration > 0:
+                rates.append((duration, size * 8 / duration))
+        if groups[0]['init']:
+            codecs = cmaf_codecs(str(playlist_path.parent / groups[0]['init']), groups[0]['init_range'])
+        else:
+            _, uri, byterange = segments[0]
+            codecs = ts_codecs(_read_range(playlist_path.parent / uri, byterange, CODEC_PROBE_BYTES))
+    except OSError:
+        return None
+
+    peak_rates = [rate for duration, rate in rates if duration >= MIN_PEAK_SEGMENT_SECONDS] or \
+        [rate for _, rate in rates]
+    return {
+        'bandwidth': int(max(peak_rates, default=0)),
+        'average_bandwidth': int(total_bits / total_duration) if total_duration else 0,
+        'codecs': codecs
+    }
+
+
+def combine_measurements(video: Dict, audio: Optional[Dict]) -> Dict:
+    """A variant's measurements with its audio rendition's added, as STREAM-INF expects."""
+    if not audio:
+        return dict(video)
+    codecs = [codec for codec in video['codecs'].split(",") if codec]
+    codecs += [codec for codec in audio['codecs'].split(",") if codec and codec not in codecs]
+    return {
+        'bandwidth': video['bandwidth'] + audio['bandwidth'],
+        'average_bandwidth': video['average_bandwidth'] + audio['average_bandwidth'],
+        'codecs': ",".join(codecs)
+    }
+
+
+def update_master_manifest(master_path: str) -> str:
+    """Rewrites an existing master playlist's STREAM-INF bandwidths and codecs from the produced media."""
+    master_path = Path(master_path)
+    with open(master_path) as f:
+        lines = f.read().splitlines()
+
+    audio_groups = {}
+    for line in lines:
+        if line.startswith("#EXT-X-MEDIA:"):
+            attributes = parse_attributes(line.split(":", 1)[1])
+            if attributes.get('TYPE') == "AUDIO" and 'URI' in attributes:
+                audio_groups[attributes['GROUP-ID'].strip('"')] = measure_media_playlist(
+                    master_path.parent / attributes['URI'].strip('"')
+                )
+
+    for i, line in enumerate(lines):
+        if not line.startswith("#EXT-X-STREAM-INF:") or i + 1 >= len(lines):
+            continue
+        measured = measure_media_playlist(master_path.parent / lines[i + 1])
+        if measured is None:
+            print(f"  Skipping {lines[i + 1]}: media not found")
+            continue
+        attributes = parse_attributes(line.split(":", 1)[1])
+        measured = combine_measurements(measured, audio_groups.get(attributes.get('AUDIO', '').strip('"')))
+        attributes['BANDWIDTH'] = str(measured['bandwidth'])
+        attributes['AVERAGE-BANDWIDTH'] = str(measured['average_bandwidth'])
+        if measured['codecs']:
+            attributes['CODECS'] = f'"{measured["codecs"]}"'
+        lines[i] = "#EXT-X-STREAM-INF:" + ",".join(f"{key}={value}" for key, value in attributes.items())
+        print(f"  {lines[i + 1]}: peak {measured['bandwidth']} bps, average {measured['average_bandwidth']} bps")
+
+    temp_path = master_path.parent / f".{master_path.name}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_path, master_path)
+    return str(master_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m utility_classes.hls_metrics <master.m3u8>")
+        sys.exit(1)
+    print(f"Master manifest updated: {update_master_manifest(sys.argv[1])}")
@@ -0,0 +1,436 @@
+import json
+import math
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .frame_io import Frame_Reader, Frame_Writer
+from .frame_staging import Image_Sequence_Stage, select_staging_root
+from .preset_scheduler import host_key
+
+THROUGHPUT_SAMPLE_FRAMES = 32
+THROUGHPUT_VERSION = 1
+
+
+def build_frame_schedule(source_count: int, source_fps: float, target_fps: float) -> Iterator[Tuple[int, float]]:
+    """Yields (source_index, timestep) for every output frame.
+
+    A timestep of 0 means the source frame is copied as-is; anything else is
+    an intermediate frame between source_index and source_index + 1.
+    """
+    output_count = int(math.floor((source_count - 1) * target_fps / source_fps)) + 1
+    for j in range(output_count):
+        position = j * source_fps / target_fps
+        index = int(math.floor(position + 1e-6))
+        timestep = position - index
+        if timestep < 1e-6 or index >= source_count - 1:
+            yield min(index, source_count - 1), 0.0
+        else:
+            yield index, timestep
+
+
+def warp(image, flow):
+    batch, _, height, width = flow.shape
+    horizontal = torch.linspace(-1.0, 1.0, width, device=flow.device).view(1, 1, 1, width).expand(batch, -1, height, -1)
+    vertical = torch.linspace(-1.0, 1.0, height, device=flow.device).view(1, 1, height, 1).expand(batch, -1, -1, width)
+    grid = torch.cat([horizontal, vertical], 1)
+    flow = torch.cat([
+        flow[:, 0:1] / ((width - 1.0) / 2.0),
+        flow[:, 1:2] / ((height - 1.0) / 2.0)
+    ], 1)
+    sample_grid = (grid + flow).permute(0, 2, 3, 1)
+    return F.grid_sample(image, sample_grid, mode='bilinear', padding_mode='border', align_corners=True)
+
+
+def _conv(in_planes, out_planes, kernel_size=3, stride=1, padding=1):
+    return nn.Sequential(
+        nn.Conv2d(in_planes, out_planes, kernel_size, stride, padding, bias=True),
+        nn.LeakyReLU(0.2, True)
+    )
+
+
+class ResConv(nn.Module):
+
+    def __init__(self, c):
+        super().__init__()
+        self.conv = nn.Conv2d(c, c, 3, 1, 1)
+        self.beta = nn.Parameter(torch.ones((1, c, 1, 1)), requires_grad=True)
+        self.relu = nn.LeakyReLU(0.2, True)
+
+    def forward(self, x):
+        return self.relu(self.conv(x) * self.beta + x)
+
+
+class IFBlock(nn.Module):
+
+    def __init__(self, in_planes, c=64):
+        super().__init__()
+        self.conv0 = nn.Sequential(
+            _conv(in_planes, c // 2, 3, 2, 1),
+            _conv(c // 2, c, 3, 2, 1)
+        )
+        self.convblock = nn.Sequential(*[ResConv(c) for _ in range(8)])
+        self.lastconv = nn.Sequential(
+            nn.ConvTranspose2d(c, 4 * 6, 4, 2, 1),
+            nn.PixelShuffle(2)
+        )
+
+    def forward(self, x, flow=None, scale=1):
+        x = F.interpolate(x, scale_factor=1. / scale, mode="bilinear", align_corners=False)
+        if flow is not None:
+            flow = F.interpolate(flow, scale_factor=1. / scale, mode="bilinear", align_corners=False) / scale
+            x = torch.cat((x, flow), 1)
+        feat = self.conv0(x)
+        feat = self.convblock(feat)
+        tmp = self.lastconv(feat)
+        tmp = F.interpolate(tmp, scale_factor=scale, mode="bilinear", align_corners=False)
+        return tmp[:, :4] * scale, tmp[:, 4:5]
+
+
+class IFNet(nn.Module):
+    """RIFE v4 IFNet (the architecture behind rife-v4.6), CPU friendly."""
+
+    def __init__(self):
+        super().__init__()
+        self.block0 = IFBlock(7, c=192)
+        self.block1 = IFBlock(8 + 4, c=128)
+        self.block2 = IFBlock(8 + 4, c=96)
+        self.block3 = IFBlock(8 + 4, c=64)
+
+    def forward(self, img0, img1, timestep, scale_list=(8, 4, 2, 1)):
+        timestep = timestep.view(-1, 1, 1, 1).expand(-1, 1, img0.shape[2], img0.shape[3])
+        warped_img0, warped_img1 = img0, img1
+        flow, mask = None, None
+        for block, scale in zip((self.block0, self.block1, self.block2, self.block3), scale_list):
+            if flow is None:
+                flow, mask = block(torch.cat((img0, img1, timestep), 1), None, scale=scale)
+            else:
+                flow_delta, mask_delta = block(
+                    torch.cat((warped_img0, warped_img1, timestep, mask), 1), flow, scale=scale
+                )
+                flow = flow + flow_delta
+                mask = mask + mask_delta
+            warped_img0 = warp(img0, flow[:, :2])
+            warped_img1 = warp(img1, flow[:, 2:4])
+        mask = torch.sigmoid(mask)
+        return warped_img0 * mask + warped_img1 * (1 - mask)
+
+
+class Interpolation_Backend:
+    name = "base"
+
+    def is_available(self) -> bool:
+        raise NotImplementedError
+
+    def measure_throughput(self, sample_clip: str, info: Dict, target_fps: int, work_dir: Path) -> float:
+        """Output frames per second of a complete run (decode, interpolate, encode) on sample_clip.
+
+        Every backend is timed through its own interpolate() on the same clip,
+        so the numbers compare the whole job rather than each backend's
+        cheapest inner loop.
+        """
+        output_video = Path(work_dir) / f"{self.name}.mp4"
+        self.prepare()
+        start = time.perf_counter()
+        try:
+            self.interpolate(sample_clip, str(output_video), info, target_fps)
+        finally:
+            output_video.unlink(missing_ok=True)
+        output_frames = max(int(info['frame_count'] * target_fps / info['fps']), 1)
+        return output_frames / max(time.perf_counter() - start, 1e-6)
+
+    def prepare(self):
+        """One-off setup (model loading) kept out of throughput timings."""
+
+    def interpolate(self, video_path: str, output_video: str, info: Dict, target_fps: int) -> str:
+        raise NotImplementedError
+
+
+class Minterpolate_Backend(Interpolation_Backend):
+    name = "ffmpeg-minterpolate"
+
+    def __init__(self, preset: str = "medium", crf: int = 18):
+        self.preset = preset
+        self.crf = crf
+
+    def is_available(self) -> bool:
+        return shutil.which("ffmpeg") is not None
+
+    def _filter(self, target_fps: int) -> str:
+        return f"minterpolate='mi_mode=mci:mc_mode=aobmc:vsbmc=1:fps={target_fps}'"
+
+    def interpolate(self, video_path: str, output_video: str, info: Dict, target_fps: int) -> str:
+        command = [
+            "ffmpeg",
+            "-i", video_path,
+            "-filter:v", self._filter(target_fps),
+            "-c:v", "libx264",
+            "-preset", self.preset,
+            "-crf", str(self.crf),
+            output_video
+        ]
+
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+            return output_video
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Video encoding error: {e.stderr.decode()}")
+
+
+class Torch_RIFE_Backend(Interpolation_Backend):
+    """In-process RIFE on CPU.
+
+    Decoded frames are streamed from an ffmpeg pipe, intermediate frames are
+    computed in batches of frame pairs and written straight into the encoder
+    pipe, so no frame ever touches the disk.
+    """
+    name = "rife-torch-cpu"
+
+    def __init__(self, model_path: str, batch_size: int = 4, threads: Optional[int] = None,
+                 preset: str = "medium", crf: int = 18):
+        self.model_path = Path(model_path)
+        self.batch_size = batch_size
+        self.threads = threads
+        self.preset = preset
+        self.crf = crf
+        self.model = None
+
+    def is_available(self) -> bool:
+        return self.model_path.exists()
+
+    def prepare(self):
+        self.load_model()
+
+    def load_model(self):
+        if self.model is not None:
+            return self.model
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+
+        state = torch.load(str(self.model_path), map_location="cpu", weights_only=True)
+        state = {k.replace("module.", "", 1): v for k, v in state.items() if "teacher" not in k}
+
+        model = IFNet()
+        model.load_state_dict(state)
+        model.eval()
+        self.model = model
+        return model
+
+    def _to_tensor(self, frames: List[np.ndarray], padded_shape: Tuple[int, int]):
+        batch = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2).float() / 255.0
+        height, width = batch.shape[2], batch.shape[3]
+        return F.pad(batch, (0, padded_shape[1] - width, 0, padded_shape[0] - height))
+
+    def interpolate_batch(self, first: List[np.ndarray], second: List[np.ndarray],
+                          timesteps: List[float]) -> List[np.ndarray]:
+        model = self.load_model()
+        height, width = first[0].shape[:2]
+        padded_shape = (((height - 1) // 64 + 1) * 64, ((width - 1) // 64 + 1) * 64)
+
+        with torch.inference_mode():
+            img0 = self._to_tensor(first, padded_shape)
+            img1 = self._to_tensor(second, padded_shape)
+            steps = torch.tensor(timesteps, dtype=torch.float32)
+            middle = model(img0, img1, steps)[:, :, :height, :width]
+
+        middle = (middle.clamp(0, 1) * 255.0).round().byte().permute(0, 2, 3, 1).numpy()
+        return list(middle)
+
+    def _stream(self, frames: Iterator[np.ndarray], source_count: int, source_fps: float,
+                target_fps: float, writer):
+        window = {}
+        pending = []
+        jobs = []
+
+        def flush():
+            results = self.interpolate_batch(
+                [first for first, _, _ in jobs],
+                [second for _, second, _ in jobs],
+                [timestep for _, _, timestep in jobs]
+            ) if jobs else []
+            for entry in pending:
+                writer.write(results[entry] if isinstance(entry, int) else entry)
+            pending.clear()
+            jobs.clear()
+
+        frame_iter = iter(frames)
+        next_index = 0
+        for index, timestep in build_frame_schedule(source_count, source_fps, target_fps):
+            needed = index + 1 if timestep else index
+            while next_index <= needed:
+                frame = next(frame_iter, None)
+                if frame is None:
+                    break
+                window[next_index] = frame
+                next_index += 1
+            if needed not in window:
+                break
+
+            if timestep:
+                pending.append(len(jobs))
+                jobs.append((window[index], window[index + 1], timestep))
+                if len(jobs) >= self.batch_size:
+                    flush()
+            elif jobs:
+                pending.append(window[index])
+            else:
+                writer.write(window[index])
+
+            for stale in [i for i in window if i < index]:
+                del window[stale]
+        flush()
+
+    def interpolate(self, video_path: str, output_video: str, info: Dict, target_fps: int) -> str:
+        with Frame_Reader(video_path, info['width'], info['height']) as reader, \
+                Frame_Writer(output_video, info['width'], info['height'], target_fps,
+                             crf=self.crf, preset=self.preset, audio_source=video_path) as writer:
+            self._stream(iter(reader), info['frame_count'], info['fps'], target_fps, writer)
+        return output_video
+
+
+class RIFE_NCNN_Backend(Interpolation_Backend):
+    """rife-ncnn-vulkan binary; works on frame directories, so it stages frames on disk."""
+    name = "rife-ncnn-vulkan"
+
+    def __init__(self, work_root: Optional[str] = None, model: str = "rife-v4.6",
+                 preset: str = "medium", crf: int = 18):
+        self.work_root = Path(work_root) if work_root else None
+        self.model = model
+        self.preset = preset
+        self.crf = crf
+
+    def is_available(self) -> bool:
+        return shutil.which("rife-ncnn-vulkan") is not None
+
+    def generate_intermediate_frames(self, frames_dir: str, output_dir: str, target_count: int):
+        command = [
+            "rife-ncnn-vulkan",
+            '-i', frames_dir,
+            '-o', output_dir,
+            '-m', self.model,
+            '-n', str(target_count)
+        ]
+
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+            return output_dir
+        except subprocess.CalledProcessError as e:
+            print(f"Error running RIFE: {e.stderr.decode()}")
+            return None
+
+    def _run(self, video_path: str, info: Dict, target_fps: int, tag: str, frame_limit: Optional[int] = None):
+        frame_bytes = info['width'] * info['height'] * 3
+        source_frames = frame_limit or info['frame_count']
+        required_bytes = frame_bytes * source_frames * (1 + target_fps / info['fps'])
+        staging_root = select_staging_root(self.work_root, required_bytes)
+
+        frames = Image_Sequence_Stage(staging_root / "frame_pairs" / tag, "bmp")
+        output_dir = staging_root / "intermediate_frames" / tag
+        frames.cleanup()
+        shutil.rmtree(output_dir, ignore_errors=True)
+        frames.directory.mkdir(parents=True, exist_ok=True)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        source_count = frames.extract(video_path, frame_limit)
+        target_count = int(round(source_count * target_fps / info['fps']))
+        result = self.generate_intermediate_frames(str(frames.directory), str(output_dir), target_count)
+        frames.cleanup()
+        if result is None:
+            raise RuntimeError("rife-ncnn-vulkan failed")
+        return output_dir, target_count
+
+    def interpolate(self, video_path: str, output_video: str, info: Dict, target_fps: int) -> str:
+        output_dir, _ = self._run(video_path, info, target_fps, Path(video_path).stem)
+
+        command = [
+            "ffmpeg",
+            "-framerate", str(target_fps),
+            "-i", str(output_dir / "%08d.png"),
+            "-c:v", "libx264",
+            "-preset", self.preset,
+            "-crf", str(self.crf),
+            "-pix_fmt", "yuv420p",
+            output_video
+        ]
+
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+            return output_video
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Video encoding error: {e.stderr.decode()}")
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def cut_sample_clip(video_path: str, output_path: str, frames: int = THROUGHPUT_SAMPLE_FRAMES) -> str:
+    """Stream-copies the first frames of the video track into a clip for throughput runs."""
+    command = [
+        "ffmpeg",
+        "-v", "error",
+        "-y",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-frames:v", str(frames),
+        "-c", "copy",
+        output_path
+    ]
+
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Sample clip error: {e.stderr.decode()}")
+    return output_path
+
+
+class Backend_Throughput_Cache:
+    """Measured end-to-end interpolation speed per backend, resolution and frame rates on this host.
+
+    Stored in a JSON file shared by all hosts, keyed by host name and CPU
+    count, like the x264 preset calibration.
+    """
+
+    def __init__(self, cache_path: Optional[Path] = None):
+        script_dir = Path(__file__).parent
+        self.cache_path = Path(cache_path) if cache_path else script_dir / "interpolation_results" / "backend_throughput.json"
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.host = host_key()
+        self.measurements = self._load().get(self.host, {})
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get('version') != THROUGHPUT_VERSION:
+            return {}
+        return cache.get('hosts', {})
+
+    def _save(self):
+        # Re-read first so that measurements written by other hosts are kept
+        hosts = self._load()
+        hosts[self.host] = self.measurements
+        temp_path = self.cache_path.parent / f".{self.cache_path.name}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'version': THROUGHPUT_VERSION, 'hosts': hosts}, f, indent=4)
+        os.replace(temp_path, self.cache_path)
+
+    @staticmethod
+    def key(backend_name: str, info: Dict, target_fps: int) -> str:
+        return f"{backend_name}@{info['width']}x{info['height']}:{info['fps']:.3f}->{target_fps}"
+
+    def get(self, key: str) -> Optional[float]:
+        return self.measurements.get(key)
+
+    def put(self, key: str, fps: float):
+        self.measurements[key] = fps
+        self._save()
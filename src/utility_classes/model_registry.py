@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import torch
+import whisper
+from whisper.model import Linear as WhisperLinear
+from whisper.model import ModelDimensions, Whisper
+
+
+def _checkpoint_path(model_size: str, download_root: Optional[str] = None) -> Optional[Tuple[str, Optional[bytes]]]:
+    """Resolves a model name or checkpoint file to a local path and its alignment heads.
+
+    Named models are fetched with whisper's download helpers, which are not
+    part of its public API; None is returned when they are missing or have
+    changed so the caller can fall back to whisper.load_model.
+    """
+    if model_size in whisper.available_models():
+        models = getattr(whisper, "_MODELS", None)
+        download = getattr(whisper, "_download", None)
+        alignment_heads = getattr(whisper, "_ALIGNMENT_HEADS", None) or {}
+        if not isinstance(models, dict) or model_size not in models or not callable(download):
+            return None
+        if download_root is None:
+            default = os.path.join(os.path.expanduser("~"), ".cache")
+            download_root = os.path.join(os.getenv("XDG_CACHE_HOME", default), "whisper")
+        try:
+            path = download(models[model_size], download_root, False)
+        except TypeError:
+            return None
+        return path, alignment_heads.get(model_size)
+    if os.path.isfile(model_size):
+        return model_size, None
+    raise RuntimeError(f"Model {model_size} not found; available models = {whisper.available_models()}")
+
+
+def load_whisper_mmap(model_size: str, device: str = "cpu", download_root: Optional[str] = None) -> Whisper:
+    """Loads a Whisper checkpoint with its weights memory-mapped from disk.
+
+    The mapped tensors are assigned into the module in place of its freshly
+    initialised parameters, so on CPU the weights stay file-backed page cache
+    pages that forked workers share instead of each holding a private copy.
+    Falls back to a regular whisper.load_model when the checkpoint file of a
+    named model cannot be located.
+    """
+    resolved = _checkpoint_path(model_size, download_root)
+    if resolved is None:
+        print(f"WARNING: cannot locate the {model_size} checkpoint for memory mapping, loading it normally")
+        return whisper.load_model(model_size, device=device, download_root=download_root)
+    path, alignment_heads = resolved
+    checkpoint = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+    dims = ModelDimensions(**checkpoint["dims"])
+    model = Whisper(dims)
+    model.load_state_dict(checkpoint["model_state_dict"], assign=True)
+    if alignment_heads is not None:
+        model.set_alignment_heads(alignment_heads)
+
+    return model.to(device)
+
+
+def quantize_whisper_int8(model: Whisper) -> Whisper:
+    """Dynamic int8 quantization of every Linear layer, for CPU inference.
+
+    Whisper's Linear subclass only adds a dtype cast, but quantize_dynamic
+    matches exact types, so the layers are swapped for plain nn.Linear
+    sharing the same weights first.
+    """
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if type(child) is WhisperLinear:
+                plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                plain.weight = child.weight
+                plain.bias = child.bias
+                setattr(module, name, plain)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class Whisper_Model_Registry:
+    """Process-wide cache of loaded Whisper models keyed on (model_size, device, dtype).
+
+    Models are loaded on first use and kept warm between jobs; a model that
+    has not been acquired for idle_timeout seconds is dropped by a daemon
+    sweeper thread. idle_timeout=None keeps models until clear().
+    """
+
+    def __init__(self, idle_timeout: Optional[float] = 600.0, mmap_weights: bool = False,
+                 download_root: Optional[str] = None):
+        self.idle_timeout = idle_timeout
+        self.mmap_weights = mmap_weights
+        self.download_root = download_root
+        self._models: Dict[Tuple[str, str, str], Dict] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def _load(self, model_size: str, device: str, dtype: str):
+        if self.mmap_weights:
+            model = load_whisper_mmap(model_size, device=device, download_root=self.download_root)
+        else:
+            model = whisper.load_model(model_size, device=device, download_root=self.download_root)
+        if dtype == "float16":
+            model = model.half()
+        elif dtype == "int8":
+            if device != "cpu":
+                raise ValueError("int8 Whisper models are only supported on cpu")
+            model = quantize_whisper_int8(model)
+        return model
+
+    def acquire(self, model_size: str, device: str = "cpu", dtype: str = "float32"):
+        key = (model_size, device, dtype)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                entry['last_used'] = time.monotonic()
+                return entry['model']
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Loads of different keys may overlap; concurrent loads of one key collapse into one
+        with key_lock:
+            with self._lock:
+                entry = self._models.get(key)
+            if entry is None:
+                print(f"Loading Whisper model ({model_size}, {device}, {dtype})...")
+                model = self._load(model_size, device, dtype)
+                entry = {'model': model, 'last_used': time.monotonic()}
+                with self._lock:
+                    self._models[key] = entry
+                self._start_sweeper()
+            else:
+                entry['last_used'] = time.monotonic()
+        return entry['model']
+
+    def preload(self, model_sizes: Iterable[str], device: str = "cpu", dtype: str = "float32"):
+        for model_size in model_sizes:
+            self.acquire(model_size, device, dtype)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def evict_idle(self, now: Optional[float] = None):
+        if self.idle_timeout is None:
+            return []
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [key for key, entry in self._models.items()
+                       if now - entry['last_used'] > self.idle_timeout]
+            for key in expired:
+                del self._models[key]
+        for key in expired:
+            print(f"Evicted idle Whisper model {key}")
+        if expired and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return expired
+
+    def _sweep(self):
+        interval = max(min(self.idle_timeout / 4, 60.0), 1.0)
+        while not self._stop.wait(interval):
+            self.evict_idle()
+
+    def _start_sweeper(self):
+        if self.idle_timeout is None or (self._sweeper is not None and self._sweeper.is_alive()):
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep, name="whisper-registry-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def clear(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        with self._lock:
+            self._models.clear()
+            self._key_locks.clear()
+
+
+_registry = Whisper_Model_Registry(
+    idle_timeout=float(os.getenv("LUCERA_WHISPER_IDLE_TIMEOUT", "600")),
+    mmap_weights=os.getenv("LUCERA_WHISPER_MMAP", "0") == "1"
+)
+
+
+def get_model_registry() -> Whisper_Model_Registry:
+    return _registry
@@ -0,0 +1,414 @@
+import datetime
+import hashlib
+import hmac
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MIB = 1024 * 1024
+# S3 rejects multipart parts (other than the last) smaller than 5 MiB
+MIN_PART_SIZE = 5 * MIB
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mpd": "application/dash+xml",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".vtt": "text/vtt",
+    ".srt": "application/x-subrip",
+    ".json": "application/json",
+    ".txt": "text/plain",
+    ".png": "image/png"
+}
+
+PLAYLIST_SUFFIXES = (".m3u8", ".mpd")
+
+
+def join_key(*parts: str) -> str:
+    return "/".join(part.strip("/") for part in parts if part and part.strip("/"))
+
+
+def content_type(path: str) -> str:
+    return CONTENT_TYPES.get(Path(path).suffix.lower(), "application/octet-stream")
+
+
+def sigv4_authorization(method: str, path: str, query_string: str, headers: Dict[str, str], payload_hash: str,
+                        access_key: str, secret_key: str, region: str, service: str = "s3") -> str:
+    """Authorization header value for an AWS Signature Version 4 request.
+
+    headers are the lower-cased headers to sign and must include host and
+    x-amz-date; path and query_string are already URI-encoded.
+    """
+    amz_date = headers['x-amz-date']
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    signed_headers = ";".join(sorted(headers))
+    canonical_request = "\n".join([
+        method,
+        path,
+        query_string,
+        "".join(f"{name}:{headers[name].strip()}\n" for name in sorted(headers)),
+        signed_headers,
+        payload_hash
+    ])
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256",
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+    key = f"AWS4{secret_key}".encode('utf-8')
+    for part in (amz_date[:8], region, service, "aws4_request"):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed_headers}, Signature={signature}"
+
+
+class Output_Sink:
+    """Destination that finished outputs are published to, under slash-separated keys.
+
+    Uploads run on a thread pool, so callers hand files over as soon as
+    they are complete and keep working.
+    """
+
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="output-sink")
+
+    def put_file(self, local_path: str, key: str):
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def submit(self, local_path: str, key: str) -> Future:
+        return self._executor.submit(self.put_file, str(local_path), key)
+
+    def put_files(self, files: List[Tuple[str, str]]):
+        """Uploads (local_path, key) pairs concurrently, raising the first failure once all have finished."""
+        futures = [self.submit(local_path, key) for local_path, key in files]
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+
+    def publish_directory(self, local_dir: str, prefix: str) -> List[str]:
+        files = [(str(path), join_key(prefix, path.relative_to(local_dir).as_posix()))
+                 for path in sorted(Path(local_dir).rglob("*")) if path.is_file()]
+        self.put_files(files)
+        return [key for _, key in files]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class Local_Sink(Output_Sink):
+    """Publishes into a local directory; each file appears atomically under its final name."""
+
+    def __init__(self, root: str, workers: int = 4):
+        super().__init__(workers)
+        self.root = Path(root)
+
+    def put_file(self, local_path: str, key: str):
+        destination = self.root / key
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = destination.parent / f".{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copy2(local_path, temp_path)
+        os.replace(temp_path, destination)
+
+    def url(self, key: str) -> str:
+        return str(self.root / key)
+
+
+class S3_Sink(Output_Sink):
+    """Publishes to an S3-compatible bucket (AWS S3, MinIO, Ceph RGW, ...).
+
+    Requests are signed with Signature Version 4 and use path-style
+    addressing, which every S3-compatible server accepts. All uploads share
+    one pooled HTTP session; files of multipart_threshold bytes or more are
+    sent as multipart uploads whose parts go up concurrently. Endpoint,
+    region and credentials default to the usual AWS_* environment variables.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, access_key: Optional[str] = None,
+                 secret_key: Optional[str] = None, session_token: Optional[str] = None,
+                 workers: int = 8, part_size: int = 8 * MIB, multipart_threshold: int = 16 * MIB,
+                 timeout: float = 60.0, retries: int = 3):
+        super().__init__(workers)
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.region = region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-1"
+        self.endpoint_url = (endpoint_url or os.environ.get("AWS_ENDPOINT_URL")
+                             or f"https://s3.{self.region}.amazonaws.com").rstrip("/")
+        self.host = urlparse(self.endpoint_url).netloc
+        self.access_key = access_key or os.environ.get("AWS_ACCESS_KEY_ID")
+        self.secret_key = secret_key or os.environ.get("AWS_SECRET_ACCESS_KEY")
+        self.session_token = session_token or os.environ.get("AWS_SESSION_TOKEN")
+        if not self.access_key or not self.secret_key:
+            raise ValueError("S3 credentials missing: set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
+        self.part_size = part_size
+        self.multipart_threshold = max(multipart_threshold, part_size)
+        self.timeout = timeout
+
+        # File uploads and multipart parts run on separate pools, so a file never waits on its own pool
+        self._parts = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="output-sink-part")
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers * 2, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _object_key(self, key: str) -> str:
+        return join_key(self.prefix, key)
+
+    def _request(self, method: str, key: str, query: Optional[Dict[str, str]] = None, body: bytes = b"",
+                 headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        path = "/" + quote(f"{self.bucket}/{self._object_key(key)}", safe="/~")
+        query_string = "&".join(f"{quote(name, safe='~')}={quote(value, safe='~')}"
+                                for name, value in sorted((query or {}).items()))
+        payload_hash = hashlib.sha256(body).hexdigest()
+        signed = {name.lower(): value for name, value in (headers or {}).items()}
+        signed.update({
+            'host': self.host,
+            'x-amz-date': datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+            'x-amz-content-sha256': payload_hash
+        })
+        if self.session_token:
+            signed['x-amz-security-token'] = self.session_token
+        authorization = sigv4_authorization(method, path, query_string, signed, payload_hash,
+                                            self.access_key, self.secret_key, self.region)
+        url = f"{self.endpoint_url}{path}" + (f"?{query_string}" if query_string else "")
+        try:
+            response = self.session.request(method, url, data=body, headers={**signed, 'authorization': authorization},
+                                            timeout=self.timeout)
+        except requests.RequestException as e:
+            raise RuntimeError(f"S3 {method} error for {key}: {e}")
+        # CompleteMultipartUpload can fail after a 200 status line, with the error in the body
+        if response.status_code >= 300 or (method == "POST" and b"<Error>" in response.content):
+            raise RuntimeError(f"S3 {method} error for {key}: {response.status_code} {response.text[:500]}")
+        return response
+
+    @staticmethod
+    def _xml_value(content: bytes, tag: str) -> str:
+        for element in ET.fromstring(content).iter():
+            if element.tag.rsplit("}", 1)[-1] == tag:
+                return element.text or ""
+        raise RuntimeError(f"S3 response without {tag}: {content[:500]!r}")
+
+    def put_file(self, local_path: str, key: str):
+        size = os.path.getsize(local_path)
+        headers = {'content-type': content_type(local_path)}
+        if size < self.multipart_threshold:
+            with open(local_path, 'rb') as f:
+                self._request("PUT", key, body=f.read(), headers=headers)
+        else:
+            self._multipart_upload(local_path, key, size, headers)
+
+    def _upload_part(self, local_path: str, key: str, upload_id: str, number: int, offset: int) -> str:
+        with open(local_path, 'rb') as f:
+            f.seek(offset)
+            body = f.read(self.part_size)
+        response = self._request("PUT", key, {'partNumber': str(number), 'uploadId': upload_id}, body=body)
+        return response.headers['ETag']
+
+    def _multipart_upload(self, local_path: str, key: str, size: int, headers: Dict[str, str]):
+        response = self._request("POST", key, {'uploads': ""}, headers=headers)
+        upload_id = self._xml_value(response.content, "UploadId")
+        futures = [self._parts.submit(self._upload_part, local_path, key, upload_id, number, offset)
+                   for number, offset in enumerate(range(0, size, self.part_size), start=1)]
+        wait(futures)
+        try:
+            etags = [future.result() for future in futures]
+            body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(etags, start=1)
+            ) + "</CompleteMultipartUpload>"
+            self._request("POST", key, {'uploadId': upload_id}, body=body.encode('utf-8'))
+        except RuntimeError:
+            # Without an abort the uploaded parts stay billed in the bucket
+            try:
+                self._request("DELETE", key, {'uploadId': upload_id})
+            except RuntimeError:
+                pass
+            raise
+
+    def url(self, key: str) -> str:
+        return f"{self.endpoint_url}/{self.bucket}/{self._object_key(key)}"
+
+    def close(self):
+        super().close()
+        self._parts.shutdown(wait=True)
+        self.session.close()
+
+
+def create_sink(target: str, **options) -> Output_Sink:
+    """Sink for an output target: s3://bucket/prefix for S3-compatible storage, anything else a local directory."""
+    parsed = urlparse(target)
+    if parsed.scheme == "s3":
+        return S3_Sink(parsed.netloc, parsed.path, **options)
+    return Local_Sink(target, **options)
+
+
+class Package_Publisher:
+    """Publishes an HLS package to a sink while ffmpeg is still writing it.
+
+    A background thread polls the package directory. With live_segments the
+    packager runs ffmpeg with temp_file, which writes each segment under a
+    .tmp name and renames it once complete, so every segment under its
+    final name is uploaded on sight. EVENT playlists are uploaded after the
+    media they list, and the master once all of its media playlists are
+    online, so the published package never references a missing object.
+    VOD playlists follow once ffmpeg has written them with EXT-X-ENDLIST.
+    finish() uploads whatever is left (single-file media, DASH manifests,
+    anything that changed since), manifests last.
+    """
+
+    # Written next to the segments but not part of what players fetch
+    SKIP_NAMES = {"segment_index.json"}
+
+    def __init__(self, sink: Output_Sink, package_dir: str, prefix: str, live_segments: bool = True,
+                 poll_interval: float = 0.5):
+        self.sink = sink
+        self.package_dir = Path(package_dir)
+        self.prefix = prefix
+        self.live_segments = live_segments
+        self.poll_interval = poll_interval
+        self.uploaded: Dict[str, Tuple[int, int]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot_dir = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="package-publisher", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.sweep()
+            except (OSError, RuntimeError) as e:
+                # Whatever failed is retried by the next sweep or by finish()
+                print(f"  Live publishing error: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._snapshot_dir is not None:
+            shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+            self._snapshot_dir = None
+
+    def finish(self) -> Dict:
+        self.stop()
+        self.sweep(final=True)
+        print(f"Published {len(self.uploaded)} files to {self.sink.url(self.prefix)}")
+        return {
+            'files': len(self.uploaded),
+            'master_url': self.sink.url(join_key(self.prefix, "master.m3u8"))
+        }
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        for path in self.package_dir.rglob("*"):
+            relative = path.relative_to(self.package_dir)
+            if (any(part.startswith(".") for part in relative.parts) or path.suffix == ".tmp"
+                    or path.name in self.SKIP_NAMES):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.is_file():
+                files[relative.as_posix()] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def _publish(self, files: List[Tuple[str, str, Tuple[int, int]]]):
+        """Uploads (relative, local_path, state) entries, recording each one that lands."""
+        futures = [(relative, state, self.sink.submit(local_path, join_key(self.prefix, relative)))
+                   for relative, local_path, state in files]
+        wait([future for _, _, future in futures])
+        error = None
+        for relative, state, future in futures:
+            if future.exception() is None:
+                self.uploaded[relative] = state
+            elif error is None:
+                error = future.exception()
+        if error is not None:
+            raise error
+
+    def _references(self, relative: str, content: str) -> List[str]:
+        base = posixpath.dirname(relative)
+        uris = []
+        for line in content.splitlines():
+            if 'URI="' in line:
+                uris.append(line.split('URI="', 1)[1].split('"', 1)[0])
+            elif line and not line.startswith("#"):
+                uris.append(line)
+        return [posixpath.normpath(posixpath.join(base, uri)) for uri in uris]
+
+    def _snapshot(self, relative: str) -> Tuple[str, str]:
+        # Playlists are uploaded as read, so a rewrite after the check cannot slip in unpublished segments
+        with open(self.package_dir / relative) as f:
+            content = f.read()
+        if self._snapshot_dir is None:
+            self._snapshot_dir = Path(tempfile.mkdtemp(prefix="lucera_publish_"))
+        snapshot = self._snapshot_dir / relative.replace("/", "__")
+        snapshot.write_text(content)
+        return content, str(snapshot)
+
+    def sweep(self, final: bool = False):
+        files = self._scan()
+        changed = {relative: state for relative, state in files.items() if self.uploaded.get(relative) != state}
+        media = [relative for relative in changed if not relative.endswith(PLAYLIST_SUFFIXES)]
+        playlists = [relative for relative in changed if relative.endswith(PLAYLIST_SUFFIXES)]
+
+        if final:
+            self._publish([(relative, str(self.package_dir / relative), changed[relative]) for relative in media])
+            # Media playlists before the manifests at the package root that point at them
+            for depth in sorted({relative.count("/") for relative in playlists}, reverse=True):
+                self._publish([(relative, str(self.package_dir / relative), changed[relative])
+                               for relative in playlists if relative.count("/") == depth])
+            return
+
+        if not self.live_segments:
+            return
+        self._publish([(relative, str(self.package_dir / relative), changed[relative]) for relative in media
+                       if not Path(relative).name.startswith("init")])
+
+        masters = {}
+        for relative in files:
+            if "/" not in relative and relative.endswith(".m3u8"):
+                masters[relative] = self._snapshot(relative)
+        # Only the playlists a master points at; chunk playlists of parallel encodes are transient
+        wanted = {reference for master, (content, _) in masters.items()
+                  for reference in self._references(master, content)}
+        for relative in sorted(wanted & set(playlists)):
+            content, snapshot = self._snapshot(relative)
+            if "#EXT-X-PLAYLIST-TYPE:EVENT" not in content and "#EXT-X-ENDLIST" not in content:
+                continue
+            # Listed media is complete, including the init segments left out above
+            references = self._references(relative, content)
+            self._publish([(reference, str(self.package_dir / reference), files[reference])
+                           for reference in references if reference not in self.uploaded and reference in files])
+            if all(reference in self.uploaded for reference in references):
+                self._publish([(relative, snapshot, changed[relative])])
+        for relative, (content, snapshot) in masters.items():
+            if relative in changed and all(reference in self.uploaded
+                                           for reference in self._references(relative, content)):
+                self._publish([(relative, snapshot, changed[relative])])
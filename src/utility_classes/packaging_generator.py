@@ -1,34 +1,156 @@
 import subprocess
 from pathlib import Path
-from typing import Dict, List, Tuple
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
 import datetime
 import hashlib
 import json
+import math
 import os
+import re
+
+from .bitrate_ladder import Bitrate_Ladder_Generator
+from .frame_io import probe_audio, probe_has_audio, probe_video
+from .hls_metrics import cmaf_codecs, combine_measurements, measure_media_playlist, parse_media_playlist
+from .output_sinks import Output_Sink, Package_Publisher, join_key
+from .preset_scheduler import Preset_Scheduler
+from .segment_encoder import (
+    TS_OFFSET_PAD,
+    Segment_Parallel_Encoder,
+    force_keyframe_args,
+    plan_segment_starts,
+    read_media_playlist,
+    write_media_playlist,
+)
+from .segment_index import Segment_Hash_Index, encode_params_hash, source_segment_hashes
 
 
 class HLS_Packaging_Generator:
     
-    def __init__(self, video_path: str):
+    # Applied by the mezzanine encode, or inline ahead of the ladder when no mezzanine is written
+    ENHANCEMENT_FILTER = "scale=1920:1080:flags=lanczos,unsharp=5:5:1.0:5:5:0.0,fps=60"
+    
+    ENCODING_PROFILES = [
+        {'resolution': '1920x1080', 'bitrate': '5000k', 'name': '1080p'},
+        {'resolution': '1280x720', 'bitrate': '2800k', 'name': '720p'},
+        {'resolution': '854x480', 'bitrate': '1400k', 'name': '480p'},
+        {'resolution': '640x360', 'bitrate': '800k', 'name': '360p'}
+    ]
+    
+    # Rate assumed for a stream whose probe reports none
+    FALLBACK_FPS = 30.0
+    
+    def __init__(self, video_path: str, single_pass: bool = True, ffmpeg_master_playlist: bool = False,
+                 write_mezzanine: bool = False, segment_parallel: bool = False,
+                 segment_workers: Optional[int] = None, segment_queue_dir: Optional[str] = None,
+                 content_aware: bool = False, analysis_metrics: Optional[Dict] = None, cmaf: bool = False,
+                 incremental: bool = False, shared_audio: bool = True, audio_source: Optional[str] = None,
+                 single_file: bool = False, scheduler: Optional[Preset_Scheduler] = None,
+                 scene_keyframes: bool = True, min_segment: float = 2.0, max_segment: float = 10.0,
+                 min_scene_score: float = 0.3, output_sink: Optional[Output_Sink] = None,
+                 ladder_source: Optional[str] = None):
         self.video_path = video_path
         path = Path(video_path)
         self.video_name = path.stem
         self.video_format = path.suffix
         
+        # single_pass decodes the source once for the whole ladder
+        self.single_pass = single_pass
+        self.ffmpeg_master_playlist = ffmpeg_master_playlist
+        self.write_mezzanine = write_mezzanine
+        # segment_parallel encodes GOP-aligned time chunks on a shared work queue
+        self.segment_parallel = segment_parallel
+        self.segment_workers = segment_workers
+        self.segment_queue_dir = segment_queue_dir
+        # content_aware replaces the fixed ladder with one sized to the source and its content
+        self.content_aware = content_aware
+        self.analysis_metrics = analysis_metrics
+        # ladder_source is the original video whose resolution caps that ladder; defaults to the
+        # packaged video (the pipeline passes the original, since it packages the upscaled output)
+        self.ladder_source = ladder_source
+        # cmaf writes fMP4 segments that both the HLS and the DASH manifests point at
+        self.cmaf = cmaf
+        # incremental re-encodes only the segments whose source frames or encode settings changed
+        self.incremental = incremental
+        # shared_audio encodes audio once as an EXT-X-MEDIA rendition and keeps the ladder video-only;
+        # audio_source defaults to the ladder input (the pipeline passes the original video)
+        self.shared_audio = shared_audio
+        self.audio_source = audio_source
+        # single_file writes each rendition as one media file addressed through EXT-X-BYTERANGE
+        self.single_file = single_file
+        # scheduler picks the merge, mezzanine and ladder presets from the job's deadline
+        self.scheduler = scheduler
+        self.ladder_preset = "medium"
+        # ladder_fps sizes the ladder's GOPs; plan_ladder_preset sets it from the probed ladder input
+        self.ladder_fps = self.filter_frame_rate(self.ENHANCEMENT_FILTER)
+        # scene_keyframes starts a segment on every rung at each analysed scene cut (score >= min_scene_score),
+        # keeping segment durations between min_segment and max_segment
+        self.scene_keyframes = scene_keyframes
+        self.min_segment = min_segment
+        self.max_segment = max_segment
+        self.min_scene_score = min_scene_score
+        self.segment_starts = None
+        # output_sink receives the package while it is encoded, each segment as soon as ffmpeg closes it
+        self.output_sink = output_sink
+        
         script_dir = Path(__file__).parent
         self.hls_root = script_dir / "hls_results"
         self.hls_root.mkdir(exist_ok=True)
         
-        self.encoding_profiles = [
-            {'resolution': '1920x1080', 'bitrate': '5000k', 'name': '1080p'},
-            {'resolution': '1280x720', 'bitrate': '2800k', 'name': '720p'},
-            {'resolution': '854x480', 'bitrate': '1400k', 'name': '480p'},
-            {'resolution': '640x360', 'bitrate': '800k', 'name': '360p'}
-        ]
+        self.encoding_profiles = [dict(profile) for profile in self.ENCODING_PROFILES]
         
         print("video name:", self.video_name)
         print("HLS packaging initialized")
     
+    @staticmethod
+    def profile_resolutions(profiles: List[Dict]) -> List[Tuple[int, int]]:
+        return [tuple(int(value) for value in profile['resolution'].split('x')) for profile in profiles]
+    
+    def _scheduled_preset(self, step: str, resolutions: List[Tuple[int, int]], frames: int, default: str) -> str:
+        if self.scheduler is None:
+            return default
+        return self.scheduler.preset_for(step, resolutions, frames, default)
+    
+    @staticmethod
+    def filter_frame_rate(video_filter: Optional[str]) -> Optional[float]:
+        """The rate an fps= filter in video_filter resamples to, or None when it keeps the input's."""
+        match = re.search(r"(?:^|,)fps=(?:fps=)?([0-9./]+)", video_filter or "")
+        return float(Fraction(match.group(1))) if match else None
+    
+    @classmethod
+    def output_frame_rate(cls, video: str, video_filter: Optional[str] = None) -> float:
+        """Frame rate an encode of video through video_filter delivers."""
+        rate = cls.filter_frame_rate(video_filter)
+        if rate:
+            return rate
+        info = probe_video(video)
+        if info['variable_frame_rate'] and info['duration'] > 0:
+            # r_frame_rate of a VFR stream is its timebase granularity, not how often frames arrive
+            return info['frame_count'] / info['duration']
+        return info['fps'] or cls.FALLBACK_FPS
+    
+    @classmethod
+    def output_frame_count(cls, video: str, video_filter: Optional[str] = None) -> int:
+        return int(probe_video(video)['duration'] * cls.output_frame_rate(video, video_filter))
+    
+    def plan_encodes(self, source_video: str):
+        """Reserves deadline time for the mezzanine and ladder encodes still to come."""
+        # Both encodes see the source through the enhancement filter (the mezzanine's output is 1:1)
+        frames = self.output_frame_count(source_video, self.ENHANCEMENT_FILTER)
+        if self.write_mezzanine:
+            self.scheduler.plan("mezzanine", [(1920, 1080)], frames)
+        self.scheduler.plan("ladder", self.profile_resolutions(self.encoding_profiles), frames)
+    
+    def plan_ladder_preset(self, source_video: str, prefilter: Optional[str] = None) -> str:
+        """Picks the ladder preset and GOP rate for source_video as it arrives through prefilter."""
+        self.ladder_fps = self.output_frame_rate(source_video, prefilter)
+        if self.scheduler is not None:
+            frames = int(probe_video(source_video)['duration'] * self.ladder_fps)
+            self.ladder_preset = self.scheduler.preset_for(
+                "ladder", self.profile_resolutions(self.encoding_profiles), frames, self.ladder_preset
+            )
+        return self.ladder_preset
+    
     def ffmpeg_merge(self, video_sources: List[str]):
         merge_dir = self.hls_root / "merged_output"
         merge_dir.mkdir(exist_ok=True)
@@ -55,6 +177,14 @@ class HLS_Packaging_Generator:
                 filter_complex += f"[{i}:v]"
             filter_complex += f"concat=n={len(video_sources)}:v=1:a=0[outv]"
             
+            preset = "medium"
+            if self.scheduler is not None:
+                infos = [probe_video(source) for source in video_sources]
+                preset = self._scheduled_preset(
+                    "merge", [(infos[0]['width'], infos[0]['height'])],
+                    sum(info['frame_count'] for info in infos), preset
+                )
+            
             command = ["ffmpeg"]
             for source in video_sources:
                 command.extend(["-i", source])
@@ -62,7 +192,7 @@ class HLS_Packaging_Generator:
                 "-filter_complex", filter_complex,
                 "-map", "[outv]",
                 "-c:v", "libx264",
-                "-preset", "medium",
+                "-preset", preset,
                 "-crf", "18",
                 str(merged_video)
             ])
@@ -82,13 +212,18 @@ class HLS_Packaging_Generator:
         
         print("Creating final enhanced video: 1080p @ 60fps, Clean, Sharp")
         
+        preset = "slow"
+        if self.scheduler is not None:
+            preset = self._scheduled_preset(
+                "mezzanine", [(1920, 1080)], self.output_frame_count(merged_video, self.ENHANCEMENT_FILTER), preset
+            )
+        
         command = [
             "ffmpeg",
             "-i", merged_video,
-            "-vf", "scale=1920:1080:flags=lanczos,unsharp=5:5:1.0:5:5:0.0",
-            "-r", "60",
+            "-vf", self.ENHANCEMENT_FILTER,
             "-c:v", "libx264",
-            "-preset", "slow",
+            "-preset", preset,
             "-crf", "18",
             "-pix_fmt", "yuv420p",
             "-movflags", "+faststart",
@@ -102,6 +237,14 @@ class HLS_Packaging_Generator:
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"Final video creation error: {e.stderr.decode()}")
     
+    def build_content_aware_ladder(self, ladder_input: str, prefilter: Optional[str] = None):
+        print("Building content-aware bitrate ladder...")
+        # Probes read the ladder's own input through the ladder's own prefilter
+        ladder = Bitrate_Ladder_Generator(ladder_input, analysis_metrics=self.analysis_metrics,
+                                          source_video=self.ladder_source, prefilter=prefilter)
+        self.encoding_profiles = ladder.build()
+        return self.encoding_profiles
+    
     def create_hls_package(self, final_video: str):
         hls_dir = self.hls_root / "hls_package" / self.video_name
         hls_dir.mkdir(parents=True, exist_ok=True)
@@ -113,7 +256,312 @@ class HLS_Packaging_Generator:
         
         return str(hls_dir), str(variants_dir)
     
-    def adaptive_bitrate_encoding(self, final_video: str, variants_dir: str):
+    def start_publishing(self, hls_dir: str) -> Optional[Package_Publisher]:
+        if self.output_sink is None:
+            return None
+        # A single-file rendition keeps growing until the encode ends, so it is published afterwards
+        publisher = Package_Publisher(self.output_sink, hls_dir, join_key("hls_package", self.video_name),
+                                      live_segments=not self.single_file)
+        print(f"Publishing package to {self.output_sink.url(publisher.prefix)}")
+        return publisher.start()
+    
+    def plan_segments(self, source_video: str) -> Optional[List[float]]:
+        """Variable segment start times aligned to the analysis scene cuts, or None for fixed 6 s segments."""
+        self.segment_starts = None
+        cuts = [cut['time'] for cut in (self.analysis_metrics or {}).get('scene_cuts', [])
+                if cut['score'] >= self.min_scene_score]
+        if cuts:
+            duration = probe_video(source_video)['duration']
+            self.segment_starts = plan_segment_starts(duration, cuts, 6, self.min_segment, self.max_segment)
+            print(f"Scene-aligned segments: {len(self.segment_starts)} segments from {len(cuts)} scene cuts")
+        return self.segment_starts
+    
+    def adaptive_bitrate_encoding(self, final_video: str, variants_dir: str, prefilter: Optional[str] = None):
+        self.plan_ladder_preset(final_video, prefilter)
+        if self.scene_keyframes:
+            self.plan_segments(final_video)
+        if self.single_file and (self.incremental or self.segment_parallel):
+            # Chunk encodes would each write their own copy of the one media file
+            print("Single-file variants are encoded in one pass; segment-parallel encoding disabled")
+        elif self.incremental:
+            return self.adaptive_bitrate_encoding_incremental(final_video, variants_dir, prefilter)
+        elif self.segment_parallel:
+            return self.adaptive_bitrate_encoding_segmented(final_video, variants_dir, prefilter)
+        if self.single_pass:
+            return self.adaptive_bitrate_encoding_single_pass(final_video, variants_dir, prefilter)
+        return self.adaptive_bitrate_encoding_per_profile(final_video, variants_dir, prefilter)
+    
+    def _chunked_ladder(self) -> bool:
+        # Single-file variants fall back to one pass (see adaptive_bitrate_encoding)
+        return (self.incremental or self.segment_parallel) and not self.single_file
+    
+    def _ladder_filter_graph(self, prefilter: Optional[str] = None) -> str:
+        count = len(self.encoding_profiles)
+        graph = "[0:v]" + (f"{prefilter}," if prefilter else "")
+        graph += f"split={count}" + "".join(f"[v{i}]" for i in range(count))
+        for i, profile in enumerate(self.encoding_profiles):
+            graph += f";[v{i}]scale={profile['resolution']}:flags=lanczos[out{i}]"
+        return graph
+    
+    def build_ladder_command(self, input_args: List[str], variants_dir: str, prefilter: Optional[str],
+                             has_audio: bool, hls_args: Optional[List[str]] = None,
+                             segment_name: str = "segment_%03d.ts", playlist_name: str = "playlist.m3u8",
+                             master_playlist: bool = False, playlist_type: str = "vod",
+                             hls_flags: Optional[List[str]] = None,
+                             keyframe_times: Optional[List[float]] = None) -> List[str]:
+        command = ["ffmpeg", "-v", "error"] + input_args + [
+            "-filter_complex", self._ladder_filter_graph(prefilter)
+        ]
+        stream_map = []
+        for i, profile in enumerate(self.encoding_profiles):
+            command.extend(["-map", f"[out{i}]"])
+            if has_audio:
+                command.extend(["-map", "0:a:0"])
+            bitrate_k = int(profile['bitrate'].replace('k', ''))
+            command.extend([
+                f"-b:v:{i}", profile['bitrate'],
+                f"-maxrate:v:{i}", profile['bitrate'],
+                f"-bufsize:v:{i}", f"{bitrate_k * 2}k"
+            ])
+            stream_map.append(f"v:{i},a:{i},name:{profile['name']}" if has_audio else f"v:{i},name:{profile['name']}")
+        
+        command.extend([
+            "-c:v", "libx264",
+            "-preset", self.ladder_preset,
+            "-pix_fmt", "yuv420p",
+            *self._gop_args(keyframe_times, len(self.encoding_profiles))
+        ])
+        if has_audio:
+            command.extend(["-c:a", "aac", "-b:a", "128k"])
+        else:
+            command.append("-an")
+        command.extend([
+            "-f", "hls",
+            "-hls_time", self._hls_time(),
+            "-hls_playlist_type", playlist_type
+        ])
+        command.extend(hls_args or [])
+        command.extend(self._hls_flag_args(hls_flags))
+        if self.cmaf:
+            command.extend(self._cmaf_args(playlist_name))
+        segment_name = self._segment_name(segment_name)
+        command.extend([
+            "-hls_segment_filename", str(Path(variants_dir) / "%v" / segment_name),
+            "-var_stream_map", " ".join(stream_map)
+        ])
+        if master_playlist:
+            command.extend(["-master_pl_name", "master.m3u8"])
+        command.append(str(Path(variants_dir) / "%v" / playlist_name))
+        return command
+    
+    def _gop_args(self, keyframe_times: Optional[List[float]] = None, stream_count: int = 1) -> List[str]:
+        # One-second GOPs at the rate the ladder encodes, so fixed segments end on a keyframe
+        gop = max(round(self.ladder_fps), 1)
+        if self.segment_starts is None:
+            return ["-g", str(gop), "-sc_threshold", "0", "-keyint_min", str(gop)]
+        # Only forced keyframes may start a GOP (every rung gets the same list), so each starts a segment.
+        # Chunk encodes pass their own chunk-relative keyframes through hls_args instead.
+        args = ["-g", str(math.ceil(self.max_segment + 1) * gop), "-sc_threshold", "0"]
+        if keyframe_times:
+            args.extend(force_keyframe_args(keyframe_times, stream_count))
+        return args
+    
+    def _hls_time(self) -> str:
+        # Forced keyframes are at least min_segment apart, so the muxer cuts at every one of them
+        return "6" if self.segment_starts is None else f"{self.min_segment / 2:g}"
+    
+    def _hls_flag_args(self, hls_flags: Optional[List[str]] = None) -> List[str]:
+        flags = list(hls_flags or [])
+        if self.output_sink is not None and "temp_file" not in flags:
+            # Segments only appear under their final name once complete, which is what the publisher watches for
+            flags.append("temp_file")
+        if self.single_file:
+            # temp_file would leave the byte ranges pointing at the renamed .tmp file
+            flags = [flag for flag in flags if flag != "temp_file"] + ["single_file"]
+        return ["-hls_flags", "+".join(flags)] if flags else []
+    
+    def _segment_name(self, segment_name: str) -> str:
+        if self.single_file:
+            segment_name = "stream.ts"
+        return segment_name.replace(".ts", ".mp4" if self.single_file else ".m4s") if self.cmaf else segment_name
+    
+    def _ladder_has_audio(self, final_video: str) -> bool:
+        return not self.shared_audio and probe_has_audio(final_video)
+    
+    def _cmaf_args(self, playlist_name: str = "playlist.m3u8") -> List[str]:
+        # Chunked encodes each write their own init segment; %v is only substituted with several variants
+        prefix = "init" if playlist_name == "playlist.m3u8" else f"init_{Path(playlist_name).stem}"
+        if len(self.encoding_profiles) > 1:
+            init_name = f"{prefix}_%v.mp4"
+        else:
+            init_name = f"{prefix}_{self.encoding_profiles[0]['name']}.mp4"
+        return [
+            "-hls_segment_type", "fmp4",
+            "-hls_fmp4_init_filename", init_name
+        ]
+    
+    def _variant_info(self, variants_dir: str, encoded: bool = True) -> List[Dict]:
+        variant_info = []
+        for profile in self.encoding_profiles:
+            variant_info.append({
+                'name': profile['name'],
+                'resolution': profile['resolution'],
+                'bitrate': profile['bitrate'],
+                'playlist': str(Path(variants_dir) / profile['name'] / "playlist.m3u8")
+            })
+            if encoded:
+                print(f"  ✓ {profile['name']} encoded")
+        return variant_info
+    
+    def adaptive_bitrate_encoding_single_pass(self, final_video: str, variants_dir: str,
+                                              prefilter: Optional[str] = None):
+        print("Encoding adaptive bitrate ladder (single pass)...")
+        
+        command = self.build_ladder_command(
+            ["-i", final_video], variants_dir, prefilter, self._ladder_has_audio(final_video),
+            master_playlist=self.ffmpeg_master_playlist, keyframe_times=self.segment_starts
+        )
+        
+        print(f"  Encoding {len(self.encoding_profiles)} rungs from one decode...")
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Ladder encoding error: {e.stderr.decode()}")
+        
+        return self._variant_info(variants_dir)
+    
+    def adaptive_bitrate_encoding_segmented(self, final_video: str, variants_dir: str,
+                                            prefilter: Optional[str] = None):
+        print("Encoding adaptive bitrate ladder (segment parallel)...")
+        
+        has_audio = self._ladder_has_audio(final_video)
+        
+        def build_command(input_args, hls_args, segment_name, playlist_name):
+            return self.build_ladder_command(
+                input_args, variants_dir, prefilter, has_audio,
+                hls_args=hls_args, segment_name=segment_name, playlist_name=playlist_name
+            )
+        
+        encoder = Segment_Parallel_Encoder(
+            final_video,
+            variants_dir,
+            [profile['name'] for profile in self.encoding_profiles],
+            probe_video(final_video)['duration'],
+            build_command,
+            workers=self.segment_workers,
+            queue_dir=self.segment_queue_dir,
+            segment_starts=self.segment_starts
+        )
+        encoder.encode()
+        
+        return self._variant_info(variants_dir)
+    
+    def adaptive_bitrate_encoding_incremental(self, final_video: str, variants_dir: str,
+                                              prefilter: Optional[str] = None):
+        """Segment-parallel encode that only re-encodes segments whose inputs changed.
+
+        Each segment's source frames are hashed and compared with the index
+        written by the previous run. Changed segments are re-encoded under a
+        new generation suffix, so the old files stay valid until each
+        playlist is atomically replaced, and are deleted afterwards.
+        """
+        print("Encoding adaptive bitrate ladder (incremental)...")
+        
+        has_audio = self._ladder_has_audio(final_video)
+        variant_names = [profile['name'] for profile in self.encoding_profiles]
+        params_hash = encode_params_hash({
+            'command': self.build_ladder_command(["-i", "SOURCE"], ".", prefilter, has_audio,
+                                                 keyframe_times=self.segment_starts)
+        })
+        
+        index_store = Segment_Hash_Index(Path(variants_dir) / "segment_index.json")
+        index = index_store.load()
+        print("  Hashing source frames...")
+        segment_hashes = source_segment_hashes(final_video, 6, self.segment_starts)
+        changed = Segment_Hash_Index.changed_segments(index, params_hash, segment_hashes, variant_names)
+        
+        if changed == []:
+            print("  No segments changed, reusing existing package")
+            return self._variant_info(variants_dir)
+        
+        generation = index['generation'] + 1 if index else 0
+        
+        def build_command(input_args, hls_args, segment_name, playlist_name):
+            return self.build_ladder_command(
+                input_args, variants_dir, prefilter, has_audio,
+                hls_args=hls_args, segment_name=segment_name, playlist_name=playlist_name
+            )
+        
+        encoder = Segment_Parallel_Encoder(
+            final_video,
+            variants_dir,
+            variant_names,
+            probe_video(final_video)['duration'],
+            build_command,
+            workers=self.segment_workers,
+            queue_dir=self.segment_queue_dir,
+            segment_name=f"segment_%05d_g{generation}.ts",
+            chunk_prefix=f"chunk_g{generation}",
+            segment_starts=self.segment_starts
+        )
+        
+        variants = {}
+        if changed is None:
+            print(f"  Encoding all {len(segment_hashes)} segments")
+            for name, playlist in encoder.encode().items():
+                variants[name] = read_media_playlist(Path(playlist))
+        else:
+            print(f"  Re-encoding {len(changed)} of {len(segment_hashes)} segments")
+            chunks = encoder.plan_segment_runs(changed)
+            encoder.run_chunks(chunks)
+            for name in variant_names:
+                variant_dir = Path(variants_dir) / name
+                entries = index['variants'][name]
+                for chunk in chunks:
+                    chunk_playlist = variant_dir / chunk['playlist']
+                    for offset, entry in enumerate(read_media_playlist(chunk_playlist)):
+                        if chunk['start_number'] + offset < len(entries):
+                            entries[chunk['start_number'] + offset] = entry
+                    chunk_playlist.unlink()
+                write_media_playlist(variant_dir / "playlist.m3u8", entries)
+                variants[name] = entries
+        
+        index_store.save(params_hash, segment_hashes, variants, generation)
+        self._remove_unreferenced_segments(variants_dir, variants)
+        
+        return self._variant_info(variants_dir)
+    
+    def _remove_unreferenced_segments(self, variants_dir: str, variants: Dict[str, List[Dict]]):
+        for name, entries in variants.items():
+            referenced = {entry['uri'] for entry in entries}
+            referenced.update(entry['map'].split('URI="', 1)[1].split('"', 1)[0]
+                              for entry in entries if entry['map'])
+            for path in (Path(variants_dir) / name).iterdir():
+                if path.name.startswith(("segment_", "init_")) and path.name not in referenced:
+                    path.unlink()
+    
+    def relocate_ffmpeg_master(self, hls_dir: str, variants_dir: str):
+        """Moves the master playlist ffmpeg wrote next to the variants up to the package root."""
+        source = Path(variants_dir) / "master.m3u8"
+        master_manifest = Path(hls_dir) / "master.m3u8"
+        prefix = Path(variants_dir).relative_to(hls_dir).as_posix()
+        
+        lines = []
+        with open(source) as f:
+            for line in f.read().splitlines():
+                if line and not line.startswith("#"):
+                    line = f"{prefix}/{line}"
+                lines.append(line)
+        
+        with open(master_manifest, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        source.unlink()
+        
+        print(f"Master manifest saved: {master_manifest}")
+        return str(master_manifest)
+    
+    def adaptive_bitrate_encoding_per_profile(self, final_video: str, variants_dir: str,
+                                              prefilter: Optional[str] = None):
         print("Encoding adaptive bitrate ladder...")
         
         variant_info = []
@@ -124,24 +572,29 @@ class HLS_Packaging_Generator:
             variant_path.mkdir(exist_ok=True)
             
             playlist_name = f"{variant_name}.m3u8"
-            segment_pattern = f"{variant_name}_%03d.ts"
+            segment_pattern = self._segment_name(f"{variant_name}_%03d.ts")
+            segment_args = [
+                "-hls_segment_type", "fmp4",
+                "-hls_fmp4_init_filename", f"init_{variant_name}.mp4"
+            ] if self.cmaf else []
             
             print(f"  Encoding {variant_name} @ {profile['bitrate']}...")
             
             command = [
                 "ffmpeg",
                 "-i", final_video,
-                "-vf", f"scale={profile['resolution']}:flags=lanczos",
+                "-vf", (f"{prefilter}," if prefilter else "") + f"scale={profile['resolution']}:flags=lanczos",
                 "-c:v", "libx264",
                 "-b:v", profile['bitrate'],
                 "-maxrate", profile['bitrate'],
                 "-bufsize", str(int(profile['bitrate'].replace('k', '')) * 2) + 'k',
-                "-preset", "medium",
-                "-g", "60",
-                "-sc_threshold", "0",
-                "-keyint_min", "60",
-                "-hls_time", "6",
+                "-preset", self.ladder_preset,
+                *self._gop_args(self.segment_starts),
+                *([] if self._ladder_has_audio(final_video) else ["-an"]),
+                "-hls_time", self._hls_time(),
                 "-hls_playlist_type", "vod",
+                *self._hls_flag_args(),
+                *segment_args,
                 "-hls_segment_filename", str(variant_path / segment_pattern),
                 str(variant_path / playlist_name)
             ]
@@ -162,26 +615,305 @@ class HLS_Packaging_Generator:
         
         return variant_info
     
-    def generate_master_manifest(self, hls_dir: str, variant_info: List[Dict]):
+    def encode_audio_rendition(self, audio_source: str, hls_dir: str) -> Optional[Dict]:
+        """Encodes the audio once for all rungs, stream-copying it when it is already AAC."""
+        audio = probe_audio(audio_source)
+        if audio is None:
+            print("No audio stream in source, packaging video only")
+            return None
+        
+        audio_dir = Path(hls_dir) / "audio"
+        audio_dir.mkdir(exist_ok=True)
+        copy = audio['codec'] == "aac"
+        
+        print(f"Encoding shared audio rendition ({'stream copy' if copy else 'AAC 128k'})...")
+        
+        command = [
+            "ffmpeg",
+            "-v", "error",
+            "-i", audio_source,
+            "-map", "0:a:0",
+            "-vn"
+        ]
+        command.extend(["-c:a", "copy"] if copy else ["-c:a", "aac", "-b:a", "128k"])
+        if self._chunked_ladder():
+            # Chunk encodes shift every video timestamp by the pad; the audio has to start at the same time
+            command.extend(["-output_ts_offset", str(TS_OFFSET_PAD)])
+        command.extend([
+            "-f", "hls",
+            "-hls_time", "6",
+            "-hls_playlist_type", "vod"
+        ])
+        command.extend(self._hls_flag_args())
+        if self.cmaf:
+            command.extend(["-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init_audio.mp4"])
+        command.extend([
+            "-hls_segment_filename", str(audio_dir / self._segment_name("segment_%03d.ts")),
+            str(audio_dir / "playlist.m3u8")
+        ])
+        
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Audio rendition error: {e.stderr.decode()}")
+        
+        bitrate = audio['bitrate'] if copy and audio['bitrate'] else 128000
+        return {
+            'name': "audio",
+            'bitrate': f"{bitrate // 1000}k",
+            'copied': copy,
+            'playlist': str(audio_dir / "playlist.m3u8")
+        }
+    
+    def generate_master_manifest(self, hls_dir: str, variant_info: List[Dict],
+                                 audio_rendition: Optional[Dict] = None):
+        """Writes master.m3u8, with bandwidths and codecs measured from the media once it exists.
+
+        Before encoding (progressive packaging) only the nominal ladder
+        bitrates are known, and those are written instead.
+        """
         master_manifest = Path(hls_dir) / "master.m3u8"
+        temp_path = Path(hls_dir) / ".master.m3u8.tmp"
         
         print("Generating master manifest (master.m3u8)...")
         
-        with open(master_manifest, 'w') as f:
+        with open(temp_path, 'w') as f:
             f.write("#EXTM3U\n")
-            f.write("#EXT-X-VERSION:3\n\n")
+            f.write(f"#EXT-X-VERSION:{7 if self.cmaf else 4 if self.single_file else 3}\n\n")
+            
+            audio = None
+            if audio_rendition:
+                nominal = int(audio_rendition['bitrate'].replace('k', '')) * 1000
+                audio = measure_media_playlist(audio_rendition['playlist']) or {
+                    'bandwidth': nominal, 'average_bandwidth': nominal, 'codecs': ""
+                }
+                audio_path = Path(audio_rendition['playlist']).relative_to(hls_dir)
+                f.write('#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="default",'
+                        f'DEFAULT=YES,AUTOSELECT=YES,URI="{audio_path}"\n\n')
             
             for variant in variant_info:
-                bandwidth = int(variant['bitrate'].replace('k', '')) * 1000
                 resolution = variant['resolution']
                 playlist_path = Path(variant['playlist']).relative_to(hls_dir)
                 
-                f.write(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={resolution}\n")
+                measured = measure_media_playlist(variant['playlist'])
+                if measured:
+                    measured = combine_measurements(measured, audio)
+                    attributes = (f"BANDWIDTH={measured['bandwidth']},"
+                                  f"AVERAGE-BANDWIDTH={measured['average_bandwidth']}")
+                    if measured['codecs']:
+                        attributes += f',CODECS="{measured["codecs"]}"'
+                else:
+                    bandwidth = int(variant['bitrate'].replace('k', '')) * 1000
+                    attributes = f"BANDWIDTH={bandwidth + (audio['bandwidth'] if audio else 0)}"
+                
+                audio_group = ',AUDIO="audio"' if audio_rendition else ""
+                f.write(f"#EXT-X-STREAM-INF:{attributes},RESOLUTION={resolution}{audio_group}\n")
                 f.write(f"{playlist_path}\n\n")
+        # Replaced atomically, so a publisher never uploads a half-written master
+        os.replace(temp_path, master_manifest)
         
         print(f"Master manifest saved: {master_manifest}")
         return str(master_manifest)
     
+    @staticmethod
+    def _dash_range(byterange: Optional[Tuple[int, int]], attribute: str) -> str:
+        if byterange is None:
+            return ""
+        length, offset = byterange
+        return f' {attribute}="{offset}-{offset + length - 1}"'
+    
+    def _write_segment_list(self, f, prefix: str, run: Dict, segments: List[Tuple]):
+        f.write('        <SegmentList timescale="1000">\n')
+        init_range = self._dash_range(run['init_range'], "range")
+        f.write(f'          <Initialization sourceURL="{prefix}/{run["init"]}"{init_range}/>\n')
+        f.write('          <SegmentTimeline>\n')
+        for duration, _, _ in segments:
+            f.write(f'            <S d="{round(duration * 1000)}"/>\n')
+        f.write('          </SegmentTimeline>\n')
+        for _, uri, byterange in segments:
+            f.write(f'          <SegmentURL media="{prefix}/{uri}"{self._dash_range(byterange, "mediaRange")}/>\n')
+        f.write('        </SegmentList>\n')
+    
+    def generate_dash_manifest(self, hls_dir: str, variant_info: List[Dict],
+                               audio_rendition: Optional[Dict] = None):
+        """Writes an MPD over the fMP4 segments the HLS playlists already reference.
+
+        Each run of segments sharing one init segment becomes a Period
+        (segment-parallel encodes write one init per chunk); rungs are cut
+        at the same GOP-aligned boundaries, so the runs line up across them.
+        The shared audio rendition is one continuous encode, so its segments
+        are assigned to the Period their start time falls in.
+        """
+        dash_manifest = Path(hls_dir) / "manifest.mpd"
+        
+        print("Generating DASH manifest (manifest.mpd)...")
+        
+        groups = {}
+        for variant in variant_info:
+            groups[variant['name']] = parse_media_playlist(variant['playlist'])
+        period_count = min(len(runs) for runs in groups.values())
+        period_durations = [sum(segment[0] for segment in run['segments'])
+                            for run in groups[variant_info[0]['name']][:period_count]]
+        total_duration = sum(period_durations)
+        
+        audio_periods = [[] for _ in range(period_count)]
+        if audio_rendition:
+            audio_run = parse_media_playlist(audio_rendition['playlist'])[0]
+            audio_prefix = Path(audio_rendition['playlist']).parent.relative_to(hls_dir).as_posix()
+            audio_bandwidth = int(audio_rendition['bitrate'].replace('k', '')) * 1000
+            start, period, period_end = 0.0, 0, period_durations[0]
+            for segment in audio_run['segments']:
+                while period < period_count - 1 and start >= period_end - 0.05:
+                    period += 1
+                    period_end += period_durations[period]
+                audio_periods[period].append(segment)
+                start += segment[0]
+        
+        with open(dash_manifest, 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+            f.write('<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" profiles="urn:mpeg:dash:profile:isoff-live:2011" '
+                    f'type="static" mediaPresentationDuration="PT{total_duration:.3f}S" minBufferTime="PT4S">\n')
+            
+            period_start = 0.0
+            for period in range(period_count):
+                f.write(f'  <Period id="{period}" start="PT{period_start:.3f}S">\n')
+                f.write('    <AdaptationSet mimeType="video/mp4" segmentAlignment="true" startWithSAP="1">\n')
+                for variant in variant_info:
+                    run = groups[variant['name']][period]
+                    variant_dir = Path(variant['playlist']).parent
+                    prefix = variant_dir.relative_to(hls_dir).as_posix()
+                    width, height = variant['resolution'].split('x')
+                    bandwidth = int(variant['bitrate'].replace('k', '')) * 1000
+                    codecs = cmaf_codecs(str(variant_dir / run['init']), run['init_range'])
+                    f.write(f'      <Representation id="{variant["name"]}" bandwidth="{bandwidth}" '
+                            f'width="{width}" height="{height}" codecs="{codecs}">\n')
+                    self._write_segment_list(f, prefix, run, run['segments'])
+                    f.write('      </Representation>\n')
+                f.write('    </AdaptationSet>\n')
+                if audio_periods[period]:
+                    f.write('    <AdaptationSet mimeType="audio/mp4" lang="und" segmentAlignment="true">\n')
+                    f.write(f'      <Representation id="audio" bandwidth="{audio_bandwidth}" codecs="mp4a.40.2">\n')
+                    self._write_segment_list(f, audio_prefix, audio_run, audio_periods[period])
+                    f.write('      </Representation>\n')
+                    f.write('    </AdaptationSet>\n')
+                f.write('  </Period>\n')
+                period_start += period_durations[period]
+            f.write('</MPD>\n')
+        
+        print(f"DASH manifest saved: {dash_manifest}")
+        return str(dash_manifest)
+    
+    def create_live_input(self) -> str:
+        """FIFO that the last enhancement stage tees its encoded output into."""
+        live_dir = self.hls_root / "live_inputs"
+        live_dir.mkdir(exist_ok=True)
+        
+        current_time_string = datetime.datetime.now().isoformat()
+        time_bits = current_time_string.encode('utf-8')
+        hash_object = hashlib.sha256(time_bits)
+        current_time_hash = hash_object.hexdigest()[:8]
+        
+        live_path = live_dir / f"{self.video_name}_live_{current_time_hash}.ts"
+        os.mkfifo(live_path)
+        return str(live_path)
+    
+    def close_live_input(self, live_path: str):
+        """Removes the FIFO, releasing a reader that is still waiting for a writer that never came."""
+        try:
+            fd = os.open(live_path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            pass
+        else:
+            os.close(fd)
+        Path(live_path).unlink(missing_ok=True)
+    
+    def _abandon_live_input(self, live_path: str):
+        # A writer blocked opening the FIFO is let through and then sees a broken pipe,
+        # which its tee output ignores; later writers create a plain file instead
+        try:
+            fd = os.open(live_path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            return
+        Path(live_path).unlink(missing_ok=True)
+        os.close(fd)
+    
+    def finalize_event_playlists(self, variant_info: List[Dict]):
+        """Flips finished EVENT playlists to VOD, atomically, so players treat them as complete."""
+        for variant in variant_info:
+            playlist = Path(variant['playlist'])
+            with open(playlist) as f:
+                lines = f.read().splitlines()
+            lines = ["#EXT-X-PLAYLIST-TYPE:VOD" if line == "#EXT-X-PLAYLIST-TYPE:EVENT" else line
+                     for line in lines]
+            if "#EXT-X-ENDLIST" not in lines:
+                lines.append("#EXT-X-ENDLIST")
+            temp_path = playlist.parent / f".{playlist.name}.tmp"
+            with open(temp_path, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(temp_path, playlist)
+    
+    def run_progressive(self, live_path: str, has_audio: bool):
+        """Packages the enhancement output while it is still being encoded.
+        
+        The ladder reads the growing MPEG-TS stream from live_path and
+        publishes EVENT playlists segment by segment; the master manifest is
+        written before the first segment, so playback can start as soon as
+        one segment per rung exists.
+        """
+        print("Starting progressive HLS packaging")
+        print("="*60)
+        
+        hls_dir, variants_dir = self.create_hls_package(live_path)
+        publisher = self.start_publishing(hls_dir)
+        try:
+            if self.content_aware:
+                # The live stream cannot be probed ahead of time; size the ladder from the source
+                self.build_content_aware_ladder(self.video_path, self.ENHANCEMENT_FILTER)
+            variant_info = self._variant_info(variants_dir, encoded=False)
+            self.plan_ladder_preset(self.video_path, self.ENHANCEMENT_FILTER)
+            audio_rendition = None
+            if self.shared_audio and has_audio:
+                # The original audio is already complete, so its rendition is published up front
+                audio_rendition = self.encode_audio_rendition(self.audio_source or self.video_path, hls_dir)
+            master_manifest = self.generate_master_manifest(hls_dir, variant_info, audio_rendition)
+            
+            command = self.build_ladder_command(
+                ["-f", "mpegts", "-i", live_path], variants_dir, self.ENHANCEMENT_FILTER,
+                has_audio and not self.shared_audio,
+                hls_flags=["temp_file"], playlist_type="event"
+            )
+            
+            print("Encoding ladder from the live enhancement stream...")
+            try:
+                subprocess.run(command, check=True, capture_output=True)
+            except subprocess.CalledProcessError as e:
+                self._abandon_live_input(live_path)
+                raise RuntimeError(f"Progressive packaging error: {e.stderr.decode()}")
+            except OSError:
+                self._abandon_live_input(live_path)
+                raise
+            
+            self.finalize_event_playlists(variant_info)
+        except BaseException:
+            if publisher is not None:
+                publisher.stop()
+            raise
+        published = publisher.finish() if publisher is not None else None
+        print("\nPROGRESSIVE HLS PACKAGING COMPLETE!")
+        
+        return {
+            'video_name': self.video_name,
+            'merged_video': None,
+            'final_video': None,
+            'master_manifest': master_manifest,
+            'dash_manifest': None,
+            'variants': self._variant_info(variants_dir),
+            'audio_rendition': audio_rendition,
+            'hls_directory': hls_dir,
+            'published': published,
+            'progressive': True
+        }
+    
     def run_full_analysis(self, video_sources: List[str] = None):
         print("Starting HLS packaging and adaptive bitrate encoding")
         print("="*60)
@@ -190,19 +922,52 @@ class HLS_Packaging_Generator:
             video_sources = [self.video_path]
         
         print("\n[1/5] FFmpeg merge")
-        merged_video = self.ffmpeg_merge(video_sources)
+        if len(video_sources) == 1:
+            print("Single source, no merge needed")
+            merged_video = video_sources[0]
+        else:
+            merged_video = self.ffmpeg_merge(video_sources)
+            # The scene index describes a single source's timeline
+            self.scene_keyframes = False
         
+        # Without a requested mezzanine the enhancement filters run inside the ladder graph
         print("\n[2/5] Creating final enhanced video (1080p @ 60fps)")
-        final_video = self.create_final_enhanced_video(merged_video)
+        if self.scheduler is not None:
+            self.plan_encodes(merged_video)
+        if self.write_mezzanine:
+            final_video = self.create_final_enhanced_video(merged_video)
+            ladder_input, prefilter = final_video, None
+        else:
+            print("Mezzanine not requested, filtering inline in the ladder encode")
+            final_video = None
+            ladder_input, prefilter = merged_video, self.ENHANCEMENT_FILTER
         
         print("\n[3/5] Setting up HLS package structure")
-        hls_dir, variants_dir = self.create_hls_package(final_video)
-        
-        print("\n[4/5] Adaptive bitrate encoding ladder")
-        variant_info = self.adaptive_bitrate_encoding(final_video, variants_dir)
-        
-        print("\n[5/5] Generating master manifest")
-        master_manifest = self.generate_master_manifest(hls_dir, variant_info)
+        hls_dir, variants_dir = self.create_hls_package(ladder_input)
+        publisher = self.start_publishing(hls_dir)
+        try:
+            if self.content_aware:
+                self.build_content_aware_ladder(ladder_input, prefilter)
+            
+            print("\n[4/5] Adaptive bitrate encoding ladder")
+            audio_rendition = None
+            if self.shared_audio:
+                audio_rendition = self.encode_audio_rendition(self.audio_source or merged_video, hls_dir)
+            variant_info = self.adaptive_bitrate_encoding(ladder_input, variants_dir, prefilter)
+            
+            print("\n[5/5] Generating master manifest")
+            if (self.single_pass and self.ffmpeg_master_playlist and audio_rendition is None
+                    and not (self.segment_parallel or self.incremental)):
+                master_manifest = self.relocate_ffmpeg_master(hls_dir, variants_dir)
+            else:
+                master_manifest = self.generate_master_manifest(hls_dir, variant_info, audio_rendition)
+            
+            dash_manifest = self.generate_dash_manifest(hls_dir, variant_info, audio_rendition) if self.cmaf else None
+        except BaseException:
+            if publisher is not None:
+                publisher.stop()
+            raise
+        published = publisher.finish() if publisher is not None else None
         
         print("\nHLS PACKAGING COMPLETE!")
         
@@ -211,17 +976,24 @@ class HLS_Packaging_Generator:
             'merged_video': merged_video,
             'final_video': final_video,
             'master_manifest': master_manifest,
+            'dash_manifest': dash_manifest,
             'variants': variant_info,
-            'hls_directory': hls_dir
+            'audio_rendition': audio_rendition,
+            'hls_directory': hls_dir,
+            'published': published
         }
 
 
 class Complete_Video_Pipeline:
     
-    def __init__(self, video_path: str):
+    def __init__(self, video_path: str, caption_options: Optional[Dict] = None,
+                 deadline_seconds: Optional[float] = None):
         self.video_path = video_path
         path = Path(video_path)
         self.video_name = path.stem
+        self.caption_options = caption_options or {}
+        # With a deadline, every encode's x264 preset is chosen to finish the job in time
+        self.scheduler = Preset_Scheduler(deadline_seconds) if deadline_seconds else None
         
         script_dir = Path(__file__).parent
         self.pipeline_root = script_dir / "complete_pipeline_results"
@@ -233,9 +1005,9 @@ class Complete_Video_Pipeline:
         print(f"Video: {self.video_name}")
         print("="*60)
         
-        from video_analysis import Analytics_Generator
-        from caption_generation import Caption_Generator
-        from video_enhancers import Video_Enhancement_Pipeline
+        from .video_analysis import Analytics_Generator
+        from .caption_generation import Caption_Generator
+        from .video_enchancers import Video_Enhancement_Pipeline
         
         results = {
             'original_video': self.video_path,
@@ -252,14 +1024,19 @@ class Complete_Video_Pipeline:
         print("\n" + "="*60)
         print("[STAGE 2] CAPTION GENERATION")
         print("="*60)
-        captions = Caption_Generator(self.video_path, model_size="base", device="cpu")
+        captions = Caption_Generator(self.video_path, **{'model_size': "base", **self.caption_options})
         caption_result = captions.run_full_analysis(keep_audio=False)
         results['captions'] = caption_result
         
         print("\n" + "="*60)
         print("[STAGE 3] VIDEO ENHANCEMENT")
         print("="*60)
-        enhancer = Video_Enhancement_Pipeline(self.video_path)
+        if self.scheduler is not None:
+            # Enhancement presets must leave time for the ladder encode at the end
+            self.scheduler.plan("ladder", HLS_Packaging_Generator.profile_resolutions(
+                HLS_Packaging_Generator.ENCODING_PROFILES),
+                HLS_Packaging_Generator.output_frame_count(self.video_path, HLS_Packaging_Generator.ENHANCEMENT_FILTER))
+        enhancer = Video_Enhancement_Pipeline(self.video_path, scheduler=self.scheduler)
         enhancement_result = enhancer.run_full_enhancement()
         results['enhancement'] = enhancement_result
         
@@ -269,7 +1046,9 @@ class Complete_Video_Pipeline:
         
         enhanced_video = enhancement_result.get('final_video', self.video_path)
         
-        hls_packager = HLS_Packaging_Generator(enhanced_video)
+        hls_packager = HLS_Packaging_Generator(enhanced_video, content_aware=True, analysis_metrics=analytics_result,
+                                               audio_source=self.video_path, ladder_source=self.video_path,
+                                               scheduler=self.scheduler)
         hls_result = hls_packager.run_full_analysis()
         results['hls'] = hls_result
         
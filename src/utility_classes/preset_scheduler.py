@@ -0,0 +1,156 @@
+import json
+import os
+import socket
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# libx264 presets, fastest first
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+
+# Speed is measured at these sizes; other sizes are scaled by pixel count from the nearest one
+CALIBRATION_SIZES = [(640, 360), (1280, 720), (1920, 1080), (3840, 2160)]
+CALIBRATION_FRAMES = 48
+CALIBRATION_VERSION = 1
+
+
+def host_key() -> str:
+    return f"{socket.gethostname()}-{os.cpu_count()}cpu"
+
+
+def measure_preset_fps(preset: str, width: int, height: int, frames: int = CALIBRATION_FRAMES) -> float:
+    """Frames per second libx264 encodes at the preset, on a noisy synthetic source, on this host."""
+    command = [
+        "ffmpeg",
+        "-v", "error",
+        "-nostdin",
+        "-f", "lavfi",
+        # Temporal noise keeps motion search and residual coding from being trivially cheap
+        "-i", f"testsrc2=size={width}x{height}:rate=30,noise=alls=12:allf=t",
+        "-frames:v", str(frames),
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-crf", "20",
+        "-pix_fmt", "yuv420p",
+        "-f", "null",
+        "-"
+    ]
+    start = time.perf_counter()
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Calibration encode error: {e.stderr.decode()}")
+    return frames / max(time.perf_counter() - start, 1e-6)
+
+
+class Preset_Calibration:
+    """libx264 speed per preset and resolution on this host.
+
+    Each (preset, size) pair is measured the first time it is needed with a
+    short encode and cached in a JSON file shared by all hosts, keyed by
+    host name and CPU count.
+    """
+
+    def __init__(self, cache_path: Optional[Path] = None):
+        script_dir = Path(__file__).parent
+        self.cache_path = Path(cache_path) if cache_path else script_dir / "scheduler_results" / "preset_calibration.json"
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.host = host_key()
+        self.measurements = self._load().get(self.host, {})
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get('version') != CALIBRATION_VERSION:
+            return {}
+        return cache.get('hosts', {})
+
+    def _save(self):
+        # Re-read first so that measurements written by other hosts are kept
+        hosts = self._load()
+        hosts[self.host] = self.measurements
+        temp_path = self.cache_path.parent / f".{self.cache_path.name}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'version': CALIBRATION_VERSION, 'hosts': hosts}, f, indent=4)
+        os.replace(temp_path, self.cache_path)
+
+    @staticmethod
+    def calibration_size(width: int, height: int) -> Tuple[int, int]:
+        pixels = width * height
+        return min(CALIBRATION_SIZES, key=lambda size: abs(size[0] * size[1] - pixels))
+
+    def fps(self, preset: str, width: int, height: int) -> float:
+        size = self.calibration_size(width, height)
+        key = f"{preset}@{size[0]}x{size[1]}"
+        if key not in self.measurements:
+            print(f"  Calibrating x264 {preset} at {size[0]}x{size[1]}...")
+            self.measurements[key] = measure_preset_fps(preset, *size)
+            self._save()
+        return self.measurements[key] * size[0] * size[1] / max(width * height, 1)
+
+
+class Preset_Scheduler:
+    """Picks x264 presets so that a job's encodes finish within its wall-clock deadline.
+
+    Encode steps are planned with their output resolutions and frame
+    counts. When a step is about to encode, it gets the slowest preset at
+    which it and every step still planned after it, all estimated at that
+    preset from the calibrated speeds, fit into the time left before the
+    deadline (with a safety margin). Time spent outside encoding (analysis,
+    model inference) is accounted for because the time left is re-read at
+    every decision. Without a deadline every step keeps its default preset.
+    """
+
+    def __init__(self, deadline_seconds: Optional[float] = None, calibration: Optional[Preset_Calibration] = None,
+                 safety_margin: float = 1.25, fastest: str = "ultrafast", slowest: str = "veryslow"):
+        self.deadline_seconds = deadline_seconds
+        self.started = time.monotonic()
+        self.calibration = calibration
+        if self.calibration is None and deadline_seconds is not None:
+            self.calibration = Preset_Calibration()
+        self.safety_margin = safety_margin
+        self.presets = X264_PRESETS[X264_PRESETS.index(fastest):X264_PRESETS.index(slowest) + 1]
+        self.planned: Dict[str, Tuple[List[Tuple[int, int]], int]] = {}
+        self.decisions: Dict[str, Dict] = {}
+
+    def remaining_seconds(self) -> float:
+        return self.deadline_seconds - (time.monotonic() - self.started)
+
+    def plan(self, step: str, resolutions: List[Tuple[int, int]], frames: int):
+        """Reserves time for an encode that will run later in the job."""
+        self.planned[step] = (list(resolutions), int(frames))
+
+    def estimate_seconds(self, preset: str, resolutions: List[Tuple[int, int]], frames: int) -> float:
+        # A ladder encodes every rung from one decode, so its outputs' costs add up
+        return sum(frames / self.calibration.fps(preset, width, height) for width, height in resolutions)
+
+    def preset_for(self, step: str, resolutions: List[Tuple[int, int]], frames: int,
+                   default: str = "medium") -> str:
+        self.planned.pop(step, None)
+        if self.deadline_seconds is None:
+            return default
+
+        budget = self.remaining_seconds() / self.safety_margin
+        chosen, estimate = self.presets[0], None
+        # Presets get monotonically slower, so the search stops at the first one that misses
+        for preset in self.presets:
+            total = self.estimate_seconds(preset, resolutions, frames)
+            total += sum(self.estimate_seconds(preset, *work) for work in self.planned.values())
+            if total > budget and estimate is not None:
+                break
+            chosen, estimate = preset, total
+        if estimate > budget:
+            print(f"WARNING: {step} cannot meet the deadline even with preset {chosen}")
+
+        print(f"  Preset for {step}: {chosen} (estimated {estimate:.0f}s with remaining steps, "
+              f"{self.remaining_seconds():.0f}s left)")
+        self.decisions[step] = {
+            'preset': chosen,
+            'estimated_seconds': round(estimate, 1),
+            'remaining_seconds': round(self.remaining_seconds(), 1)
+        }
+        return chosen
@@ -0,0 +1,367 @@
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# Every chunk's timestamps are shifted by this constant so that no chunk starts
+# with negative DTS (B-frame delay); otherwise the muxer would shift only the
+# first chunk and the stitched timeline would overlap at the first boundary.
+TS_OFFSET_PAD = 10.0
+
+
+class Segment_Work_Queue:
+    """A job queue on a shared filesystem, safe across processes and hosts.
+
+    Jobs are JSON files moved between pending/, claimed/, done/ and failed/.
+    A claim is an os.rename out of pending/, which is atomic on POSIX
+    filesystems (including NFS), so exactly one worker wins each job.
+    """
+
+    STATES = ("pending", "claimed", "done", "failed")
+
+    def __init__(self, queue_dir: Path):
+        self.queue_dir = Path(queue_dir)
+        for state in self.STATES:
+            (self.queue_dir / state).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state: str, job_id: str) -> Path:
+        return self.queue_dir / state / f"{job_id}.json"
+
+    def submit(self, job_id: str, job: Dict):
+        temp_path = self.queue_dir / f".{job_id}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(job, f)
+        os.rename(temp_path, self._path("pending", job_id))
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        for path in sorted((self.queue_dir / "pending").glob("*.json")):
+            job_id = path.stem
+            claimed = self._path("claimed", job_id)
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            os.utime(claimed)
+            with open(claimed) as f:
+                job = json.load(f)
+            job['job_id'] = job_id
+            job['worker'] = worker_id
+            return job
+        return None
+
+    def complete(self, job: Dict, error: Optional[str] = None):
+        state = "failed" if error else "done"
+        claimed = self._path("claimed", job['job_id'])
+        if error:
+            job['error'] = error
+        with open(claimed, 'w') as f:
+            json.dump(job, f)
+        os.rename(claimed, self._path(state, job['job_id']))
+
+    def requeue_stale(self, lease_seconds: float) -> List[str]:
+        """Returns jobs whose worker stopped touching them (crashed node) to pending/."""
+        now = time.time()
+        requeued = []
+        for path in (self.queue_dir / "claimed").glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > lease_seconds:
+                    os.rename(path, self._path("pending", path.stem))
+                    requeued.append(path.stem)
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def count(self, state: str, prefix: str = "") -> int:
+        return len(list((self.queue_dir / state).glob(f"{prefix}*.json")))
+
+    def failures(self, prefix: str = "") -> List[Dict]:
+        failures = []
+        for path in sorted((self.queue_dir / "failed").glob(f"{prefix}*.json")):
+            with open(path) as f:
+                failures.append(json.load(f))
+        return failures
+
+
+def run_worker(queue_dir: str, worker_id: Optional[str] = None, idle_exit: bool = True,
+               poll_seconds: float = 1.0, heartbeat_seconds: float = 15.0) -> int:
+    """Claims and runs chunk encodes until the queue is empty; returns the number run.
+
+    Remote nodes run the same loop against the shared queue directory:
+        python -m utility_classes.segment_encoder <queue_dir>
+    """
+    queue = Segment_Work_Queue(Path(queue_dir))
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    completed = 0
+
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if idle_exit:
+                return completed
+            time.sleep(poll_seconds)
+            continue
+
+        claimed = queue._path("claimed", job['job_id'])
+        process = subprocess.Popen(job['command'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = b""
+        while True:
+            try:
+                _, stderr = process.communicate(timeout=heartbeat_seconds)
+                break
+            except subprocess.TimeoutExpired:
+                # Heartbeat: keeps the lease fresh so the job is not requeued
+                claimed.touch()
+
+        if process.returncode != 0:
+            queue.complete(job, error=stderr.decode(errors='replace')[-4000:])
+        else:
+            queue.complete(job)
+            completed += 1
+
+
+def read_media_playlist(playlist_path: Path) -> List[Dict]:
+    """Segment entries of a media playlist: duration, uri and the EXT-X-MAP line in force."""
+    entries = []
+    current_map = None
+    with open(playlist_path) as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith("#EXT-X-MAP:"):
+            current_map = line
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0])
+            entries.append({'duration': duration, 'uri': lines[i + 1], 'map': current_map})
+    return entries
+
+
+def write_media_playlist(playlist: Path, entries: List[Dict]) -> str:
+    """Writes a VOD media playlist through a temporary file and an atomic rename.
+
+    fMP4 entries each carry their own init segment reference, so an
+    EXT-X-MAP is repeated wherever it changes.
+    """
+    playlist = Path(playlist)
+    target_duration = max((math.ceil(entry['duration']) for entry in entries), default=0)
+    has_map = any(entry['map'] for entry in entries)
+    temp_path = playlist.parent / f".{playlist.name}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write("#EXTM3U\n")
+        f.write(f"#EXT-X-VERSION:{7 if has_map else 3}\n")
+        f.write(f"#EXT-X-TARGETDURATION:{target_duration}\n")
+        f.write("#EXT-X-MEDIA-SEQUENCE:0\n")
+        f.write("#EXT-X-PLAYLIST-TYPE:VOD\n")
+        current_map = None
+        for entry in entries:
+            if entry['map'] and entry['map'] != current_map:
+                current_map = entry['map']
+                f.write(f"{current_map}\n")
+            f.write(f"#EXTINF:{entry['duration']:.6f},\n")
+            f.write(f"{entry['uri']}\n")
+        f.write("#EXT-X-ENDLIST\n")
+    os.replace(temp_path, playlist)
+    return str(playlist)
+
+
+def stitch_playlists(variant_dir: Path, chunk_playlists: List[str], playlist_name: str = "playlist.m3u8") -> str:
+    """Concatenates per-chunk VOD media playlists into one continuous playlist.
+
+    Segment numbering and timestamps were made continuous at encode time
+    (-start_number, -output_ts_offset), so only the entries are merged.
+    """
+    entries = []
+    for name in chunk_playlists:
+        entries.extend(read_media_playlist(variant_dir / name))
+    playlist = write_media_playlist(variant_dir / playlist_name, entries)
+
+    for name in chunk_playlists:
+        (variant_dir / name).unlink(missing_ok=True)
+    return playlist
+
+
+def plan_segment_starts(duration: float, scene_cuts: List[float], target: float = 6.0,
+                        min_segment: float = 2.0, max_segment: float = 10.0) -> List[float]:
+    """Segment start times (the first is 0) with a boundary at every usable scene cut.
+
+    Cuts closer than min_segment to the previous boundary are dropped. The
+    stretch between two boundaries is split evenly into pieces near target
+    and never longer than max_segment; a tail shorter than min_segment is
+    merged into the stretch before it and that stretch is split again.
+    """
+    if max_segment < 2 * min_segment:
+        raise ValueError("max_segment must be at least twice min_segment")
+    points = [cut for cut in sorted(scene_cuts) if 0.0 < cut < duration] + [duration]
+    starts = [0.0]
+    stretches = []
+    for point in points:
+        if point - starts[-1] < min_segment:
+            if point < duration:
+                continue
+            if stretches:
+                del starts[stretches.pop() + 1:]
+        first = starts[-1]
+        gap = point - first
+        pieces = max(round(gap / target), math.ceil(gap / max_segment), 1)
+        pieces = min(pieces, max(int(gap // min_segment), 1))
+        stretches.append(len(starts) - 1)
+        starts.extend(first + gap * i / pieces for i in range(1, pieces + 1))
+    # The last start appended is the end of the title
+    return [round(start, 3) for start in starts[:-1]]
+
+
+def force_keyframe_args(keyframe_times: List[float], stream_count: int) -> List[str]:
+    # ffmpeg only applies an unqualified -force_key_frames to the first video output stream
+    times = ",".join(f"{time:.3f}" for time in keyframe_times)
+    args = []
+    for i in range(stream_count):
+        args.extend([f"-force_key_frames:v:{i}", times])
+    return args
+
+
+class Segment_Parallel_Encoder:
+    """Encodes a ladder as independent GOP-aligned time chunks and stitches the playlists.
+
+    Chunks span a whole number of HLS segments, scene-cut keyframes are
+    disabled, and each chunk forces a keyframe at every segment start it
+    covers, relative to its own first frame, so segments begin on an IDR
+    frame whether or not the GOP length divides the segment duration at the
+    source's frame rate. The stitched output is the same segment sequence a
+    single encode would produce. With segment_starts the forced starts are
+    the variable, scene-aligned ones.
+    """
+
+    def __init__(self, source: str, variants_dir: str, variant_names: List[str], duration: float,
+                 build_command: Callable[[List[str], List[str], str, str], List[str]],
+                 hls_time: int = 6, chunk_segments: int = 5, workers: Optional[int] = None,
+                 queue_dir: Optional[str] = None, lease_seconds: float = 300.0,
+                 segment_name: str = "segment_%05d.ts", chunk_prefix: str = "chunk",
+                 segment_starts: Optional[List[float]] = None):
+        self.source = source
+        self.variants_dir = Path(variants_dir)
+        self.variant_names = variant_names
+        self.duration = duration
+        self.build_command = build_command
+        self.hls_time = hls_time
+        self.chunk_segments = chunk_segments
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
+        self.owns_queue = queue_dir is None
+        self.queue_dir = Path(queue_dir) if queue_dir else self.variants_dir / ".segment_queue"
+        self.lease_seconds = lease_seconds
+        self.segment_name = segment_name
+        self.chunk_prefix = chunk_prefix
+        self.segment_starts = segment_starts
+
+    def _segment_run(self, index: int, first: int, last: int) -> Dict:
+        """Chunk covering segments first..last of a variable segment_starts plan."""
+        start = self.segment_starts[first]
+        end = self.segment_starts[last + 1] if last + 1 < len(self.segment_starts) else self.duration
+        return {
+            'index': index,
+            'start': start,
+            'duration': round(end - start, 3),
+            'start_number': first,
+            'playlist': f"{self.chunk_prefix}_{index:05d}.m3u8",
+            'keyframes': [round(time - start, 3) for time in self.segment_starts[first:last + 1]]
+        }
+    
+    def _fixed_keyframes(self, segment_count: int) -> List[float]:
+        """Chunk-relative starts of segment_count fixed hls_time segments."""
+        return [index * self.hls_time for index in range(segment_count)]
+    
+    def plan_chunks(self) -> List[Dict]:
+        if self.segment_starts:
+            count = len(self.segment_starts)
+            return [self._segment_run(index, first, min(first + self.chunk_segments, count) - 1)
+                    for index, first in enumerate(range(0, count, self.chunk_segments))]
+        chunk_seconds = self.hls_time * self.chunk_segments
+        count = max(1, math.ceil(self.duration / chunk_seconds))
+        return [{
+            'index': index,
+            'start': index * chunk_seconds,
+            'duration': chunk_seconds,
+            'start_number': index * self.chunk_segments,
+            'playlist': f"{self.chunk_prefix}_{index:05d}.m3u8",
+            'keyframes': self._fixed_keyframes(self.chunk_segments)
+        } for index in range(count)]
+
+    def plan_segment_runs(self, segment_indices: List[int]) -> List[Dict]:
+        """Chunks covering only the given segments, one per run of consecutive indices."""
+        runs = []
+        for index in sorted(segment_indices):
+            if runs and index == runs[-1][1] + 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        if self.segment_starts:
+            return [self._segment_run(first, first, last) for first, last in runs]
+        return [{
+            'index': first,
+            'start': first * self.hls_time,
+            'duration': (last - first + 1) * self.hls_time,
+            'start_number': first,
+            'playlist': f"{self.chunk_prefix}_{first:05d}.m3u8",
+            'keyframes': self._fixed_keyframes(last - first + 1)
+        } for first, last in runs]
+
+    def chunk_command(self, chunk: Dict) -> List[str]:
+        input_args = ["-ss", str(chunk['start']), "-i", self.source]
+        # An input -t lets the CFR output pad the chunk with a copy of its last frame,
+        # which the muxer writes as a stray one-frame segment over the next chunk's first
+        hls_args = [
+            "-t", str(chunk['duration']),
+            "-start_number", str(chunk['start_number']),
+            "-output_ts_offset", str(chunk['start'] + TS_OFFSET_PAD)
+        ]
+        if chunk.get('keyframes'):
+            hls_args.extend(force_keyframe_args(chunk['keyframes'], len(self.variant_names)))
+        return self.build_command(input_args, hls_args, self.segment_name, chunk['playlist'])
+
+    def encode(self) -> Dict[str, str]:
+        chunks = self.plan_chunks()
+        self.run_chunks(chunks)
+
+        playlists = {}
+        for name in self.variant_names:
+            playlists[name] = stitch_playlists(
+                self.variants_dir / name, [chunk['playlist'] for chunk in chunks]
+            )
+        return playlists
+
+    def run_chunks(self, chunks: List[Dict]):
+        queue = Segment_Work_Queue(self.queue_dir)
+        run_id = uuid.uuid4().hex[:8]
+        for chunk in chunks:
+            queue.submit(f"{run_id}_{chunk['index']:05d}", {'command': self.chunk_command(chunk)})
+
+        print(f"  Encoding {len(chunks)} chunks with {self.workers} local worker(s)...")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for _ in pool.map(lambda i: run_worker(str(self.queue_dir), worker_id=f"local-{os.getpid()}-{i}"),
+                              range(self.workers)):
+                pass
+
+        # Remote workers may still hold claims; wait for them, reclaiming lost leases
+        while queue.count("claimed", run_id) or queue.count("pending", run_id):
+            queue.requeue_stale(self.lease_seconds)
+            run_worker(str(self.queue_dir), worker_id=f"local-{os.getpid()}-drain")
+            time.sleep(1.0)
+
+        failures = queue.failures(run_id)
+        if failures:
+            raise RuntimeError(f"Segment encoding error: {failures[0].get('error', '')}")
+        if self.owns_queue:
+            shutil.rmtree(self.queue_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m utility_classes.segment_encoder <queue_dir> [--wait]")
+        sys.exit(1)
+    count = run_worker(sys.argv[1], idle_exit="--wait" not in sys.argv)
+    print(f"Encoded {count} chunks")
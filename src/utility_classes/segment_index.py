@@ -0,0 +1,111 @@
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, Optional
+
+INDEX_VERSION = 1
+
+
+def source_segment_hashes(video_path: str, hls_time: float, segment_starts: Optional[List[float]] = None) -> List[str]:
+    """SHA-256 per hls_time slice over the decoded source frames (video and first audio stream).
+
+    ffmpeg's framehash muxer prints one checksum per decoded frame, so the
+    whole source is decoded once but nothing is encoded. With
+    segment_starts the slices are the variable segments starting there.
+    """
+    command = [
+        "ffmpeg",
+        "-v", "error",
+        "-nostdin",
+        "-i", str(video_path),
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        "-f", "framehash",
+        "-hash", "md5",
+        "-"
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"FFmpeg framehash error: {e.stderr}")
+
+    time_bases = {}
+    hashes: List = []
+    first_pts = {}
+    for line in result.stdout.splitlines():
+        if line.startswith("#tb "):
+            stream, time_base = line[4:].split(":", 1)
+            time_bases[int(stream)] = Fraction(time_base.strip())
+            continue
+        if not line or line.startswith("#"):
+            continue
+        fields = [field.strip() for field in line.split(",")]
+        stream, pts, frame_hash = int(fields[0]), int(fields[2]), fields[5]
+        first_pts.setdefault(stream, pts)
+        seconds = float((pts - first_pts[stream]) * time_bases[stream])
+        if segment_starts:
+            index = max(bisect.bisect_right(segment_starts, seconds + 1e-6) - 1, 0)
+        else:
+            index = int(seconds // hls_time)
+        while len(hashes) <= index:
+            hashes.append(hashlib.sha256())
+        hashes[index].update(f"{stream}:{frame_hash}\n".encode('utf-8'))
+    return [digest.hexdigest() for digest in hashes]
+
+
+def encode_params_hash(params: Dict) -> str:
+    payload = json.dumps({'version': INDEX_VERSION, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Segment_Hash_Index:
+    """Per-package record of what every HLS segment was encoded from.
+
+    Stores the encode parameter hash, one source hash per segment and each
+    variant's playlist entries, so a repackage can tell which segments
+    changed and rebuild playlists without re-reading the old ones.
+    """
+
+    def __init__(self, index_path: Path):
+        self.index_path = Path(index_path)
+
+    def load(self) -> Optional[Dict]:
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get('version') != INDEX_VERSION:
+            return None
+        return index
+
+    def save(self, params_hash: str, segment_hashes: List[str], variants: Dict[str, List[Dict]],
+             generation: int = 0):
+        index = {
+            'version': INDEX_VERSION,
+            'params': params_hash,
+            'generation': generation,
+            'segments': segment_hashes,
+            'variants': variants
+        }
+        temp_path = self.index_path.with_suffix(".tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(index, f, indent=4)
+        os.replace(temp_path, self.index_path)
+        return index
+
+    @staticmethod
+    def changed_segments(index: Optional[Dict], params_hash: str, segment_hashes: List[str],
+                         variant_names: List[str]) -> Optional[List[int]]:
+        """Indices of segments to re-encode, or None when the whole package must be rebuilt."""
+        if index is None or index['params'] != params_hash:
+            return None
+        if len(index['segments']) != len(segment_hashes) or sorted(index['variants']) != sorted(variant_names):
+            return None
+        if any(len(entries) != len(segment_hashes) for entries in index['variants'].values()):
+            return None
+        return [i for i, (old, new) in enumerate(zip(index['segments'], segment_hashes)) if old != new]
@@ -0,0 +1,188 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+from .audio_processing import SAMPLE_RATE
+from .model_registry import get_model_registry
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
+
+@dataclass
+class TranscriptSegment:
+    start: float
+    end: float
+    text: str
+
+
+class Transcription_Backend:
+    """Common interface: every backend turns 16 kHz float32 audio into TranscriptSegments."""
+    name = "base"
+    compute_types = ()
+
+    def __init__(self, model_size: str = "base", device: str = "cpu",
+                 compute_type: Optional[str] = None, threads: Optional[int] = None):
+        if compute_type is None:
+            compute_type = self.compute_types[0]
+        if compute_type not in self.compute_types:
+            raise ValueError(f"{self.name} backend does not support compute type {compute_type}")
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.threads = threads
+        self.model = None
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    def load(self):
+        raise NotImplementedError
+
+    def _transcribe(self, audio) -> List[Dict]:
+        raise NotImplementedError
+
+    def transcribe(self, audio, offset: float = 0.0) -> List[TranscriptSegment]:
+        self.load()
+        segments = self._transcribe(audio)
+        end_limit = offset + len(audio) / SAMPLE_RATE if isinstance(audio, np.ndarray) else float("inf")
+        return [TranscriptSegment(
+            start=min(seg['start'] + offset, end_limit),
+            end=min(seg['end'] + offset, end_limit),
+            text=seg['text'].strip()
+        ) for seg in segments]
+
+
+class Whisper_Backend(Transcription_Backend):
+    name = "whisper"
+    compute_types = ("float32", "float16")
+
+    def __init__(self, model_size: str = "base", device: str = "cpu",
+                 compute_type: Optional[str] = None, threads: Optional[int] = None):
+        if compute_type == "float16" and not device.startswith("cuda"):
+            raise ValueError(f"whisper backend only runs float16 on cuda, not {device}")
+        super().__init__(model_size, device, compute_type, threads)
+
+    def load(self):
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.model is None:
+            self.model = get_model_registry().acquire(self.model_size, self.device, self.compute_type)
+        return self.model
+
+    def _transcribe(self, audio) -> List[Dict]:
+        result = self.model.transcribe(audio, word_timestamps=False, fp16=self.compute_type == "float16")
+        return result['segments']
+
+
+class Quantized_Whisper_Backend(Whisper_Backend):
+    """openai-whisper with its Linear layers dynamically quantized to int8 (CPU only)."""
+    name = "whisper-int8"
+    compute_types = ("int8",)
+
+    def __init__(self, model_size: str = "base", device: str = "cpu",
+                 compute_type: Optional[str] = None, threads: Optional[int] = None):
+        if device != "cpu":
+            raise ValueError("whisper-int8 backend only runs on cpu")
+        super().__init__(model_size, device, compute_type, threads)
+
+    def _transcribe(self, audio) -> List[Dict]:
+        result = self.model.transcribe(audio, word_timestamps=False, fp16=False)
+        return result['segments']
+
+
+class CTranslate2_Backend(Transcription_Backend):
+    """CTranslate2 engine through faster-whisper, used when the package is installed."""
+    name = "ctranslate2"
+    compute_types = ("int8", "int8_float32", "float32", "float16", "int8_float16")
+
+    _models: Dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return WhisperModel is not None
+
+    def load(self):
+        if self.model is None:
+            key = (self.model_size, self.device, self.compute_type, self.threads or 0)
+            with self._lock:
+                if key not in self._models:
+                    print(f"Loading CTranslate2 Whisper model ({self.model_size}, {self.compute_type})...")
+                    self._models[key] = WhisperModel(
+                        self.model_size,
+                        device=self.device,
+                        compute_type=self.compute_type,
+                        cpu_threads=self.threads or 0
+                    )
+                self.model = self._models[key]
+        return self.model
+
+    def _transcribe(self, audio) -> List[Dict]:
+        segments, _ = self.model.transcribe(audio, word_timestamps=False)
+        return [{'start': seg.start, 'end': seg.end, 'text': seg.text} for seg in segments]
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (Whisper_Backend, Quantized_Whisper_Backend, CTranslate2_Backend)
+}
+
+
+def create_backend(name: str, **kwargs) -> Transcription_Backend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend {name}; available: {sorted(BACKENDS)}")
+    backend = BACKENDS[name]
+    if not backend.is_available():
+        raise RuntimeError(f"Transcription backend {name} is not installed")
+    return backend(**kwargs)
+
+
+def benchmark_backends(audio: np.ndarray, model_size: str = "base", configs: Optional[List[Dict]] = None,
+                       device: str = "cpu", threads: Optional[int] = None) -> List[Dict]:
+    """Times load and transcription for each backend config and reports real-time factor.
+
+    RTF is transcription seconds per second of audio; below 1.0 is faster
+    than real time. Unavailable backends are reported rather than raised.
+    """
+    if configs is None:
+        configs = [{'backend': name} for name in BACKENDS]
+    audio_seconds = len(audio) / SAMPLE_RATE
+
+    results = []
+    for config in configs:
+        name = config['backend']
+        entry = {'backend': name, 'compute_type': config.get('compute_type'), 'threads': threads}
+        if name not in BACKENDS or not BACKENDS[name].is_available():
+            entry['error'] = "not available"
+            results.append(entry)
+            continue
+
+        backend = create_backend(name, model_size=model_size, device=device,
+                                 compute_type=config.get('compute_type'), threads=threads)
+        start = time.perf_counter()
+        backend.load()
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        segments = backend.transcribe(audio)
+        transcribe_seconds = time.perf_counter() - start
+
+        entry.update({
+            'compute_type': backend.compute_type,
+            'load_seconds': round(load_seconds, 3),
+            'transcribe_seconds': round(transcribe_seconds, 3),
+            'audio_seconds': round(audio_seconds, 3),
+            'rtf': round(transcribe_seconds / audio_seconds, 4) if audio_seconds else None,
+            'segments': len(segments)
+        })
+        print(f"{name} ({backend.compute_type}): RTF {entry['rtf']}")
+        results.append(entry)
+    return results
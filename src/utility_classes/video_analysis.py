@@ -18,6 +18,7 @@ class Analytics_Generator:
         script_dir = Path(__file__).parent
         self.analysis_root = script_dir / "analysis_results"
         self.analysis_root.mkdir(exist_ok=True)
+        self.scene_cuts = []
         
         print("video name:", self.video_name)
     
@@ -58,7 +59,7 @@ class Analytics_Generator:
         command = [
             "ffmpeg",
             "-i", self.video_path,
-            "-vf", f"select='gt(scene,{threshold})',showinfo",
+            "-vf", f"select='gt(scene,{threshold})',metadata=print",
             "-f", "null",
             "-"
         ]
@@ -67,24 +68,33 @@ class Analytics_Generator:
         stdout, stderr = process.communicate()
         
         scene_count = 0
+        self.scene_cuts = []
         with open(scenes_file, 'w') as f:
             f.write(f"Scene Detection (threshold={threshold})\n")
             f.write("=" * 50 + "\n\n")
             
+            # metadata=print logs each selected frame's pts_time, then its lavfi.scene_score
+            timestamp = None
             for line in stderr.split('\n'):
-                if 'Parsed_showinfo' in line and 'pts_time' in line:
-                    if 'pts_time:' in line and 'scene:' in line:
-                        timestamp = line.split('pts_time:')[1].split()[0]
-                        scene_score = line.split('scene:')[1].split()[0]
-                        
-                        if float(scene_score) > threshold:
-                            f.write(f"Scene cut at {timestamp}s (score: {scene_score})\n")
-                            scene_count += 1
+                if 'Parsed_metadata' in line and 'pts_time:' in line:
+                    timestamp = line.split('pts_time:')[1].split()[0]
+                elif 'lavfi.scene_score=' in line and timestamp is not None:
+                    scene_score = line.split('lavfi.scene_score=')[1].split()[0]
+                    
+                    if float(scene_score) > threshold:
+                        f.write(f"Scene cut at {timestamp}s (score: {scene_score})\n")
+                        self.scene_cuts.append({'time': float(timestamp), 'score': float(scene_score)})
+                        scene_count += 1
+                    timestamp = None
             
             if scene_count == 0:
                 f.write("No scene cuts detected above threshold.\n")
                 f.write("This video appears to be a single continuous scene.\n")
         
+        # Machine-readable scene index; packaging places keyframes at these cuts
+        with open(scenes_dir / f"{self.video_name}_scenes.json", 'w') as f:
+            json.dump({'threshold': threshold, 'cuts': self.scene_cuts}, f, indent=4)
+        
         print(f"Detected {scene_count} scene cuts")
         print(f"Scene detection saved to: {scenes_file}")
         return str(scenes_file)
@@ -465,6 +475,7 @@ class Analytics_Generator:
         
         print("\n[FINAL] Running decision engine")
         decision = self.decision_engine(motion_scores, complexity_scores, noise_scores, blur_scores)
+        decision['scene_cuts'] = list(self.scene_cuts)
         print("ANALYSIS COMPLETE!")
 
         return decision
\ No newline at end of file
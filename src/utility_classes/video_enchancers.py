@@ -5,13 +5,87 @@ import datetime
 import hashlib
 import json
 import cv2
+import numpy as np
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from .frame_io import Frame_Reader, Frame_Writer, probe_frame_timestamps, probe_keyframe_times, probe_video
+from .frame_staging import Image_Sequence_Stage, select_staging_root
+from .interpolation_backends import (
+    THROUGHPUT_SAMPLE_FRAMES,
+    Backend_Throughput_Cache,
+    Interpolation_Backend,
+    Minterpolate_Backend,
+    RIFE_NCNN_Backend,
+    Torch_RIFE_Backend,
+    cut_sample_clip,
+)
+from .preset_scheduler import Preset_Scheduler
+
+# ffprobe H.264 profile names and the libx264 profiles that reproduce them
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444"
+}
+# Stream parameters the re-encoded pieces must share with the copied source pieces
+SPLICE_PARAMETERS = ('codec', 'profile', 'level', 'pix_fmt', 'width', 'height')
+
+
+class Tile_Change_Detector:
+    """Flags the tiles of a frame whose pixels moved away from the last upscaled version.
+
+    Each tile is compared against the source pixels that were last sent to the
+    SR model for it (not just the previous frame), so slow drift below the
+    tolerance can never accumulate into a visible stale tile.
+    """
+    
+    def __init__(self, tile_size: int = 64, tolerance: int = 2):
+        self.tile_size = tile_size
+        self.tolerance = tolerance
+        self.reference = None
+    
+    def grid_shape(self, frame: np.ndarray) -> Tuple[int, int]:
+        height, width = frame.shape[:2]
+        return -(-height // self.tile_size), -(-width // self.tile_size)
+    
+    def changed_tiles(self, frame: np.ndarray) -> np.ndarray:
+        rows, cols = self.grid_shape(frame)
+        
+        if self.reference is None or self.reference.shape != frame.shape:
+            self.reference = frame.copy()
+            return np.ones((rows, cols), dtype=bool)
+        
+        height, width = frame.shape[:2]
+        size = self.tile_size
+        diff = cv2.absdiff(frame, self.reference)
+        if diff.ndim == 2:
+            diff = diff[..., None]
+        padded = np.zeros((rows * size, cols * size, diff.shape[2]), dtype=diff.dtype)
+        padded[:height, :width] = diff
+        tile_max = padded.reshape(rows, size, cols, size, -1).max(axis=(1, 3, 4))
+        changed = tile_max > self.tolerance
+        
+        for row, col in zip(*np.nonzero(changed)):
+            y, x = row * size, col * size
+            self.reference[y:y + size, x:x + size] = frame[y:y + size, x:x + size]
+        
+        return changed
 
 
 class Upscaling_Generator:
     
-    def __init__(self, video_path: str, model_name: str = "RealESRGAN_x4plus"):
+    def __init__(self, video_path: str, model_name: str = "RealESRGAN_x4plus",
+                 skip_static_tiles: bool = True, tile_size: int = 64,
+                 tile_tolerance: int = 2, tile_halo: int = 8,
+                 binary_input_format: str = "bmp", chunk_frames: int = 120,
+                 audio_source: Optional[str] = None, preset: str = "medium",
+                 live_path: Optional[str] = None, scheduler: Optional[Preset_Scheduler] = None):
         self.video_path = video_path
         path = Path(video_path)
         self.video_name = path.stem
@@ -22,6 +96,24 @@ class Upscaling_Generator:
         self.upscaling_root.mkdir(exist_ok=True)
         
         self.model_name = model_name
+        self.scale = 4
+        self.binary_input_format = binary_input_format
+        self.output_format = "png"
+        
+        self.skip_static_tiles = skip_static_tiles
+        self.tile_size = tile_size
+        self.tile_tolerance = tile_tolerance
+        self.tile_halo = tile_halo
+        self.tile_stats = {}
+        self._tile_counters = {}
+        
+        self.chunk_frames = chunk_frames
+        self.audio_source = audio_source or video_path
+        self.preset = preset
+        # live_path also receives the encoded output as a growing MPEG-TS stream
+        self.live_path = live_path
+        # scheduler replaces the fixed preset with one sized to the job's deadline
+        self.scheduler = scheduler
         
         print("video name:", self.video_name)
         print(f"Upscaling model: {model_name}")
@@ -36,34 +128,14 @@ class Upscaling_Generator:
         
         return str(model_path)
     
-    def extract_frames(self):
-        frames_dir = self.upscaling_root / "frame_extraction" / self.video_name
-        frames_dir.mkdir(parents=True, exist_ok=True)
-        
-        output_pattern = frames_dir / "frame_%06d.png"
-        
-        print(f"Extracting frames to PNG sequence...")
-        
-        command = [
-            "ffmpeg",
-            "-i", self.video_path,
-            "-qscale:v", "1",
-            "-qmin", "1",
-            "-qmax", "1",
-            "-vsync", "0",
-            str(output_pattern)
-        ]
-        
-        try:
-            subprocess.run(command, check=True, capture_output=True)
-            frame_count = len(list(frames_dir.glob("*.png")))
-            print(f"Extracted {frame_count} frames")
-            return str(frames_dir)
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Frame extraction error: {e.stderr.decode()}")
+    def _staging_dir(self, stage_name: str, required_bytes: int = 0) -> Path:
+        root = select_staging_root(self.upscaling_root, required_bytes)
+        stage_dir = root / stage_name / self.video_name
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        return stage_dir
     
-    def batch_process_gpu(self, frames_dir: str):
-        upscaled_dir = self.upscaling_root / "upscaled_frames" / self.video_name
+    def batch_process_gpu(self, frames_dir: str, output_dir: Optional[str] = None):
+        upscaled_dir = Path(output_dir) if output_dir else self._staging_dir("upscaled_frames")
         upscaled_dir.mkdir(parents=True, exist_ok=True)
         
         esrgan_cmd = "realesrgan-ncnn-vulkan"
@@ -78,8 +150,8 @@ class Upscaling_Generator:
             '-i', frames_dir,
             '-o', str(upscaled_dir),
             '-n', self.model_name,
-            '-s', '4',
-            '-f', 'jpg'
+            '-s', str(self.scale),
+            '-f', self.output_format
         ]
         
         try:
@@ -90,11 +162,149 @@ class Upscaling_Generator:
             print(f"Error running RealESRGAN: {e}")
             return None
     
-    def upscale_4x(self, upscaled_frames_dir: str):
-        print(f"Applying 4x upscaling (480p -> 1920p)")
-        return upscaled_frames_dir
+    def _stage_tiles(self, frames, tiles: Image_Sequence_Stage, detector: Tile_Change_Detector):
+        size, halo = self.tile_size, self.tile_halo
+        counters = self._tile_counters
+        tile_plan = []
+        
+        for frame_name, frame in frames:
+            height, width = frame.shape[:2]
+            changed = detector.changed_tiles(frame)
+            counters['tiles_total'] += changed.size
+            counters['source_pixels'] += height * width
+            
+            frame_tiles = []
+            for row, col in zip(*np.nonzero(changed)):
+                y0, x0 = row * size, col * size
+                y1, x1 = min(y0 + size, height), min(x0 + size, width)
+                crop_y0, crop_x0 = max(y0 - halo, 0), max(x0 - halo, 0)
+                crop_y1, crop_x1 = min(y1 + halo, height), min(x1 + halo, width)
+                
+                tile_name = f"{frame_name}_{row:03d}_{col:03d}"
+                tiles.write(tile_name, frame[crop_y0:crop_y1, crop_x0:crop_x1])
+                counters['staged_pixels'] += (crop_y1 - crop_y0) * (crop_x1 - crop_x0)
+                frame_tiles.append({
+                    'name': tile_name,
+                    'box': (int(y0), int(x0), int(y1), int(x1)),
+                    'offset': (int(y0 - crop_y0), int(x0 - crop_x0))
+                })
+            
+            counters['tiles_upscaled'] += len(frame_tiles)
+            tile_plan.append({'frame': frame_name, 'shape': (height, width), 'tiles': frame_tiles})
+        
+        total = counters['tiles_total']
+        self.tile_stats = {
+            'tiles_total': total,
+            'tiles_upscaled': counters['tiles_upscaled'],
+            'tile_skip_fraction': float(1 - counters['tiles_upscaled'] / total) if total else 0.0,
+            'upscaled_pixel_ratio': float(counters['staged_pixels'] / counters['source_pixels']) if counters['source_pixels'] else 0.0
+        }
+        return tile_plan
+    
+    def _reset_tile_counters(self):
+        self._tile_counters = {'tiles_total': 0, 'tiles_upscaled': 0, 'source_pixels': 0, 'staged_pixels': 0}
+        self.tile_stats = {}
+    
+    def _compose_tiles(self, upscaled_tiles_dir: str, tile_plan, state: Dict):
+        """Yields (frame_name, canvas); the canvas is reused, so consume it before advancing."""
+        scale = self.scale
+        for entry in tile_plan:
+            height, width = entry['shape']
+            canvas = state.get('canvas')
+            if canvas is None or canvas.shape[:2] != (height * scale, width * scale):
+                canvas = np.zeros((height * scale, width * scale, 3), dtype=np.uint8)
+                state['canvas'] = canvas
+            
+            for tile in entry['tiles']:
+                tile_path = Path(upscaled_tiles_dir) / f"{tile['name']}.{self.output_format}"
+                upscaled = cv2.imread(str(tile_path), cv2.IMREAD_COLOR)
+                if upscaled is None:
+                    raise RuntimeError(f"Missing upscaled tile: {tile_path}")
+                y0, x0, y1, x1 = tile['box']
+                off_y, off_x = tile['offset'][0] * scale, tile['offset'][1] * scale
+                canvas[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = upscaled[
+                    off_y:off_y + (y1 - y0) * scale, off_x:off_x + (x1 - x0) * scale
+                ]
+            
+            yield entry['frame'], canvas
+    
+    def iter_frame_chunks(self, info: Dict):
+        """Decodes the source straight into chunks of chunk_frames BGR frames.
+
+        Nothing is staged for the whole video; each chunk is written out for
+        the SR binary on its own, so staging only ever holds one or two chunks.
+        """
+        chunk = []
+        with Frame_Reader(self.video_path, info['width'], info['height'], pix_fmt="bgr24") as reader:
+            for index, frame in enumerate(reader, 1):
+                chunk.append((f"frame_{index:06d}", frame))
+                if len(chunk) >= self.chunk_frames:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
     
-    def encode_video(self, frames_dir: str):
+    def upscale_chunk(self, chunk, chunk_index: int, detector: Optional[Tile_Change_Detector]):
+        """Stages one chunk of frames for the SR binary and runs it.
+
+        Returns None when the binary is unavailable or fails.
+        """
+        chunk_bytes = sum(frame.nbytes for _, frame in chunk)
+        staged = Image_Sequence_Stage(self._staging_dir(f"chunk_input/{chunk_index:05d}", chunk_bytes),
+                                      self.binary_input_format)
+        staged.directory.mkdir(parents=True, exist_ok=True)
+        
+        if detector is not None:
+            plan = self._stage_tiles(chunk, staged, detector)
+        else:
+            plan = None
+            for frame_name, frame in chunk:
+                staged.write(frame_name, frame)
+        
+        output_dir = self._staging_dir(f"chunk_output/{chunk_index:05d}", chunk_bytes * self.scale * self.scale)
+        upscaled_dir = self.batch_process_gpu(str(staged.directory), str(output_dir))
+        staged.cleanup()
+        if upscaled_dir is None:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            return None
+        
+        return {
+            'upscaled_dir': upscaled_dir,
+            'plan': plan,
+            'names': [frame_name for frame_name, _ in chunk]
+        }
+    
+    def _chunk_frames(self, result: Dict, state: Dict):
+        if result['plan'] is not None:
+            yield from self._compose_tiles(result['upscaled_dir'], result['plan'], state)
+        else:
+            for frame_name in result['names']:
+                frame_path = Path(result['upscaled_dir']) / f"{frame_name}.{self.output_format}"
+                frame = cv2.imread(str(frame_path), cv2.IMREAD_COLOR)
+                if frame is None:
+                    raise RuntimeError(f"Missing upscaled frame: {frame_path}")
+                yield frame_name, frame
+        shutil.rmtree(result['upscaled_dir'], ignore_errors=True)
+    
+    def stream_upscaled_frames(self, first_result: Dict, chunks, detector: Optional[Tile_Change_Detector]):
+        """Yields upscaled frames in order while the SR binary works one chunk ahead."""
+        state = {}
+        chunk_index = 1
+        result = first_result
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while result is not None:
+                next_chunk = next(chunks, None)
+                future = executor.submit(self.upscale_chunk, next_chunk, chunk_index, detector) if next_chunk else None
+                chunk_index += 1
+                
+                for frame_name, frame in self._chunk_frames(result, state):
+                    yield frame
+                
+                result = future.result() if future else None
+                if future and result is None:
+                    raise RuntimeError(f"Upscaling failed on chunk {chunk_index - 1}")
+    
+    def _output_path(self):
         output_dir = self.upscaling_root / "final_videos"
         output_dir.mkdir(exist_ok=True)
         
@@ -103,44 +313,52 @@ class Upscaling_Generator:
         hash_object = hashlib.sha256(time_bits)
         current_time_hash = hash_object.hexdigest()[:8]
         
-        output_video = output_dir / f"{self.video_name}_upscaled_{current_time_hash}.mp4"
-        
-        frame_pattern = Path(frames_dir) / "frame_%06d.png"
-        
-        print(f"Encoding upscaled video...")
-        
-        command = [
-            "ffmpeg",
-            "-framerate", "30",
-            "-i", str(frame_pattern),
-            "-c:v", "libx264",
-            "-preset", "medium",
-            "-crf", "18",
-            "-pix_fmt", "yuv420p",
-            str(output_video)
-        ]
-        
-        try:
-            subprocess.run(command, check=True, capture_output=True)
-            print(f"Video encoded: {output_video}")
-            return str(output_video)
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Video encoding error: {e.stderr.decode()}")
+        return output_dir / f"{self.video_name}_upscaled_{current_time_hash}.mp4"
+    
+    def _encode_preset(self, info: Dict) -> str:
+        if self.scheduler is None:
+            return self.preset
+        return self.scheduler.preset_for(
+            "upscale", [(info['width'] * self.scale, info['height'] * self.scale)], info['frame_count'], self.preset
+        )
+    
+    def encode_video_stream(self, frames, info: Dict):
+        """Encodes frames as they arrive, with source timing and stream-copied source audio."""
+        output_video = self._output_path()
+        height, width = info['height'] * self.scale, info['width'] * self.scale
+        timestamps = probe_frame_timestamps(self.video_path) if info.get('variable_frame_rate') else None
+        
+        print(f"Encoding upscaled video at {info['fps_fraction']} fps"
+              f"{' (VFR timestamps)' if timestamps else ''} while upscaling...")
+        
+        with Frame_Writer(str(output_video), width, height, info['fps_fraction'],
+                          crf=18, preset=self._encode_preset(info), pix_fmt="bgr24",
+                          timestamps=timestamps, audio_source=self.audio_source,
+                          live_path=self.live_path) as writer:
+            for frame in frames:
+                writer.write(frame)
+        
+        print(f"Video encoded: {output_video}")
+        return str(output_video)
     
     def run_full_analysis(self):
         print("Starting video upscaling pipeline")
         print("="*60)
         
-        print("\n[1/5] Loading Real-ESRGAN model")
+        print("\n[1/4] Loading Real-ESRGAN model")
         model_path = self.load_model()
         
-        print("\n[2/5] Extracting frames as PNG sequence")
-        frames_dir = self.extract_frames()
+        print("\n[2/4] Decoding frames")
+        info = probe_video(self.video_path)
+        chunks = self.iter_frame_chunks(info)
         
-        print("\n[3/5] Batch processing with GPU inference")
-        upscaled_frames = self.batch_process_gpu(frames_dir)
+        print("\n[3/4] Batch processing with GPU inference")
+        self._reset_tile_counters()
+        detector = Tile_Change_Detector(self.tile_size, self.tile_tolerance) if self.skip_static_tiles else None
+        first_result = self.upscale_chunk(next(chunks, []), 0, detector)
         
-        if upscaled_frames is None:
+        if first_result is None:
+            chunks.close()
             print("Upscaling skipped (binary missing). Returning original video.")
             return {
                 'video_name': self.video_name,
@@ -151,12 +369,13 @@ class Upscaling_Generator:
                 'skipped': True
             }
         
-        print("\n[4/5] Applying 4x upscale")
+        upscaled_frames = self.stream_upscaled_frames(first_result, chunks, detector)
         
-        final_frames = self.upscale_4x(upscaled_frames)
-        
-        print("\n[5/5] Encoding back to video")
-        output_video = self.encode_video(final_frames)
+        print("\n[4/4] Encoding back to video (concurrently with upscaling)")
+        try:
+            output_video = self.encode_video_stream(upscaled_frames, info)
+        finally:
+            chunks.close()
         
         print("\nUPSCALING COMPLETE!")
         
@@ -165,13 +384,16 @@ class Upscaling_Generator:
             'output_video': output_video,
             'model_used': self.model_name,
             'scale_factor': '4x',
-            'resolution': '1920p'
+            'resolution': '1920p',
+            'tile_stats': self.tile_stats
         }
 
 
 class Interpolation_Generator:
     
-    def __init__(self, video_path: str, target_fps: int = 60):
+    def __init__(self, video_path: str, target_fps: int = 60, backend: Optional[str] = None,
+                 batch_size: int = 4, scheduler: Optional[Preset_Scheduler] = None,
+                 throughput_cache: Optional[Backend_Throughput_Cache] = None):
         self.video_path = video_path
         path = Path(video_path)
         self.video_name = path.stem
@@ -182,6 +404,12 @@ class Interpolation_Generator:
         self.interpolation_root.mkdir(exist_ok=True)
         
         self.target_fps = target_fps
+        self.backend_name = backend
+        self.batch_size = batch_size
+        self.backend_throughput = {}
+        self.scheduler = scheduler
+        # Measured backend speeds per host and resolution; created on first measurement
+        self.throughput_cache = throughput_cache
         
         print("video name:", self.video_name)
         print(f"Target FPS: {target_fps}")
@@ -206,53 +434,73 @@ class Interpolation_Generator:
         print(f"Loading RIFE model...")
         return str(model_dir)
     
-    def read_frame_pairs(self):
-        frames_dir = self.interpolation_root / "frame_pairs" / self.video_name
-        frames_dir.mkdir(parents=True, exist_ok=True)
-        
-        print(f"Reading frame pairs for interpolation...")
-        
-        cap = cv2.VideoCapture(self.video_path)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        cap.release()
-        
-        print(f"Total frames: {frame_count}")
-        return str(frames_dir), frame_count
-    
-    def generate_intermediate_frames(self, frames_dir: str, frame_count: int):
-        intermediate_dir = self.interpolation_root / "intermediate_frames" / self.video_name
-        intermediate_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Check if RIFE binary exists in path
-        rife_cmd = "rife-ncnn-vulkan"
-        if not shutil.which(rife_cmd):
-            print(f"WARNING: {rife_cmd} not found in PATH. Skipping frame interpolation.")
-            return None
-
-        print(f"Generating intermediate frames with RIFE...")
-        
-        command = [
-            rife_cmd,
-            '-i', self.video_path, # Original command used self.video_path as input
-            '-o', str(intermediate_dir),
-            '-m', 'rife-v4.6', # Original command included model name
-            '-n', str(frame_count) # Original command included frame count
+    def available_backends(self, model_dir: str):
+        backends = [
+            Torch_RIFE_Backend(str(Path(model_dir) / "flownet.pkl"), batch_size=self.batch_size),
+            RIFE_NCNN_Backend(work_root=str(self.interpolation_root)),
+            Minterpolate_Backend()
         ]
-        
+        return [backend for backend in backends if backend.is_available()]
+    
+    def select_backend(self, model_dir: str, info: Dict):
+        backends = self.available_backends(model_dir)
+        if not backends:
+            raise RuntimeError("No interpolation backend available")
+        
+        if self.backend_name:
+            for backend in backends:
+                if backend.name == self.backend_name:
+                    print(f"Using requested backend: {backend.name}")
+                    return backend
+            print(f"WARNING: backend {self.backend_name} not available, measuring the others")
+        
+        if len(backends) == 1:
+            print(f"Using only available backend: {backends[0].name}")
+            return backends[0]
+        
+        print("Measuring interpolation throughput...")
+        if self.throughput_cache is None:
+            self.throughput_cache = Backend_Throughput_Cache()
+        # Every backend runs end to end on the same short clip cut from the source
+        frames = min(THROUGHPUT_SAMPLE_FRAMES, info['frame_count'] or THROUGHPUT_SAMPLE_FRAMES)
+        sample_info = dict(info, frame_count=frames, duration=frames / info['fps'])
+        work_dir = self.interpolation_root / "throughput_probe" / self.video_name
+        sample_clip = None
+        
+        best_backend, best_fps = backends[0], -1.0
         try:
-            subprocess.run(command, check=True, capture_output=True)
-            print("Intermediate frames generated")
-            return str(intermediate_dir)
-        except subprocess.CalledProcessError as e:
-            print(f"Error running RIFE: {e.stderr.decode()}")
-            return None
+            for backend in backends:
+                key = self.throughput_cache.key(backend.name, info, self.target_fps)
+                fps = self.throughput_cache.get(key)
+                if fps is None:
+                    if sample_clip is None:
+                        work_dir.mkdir(parents=True, exist_ok=True)
+                        sample_path = work_dir / f"sample{self.video_format}"
+                        sample_clip = cut_sample_clip(self.video_path, str(sample_path), frames)
+                    try:
+                        fps = backend.measure_throughput(sample_clip, sample_info, self.target_fps, work_dir)
+                    except (RuntimeError, subprocess.CalledProcessError) as e:
+                        print(f"  {backend.name}: failed ({e})")
+                        continue
+                    self.throughput_cache.put(key, fps)
+                    print(f"  {backend.name}: {fps:.1f} frames/s")
+                else:
+                    print(f"  {backend.name}: {fps:.1f} frames/s (cached)")
+                self.backend_throughput[backend.name] = fps
+                if fps > best_fps:
+                    best_backend, best_fps = backend, fps
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        print(f"Selected backend: {best_backend.name}")
+        return best_backend
     
     def interpolate_to_60fps(self, source_fps: float):
         multiplier = self.target_fps / source_fps
         print(f"Interpolation multiplier: {multiplier:.2f}x")
         return multiplier
     
-    def encode_interpolated_video(self):
+    def _output_path(self):
         output_dir = self.interpolation_root / "final_videos"
         output_dir.mkdir(exist_ok=True)
         
@@ -261,32 +509,29 @@ class Interpolation_Generator:
         hash_object = hashlib.sha256(time_bits)
         current_time_hash = hash_object.hexdigest()[:8]
         
-        output_video = output_dir / f"{self.video_name}_interpolated_{current_time_hash}.mp4"
-        
-        print(f"Encoding interpolated video at {self.target_fps}fps...")
-        
-        command = [
-            "ffmpeg",
-            "-i", self.video_path,
-            "-filter:v", f"minterpolate='mi_mode=mci:mc_mode=aobmc:vsbmc=1:fps={self.target_fps}'",
-            "-c:v", "libx264",
-            "-preset", "medium",
-            "-crf", "18",
-            str(output_video)
-        ]
-        
-        try:
-            subprocess.run(command, check=True, capture_output=True)
-            print(f"Video encoded: {output_video}")
-            return str(output_video)
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Video encoding error: {e.stderr.decode()}")
+        return output_dir / f"{self.video_name}_interpolated_{current_time_hash}.mp4"
+    
+    def encode_interpolated_video(self, backend: Optional[Interpolation_Backend] = None, info: Optional[Dict] = None):
+        output_video = self._output_path()
+        backend = backend or Minterpolate_Backend()
+        info = info or probe_video(self.video_path)
+        if self.scheduler is not None:
+            backend.preset = self.scheduler.preset_for(
+                "interpolate", [(info['width'], info['height'])], int(info['duration'] * self.target_fps),
+                backend.preset
+            )
+        
+        print(f"Encoding interpolated video at {self.target_fps}fps with {backend.name}...")
+        
+        backend.interpolate(self.video_path, str(output_video), info, self.target_fps)
+        print(f"Video encoded: {output_video}")
+        return str(output_video)
     
     def run_full_analysis(self):
         print("Starting frame interpolation pipeline")
         print("="*60)
         
-        print("\n[0/5] Checking FPS")
+        print("\n[0/4] Checking FPS")
         needs_interpolation, current_fps = self.check_fps()
         
         if not needs_interpolation:
@@ -297,20 +542,18 @@ class Interpolation_Generator:
                 'current_fps': current_fps
             }
         
-        print("\n[1/5] Loading RIFE model")
+        print("\n[1/4] Loading RIFE model")
         model_path = self.load_rife_model()
         
-        print("\n[2/5] Reading frame pairs")
-        frames_dir, frame_count = self.read_frame_pairs()
+        print("\n[2/4] Selecting interpolation backend")
+        info = probe_video(self.video_path)
+        backend = self.select_backend(model_path, info)
         
-        print("\n[3/5] Generating intermediate frames")
-        intermediate_dir = self.generate_intermediate_frames(frames_dir, frame_count)
+        print("\n[3/4] Interpolating to 60fps")
+        multiplier = self.interpolate_to_60fps(info['fps'] or current_fps)
         
-        print("\n[4/5] Interpolating to 60fps")
-        multiplier = self.interpolate_to_60fps(current_fps)
-        
-        print("\n[5/5] Encoding interpolated video")
-        output_video = self.encode_interpolated_video()
+        print("\n[4/4] Streaming frame pairs through backend")
+        output_video = self.encode_interpolated_video(backend, info)
         
         print("\nINTERPOLATION COMPLETE!")
         
@@ -319,13 +562,17 @@ class Interpolation_Generator:
             'output_video': output_video,
             'original_fps': current_fps,
             'target_fps': self.target_fps,
-            'multiplier': multiplier
+            'multiplier': multiplier,
+            'backend': backend.name,
+            'backend_throughput': self.backend_throughput
         }
 
 
 class Denoising_Generator:
     
-    def __init__(self, video_path: str, noise_threshold: float = 100.0):
+    def __init__(self, video_path: str, noise_threshold: float = 2.0, sample_count: int = 60,
+                 segment_seconds: float = 10.0, preset: str = "medium",
+                 scheduler: Optional[Preset_Scheduler] = None):
         self.video_path = video_path
         path = Path(video_path)
         self.video_name = path.stem
@@ -335,48 +582,128 @@ class Denoising_Generator:
         self.denoising_root = script_dir / "denoising_results"
         self.denoising_root.mkdir(exist_ok=True)
         
+        # noise_threshold is a noise sigma in 8-bit luma levels
         self.noise_threshold = noise_threshold
+        self.sample_count = sample_count
+        self.segment_seconds = segment_seconds
+        self.preset = preset
+        self.scheduler = scheduler
+        self.segments = None
+        self.noise_level = None
         
         print("video name:", self.video_name)
         print(f"Noise threshold: {noise_threshold}")
     
-    def check_noise_level(self):
-        print("Analyzing noise level...")
-        
+    @staticmethod
+    def estimate_noise_sigma(frames: np.ndarray) -> np.ndarray:
+        """Per-frame noise sigma from the MAD of the diagonal Haar (HH) subband.
+
+        frames is an (N, H, W) stack of luma planes. The HH residual is almost
+        free of image structure, so unlike Laplacian variance it does not
+        confuse blur (low) or texture (high) with noise.
+        """
+        frames = np.asarray(frames, dtype=np.float32)
+        height, width = frames.shape[1] // 2 * 2, frames.shape[2] // 2 * 2
+        frames = frames[:, :height, :width]
+        hh = (frames[:, 0::2, 0::2] - frames[:, 0::2, 1::2]
+              - frames[:, 1::2, 0::2] + frames[:, 1::2, 1::2]) / 2.0
+        residual = np.abs(hh.reshape(hh.shape[0], -1))
+        return np.median(residual, axis=1) / 0.6745
+    
+    def sample_frames(self):
         cap = cv2.VideoCapture(self.video_path)
-        noise_scores = []
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
         
-        for i in range(10):
+        positions = np.unique(np.linspace(0, max(frame_count - 1, 0), self.sample_count).astype(int))
+        gray_frames, timestamps = [], []
+        for position in positions:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
             ret, frame = cap.read()
             if not ret:
-                break
-            
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            variance = laplacian.var()
-            noise_scores.append(variance)
+                continue
+            gray_frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            timestamps.append(position / fps)
         
         cap.release()
+        return gray_frames, np.array(timestamps), frame_count / fps if fps else 0.0
+    
+    def _strength_for_sigma(self, sigma: float) -> Optional[Dict]:
+        if sigma < self.noise_threshold:
+            return None
+        # Quantized to half steps so neighbouring segments share one filter instance
+        luma_spatial = round(float(np.clip(sigma * 0.8, 1.5, 10.0)) * 2) / 2
+        return {
+            'luma_spatial': luma_spatial,
+            'chroma_spatial': round(luma_spatial * 0.75, 1),
+            'luma_tmp': round(luma_spatial * 1.5, 1),
+            'chroma_tmp': round(luma_spatial * 1.125, 1)
+        }
+    
+    def check_noise_level(self):
+        if self.segments is not None:
+            return any(seg['strength'] for seg in self.segments), self.noise_level
         
-        avg_noise = sum(noise_scores) / len(noise_scores) if noise_scores else 0
+        print("Analyzing noise level...")
         
-        print(f"Average noise level: {avg_noise:.2f}")
+        gray_frames, timestamps, duration = self.sample_frames()
+        if not gray_frames:
+            self.segments = []
+            self.noise_level = 0.0
+            print("No frames could be sampled, skipping denoising")
+            return False, 0.0
+        
+        sigmas = self.estimate_noise_sigma(np.stack(gray_frames))
+        segment_ids = (timestamps // self.segment_seconds).astype(int)
+        segment_count = max(int(np.ceil(duration / self.segment_seconds)), int(segment_ids.max()) + 1)
+        
+        # Every segment of the timeline gets a sigma: on sources longer than
+        # sample_count * segment_seconds most segments hold no sample and take
+        # the one nearest to their centre, so a uniformly noisy file is one run
+        segments = []
+        for segment_id in range(segment_count):
+            start = float(segment_id * self.segment_seconds)
+            inside = segment_ids == segment_id
+            if inside.any():
+                sigma = float(np.median(sigmas[inside]))
+            else:
+                sigma = float(sigmas[np.argmin(np.abs(timestamps - (start + self.segment_seconds / 2)))])
+            segments.append({
+                'start': start,
+                'end': float(min(start + self.segment_seconds, max(duration, start))),
+                'sigma': sigma,
+                'strength': self._strength_for_sigma(sigma)
+            })
+        segments[-1]['end'] = max(segments[-1]['end'], float(duration))
+        self.segments = segments
+        
+        noise_level = float(np.median(sigmas))
+        self.noise_level = noise_level
+        noisy = [seg for seg in segments if seg['strength']]
+        
+        print(f"Median noise sigma: {noise_level:.2f} over {len(sigmas)} sampled frames")
         print(f"Threshold: {self.noise_threshold}")
+        print(f"Noisy segments: {len(noisy)}/{len(segments)}")
         
-        needs_denoising = avg_noise < self.noise_threshold
+        needs_denoising = bool(noisy)
         
         if not needs_denoising:
             print("Noise level below threshold, skipping denoising")
         
-        return needs_denoising, avg_noise
+        return needs_denoising, noise_level
     
     def configure_denoiser(self):
         config_dir = self.denoising_root / "config"
         config_dir.mkdir(exist_ok=True)
         
+        segments = self.segments or []
+        clean = [seg for seg in segments if not seg['strength']]
         config = {
-            'temporal_radius': 3,
-            'strength': 7,
+            'estimator': 'haar_hh_mad',
+            'noise_threshold': self.noise_threshold,
+            'segment_seconds': self.segment_seconds,
+            'clean_fraction': len(clean) / len(segments) if segments else 1.0,
+            'segments': segments,
             'adaptive_filtering': True,
             'preserve_edges': True
         }
@@ -388,6 +715,71 @@ class Denoising_Generator:
         print(f"Denoiser configured: {config_file}")
         return config
     
+    def _noisy_runs(self):
+        runs = []
+        for seg in self.segments or []:
+            if not seg['strength']:
+                continue
+            if runs and runs[-1]['strength'] == seg['strength'] and abs(runs[-1]['end'] - seg['start']) < 1e-6:
+                runs[-1]['end'] = seg['end']
+            else:
+                runs.append(dict(seg))
+        return runs
+    
+    def build_filter(self, start: float = 0.0, end: Optional[float] = None) -> str:
+        """One hqdn3d instance per strength, timeline-gated to the runs using it.
+
+        Frames outside a noisy run pass through the filter untouched. For a
+        piece cut out of the source at start, the gates are shifted onto the
+        piece's own timeline and limited to it.
+        """
+        gates = {}
+        for run in self._noisy_runs():
+            run_start = max(run['start'], start)
+            run_end = run['end'] if end is None else min(run['end'], end)
+            if run_end <= run_start:
+                continue
+            strength = run['strength']
+            key = (strength['luma_spatial'], strength['chroma_spatial'], strength['luma_tmp'], strength['chroma_tmp'])
+            gates.setdefault(key, []).append(f"between(t,{run_start - start:.3f},{run_end - start:.3f})")
+        return ",".join(
+            f"hqdn3d={':'.join(str(value) for value in key)}:enable='{'+'.join(between)}'"
+            for key, between in gates.items()
+        )
+    
+    def plan_pieces(self, keyframes, frame_times, duration: float):
+        """Splits the video into pieces to stream-copy and pieces to re-encode.
+
+        Each noisy run is widened out to the source keyframes around it, so
+        every clean piece in between starts on a keyframe and ends where the
+        next re-encoded piece starts on one. The widening only re-encodes a
+        few clean frames; the filter stays gated to the noisy run. Clean
+        pieces carry their frame count: a stream copy cut by time is checked
+        against decode timestamps and would take the next keyframe along.
+        """
+        noisy = []
+        for run in self._noisy_runs():
+            start = max((k for k in keyframes if k <= run['start'] + 1e-6), default=0.0)
+            end = min((k for k in keyframes if k >= run['end'] - 1e-6), default=duration)
+            if noisy and start <= noisy[-1]['end']:
+                noisy[-1]['end'] = max(noisy[-1]['end'], end)
+            else:
+                noisy.append({'start': start, 'end': end, 'denoise': True})
+        
+        pieces, position = [], 0.0
+        for piece in noisy:
+            if piece['start'] > position:
+                pieces.append({'start': position, 'end': piece['start'], 'denoise': False})
+            pieces.append(piece)
+            position = piece['end']
+        if position < duration:
+            pieces.append({'start': position, 'end': duration, 'denoise': False})
+        
+        for piece in pieces:
+            if not piece['denoise']:
+                piece['frames'] = sum(1 for t in frame_times if piece['start'] - 1e-6 <= t < piece['end'] - 1e-6)
+        return pieces
+    
     def temporal_analysis_motion_vectors(self):
         analysis_dir = self.denoising_root / "temporal_analysis"
         analysis_dir.mkdir(exist_ok=True)
@@ -420,29 +812,53 @@ class Denoising_Generator:
         
         return str(filtered_dir)
     
-    def output_clean_video(self):
-        output_dir = self.denoising_root / "final_videos"
-        output_dir.mkdir(exist_ok=True)
-        
-        current_time_string = datetime.datetime.now().isoformat()
-        time_bits = current_time_string.encode('utf-8')
-        hash_object = hashlib.sha256(time_bits)
-        current_time_hash = hash_object.hexdigest()[:8]
-        
-        output_video = output_dir / f"{self.video_name}_denoised_{current_time_hash}.mp4"
+    def _encode_preset(self, info: Dict, frame_count: int) -> str:
+        if self.scheduler is None:
+            return self.preset
+        return self.scheduler.preset_for("denoise", [(info['width'], info['height'])], frame_count, self.preset)
+    
+    def _encode_piece(self, piece: Dict, piece_path: Path, preset: str, info: Dict):
+        command = [
+            "ffmpeg",
+            "-v", "error",
+            "-y",
+            "-ss", f"{piece['start']:.6f}",
+            "-i", self.video_path,
+            "-map", "0:v:0"
+        ]
+        if piece['denoise']:
+            # Pinned to the source's profile, level and pixel format so the
+            # spliced stream keeps one set of SPS parameters throughout
+            command.extend([
+                "-t", f"{piece['end'] - piece['start']:.6f}",
+                "-vf", self.build_filter(piece['start'], piece['end']),
+                "-c:v", "libx264",
+                "-preset", preset,
+                "-crf", "18",
+                "-profile:v", X264_PROFILES[info['profile']],
+                "-level:v", f"{info['level'] / 10:.1f}",
+                "-pix_fmt", info['pix_fmt']
+            ])
+        else:
+            command.extend(["-frames:v", str(piece['frames']), "-c", "copy"])
+        command.extend(["-f", "mpegts", str(piece_path)])
         
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Video encoding error: {e.stderr.decode()}")
+    
+    def _encode_whole(self, info: Dict, output_video: Path) -> str:
         print(f"Encoding denoised video...")
-        
         command = [
             "ffmpeg",
             "-i", self.video_path,
-            "-vf", "hqdn3d=4:3:6:4.5",
+            "-vf", self.build_filter(),
             "-c:v", "libx264",
-            "-preset", "medium",
+            "-preset", self._encode_preset(info, info['frame_count']),
             "-crf", "18",
             str(output_video)
         ]
-        
         try:
             subprocess.run(command, check=True, capture_output=True)
             print(f"Clean video saved: {output_video}")
@@ -450,6 +866,96 @@ class Denoising_Generator:
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"Video encoding error: {e.stderr.decode()}")
     
+    def output_clean_video(self):
+        """Re-encodes only the noisy stretches; clean stretches are stream-copied.
+
+        Pieces are cut on source keyframes (see plan_pieces), written as
+        MPEG-TS and joined with the concat demuxer; the source audio is copied
+        in. Re-encoded pieces are pinned to the source's H.264 profile, level
+        and pixel format, and each one is probed before splicing: if any of
+        those parameters (or the frame size) still differ, or the source is
+        not H.264 with a profile libx264 can produce, the video is re-encoded
+        whole instead, with the filter gated to the noisy segments.
+        """
+        if not any(seg['strength'] for seg in self.segments or []):
+            print("No noisy segments, keeping the source video")
+            return self.video_path
+        
+        output_dir = self.denoising_root / "final_videos"
+        output_dir.mkdir(exist_ok=True)
+        
+        current_time_string = datetime.datetime.now().isoformat()
+        time_bits = current_time_string.encode('utf-8')
+        hash_object = hashlib.sha256(time_bits)
+        current_time_hash = hash_object.hexdigest()[:8]
+        
+        output_video = output_dir / f"{self.video_name}_denoised_{current_time_hash}.mp4"
+        
+        info = probe_video(self.video_path)
+        spliceable = (info.get('codec') == "h264" and info.get('profile') in X264_PROFILES
+                      and bool(info.get('level')) and bool(info.get('pix_fmt')))
+        keyframes = probe_keyframe_times(self.video_path) if spliceable else []
+        if not keyframes:
+            return self._encode_whole(info, output_video)
+        
+        pieces = self.plan_pieces(keyframes, probe_frame_timestamps(self.video_path), info['duration'])
+        encoded_seconds = sum(piece['end'] - piece['start'] for piece in pieces if piece['denoise'])
+        preset = self._encode_preset(
+            info, int(info['frame_count'] * encoded_seconds / info['duration']) if info['duration'] else info['frame_count']
+        )
+        
+        print(f"Encoding denoised video: re-encoding {encoded_seconds:.1f}s of {info['duration']:.1f}s, "
+              f"copying the rest...")
+        
+        pieces_dir = self.denoising_root / "pieces" / self.video_name
+        shutil.rmtree(pieces_dir, ignore_errors=True)
+        pieces_dir.mkdir(parents=True)
+        try:
+            piece_paths = []
+            for index, piece in enumerate(pieces):
+                piece_path = pieces_dir / f"piece_{index:04d}.ts"
+                self._encode_piece(piece, piece_path, preset, info)
+                piece_paths.append(piece_path)
+                if piece['denoise']:
+                    piece_info = probe_video(str(piece_path))
+                    mismatched = [name for name in SPLICE_PARAMETERS if piece_info.get(name) != info.get(name)]
+                    if mismatched:
+                        print(f"Re-encoded piece differs from the source in {', '.join(mismatched)}, "
+                              f"re-encoding the whole video instead")
+                        spliceable = False
+                        break
+            
+            if spliceable:
+                concat_list = pieces_dir / "pieces.txt"
+                with open(concat_list, 'w') as f:
+                    f.writelines(f"file '{piece_path}'\n" for piece_path in piece_paths)
+                
+                command = [
+                    "ffmpeg",
+                    "-v", "error",
+                    "-y",
+                    "-f", "concat",
+                    "-safe", "0",
+                    "-i", str(concat_list),
+                    "-i", self.video_path,
+                    "-map", "0:v:0",
+                    "-map", "1:a:0?",
+                    "-c", "copy",
+                    str(output_video)
+                ]
+                try:
+                    subprocess.run(command, check=True, capture_output=True)
+                except subprocess.CalledProcessError as e:
+                    raise RuntimeError(f"Video encoding error: {e.stderr.decode()}")
+        finally:
+            shutil.rmtree(pieces_dir, ignore_errors=True)
+        
+        if not spliceable:
+            return self._encode_whole(info, output_video)
+        
+        print(f"Clean video saved: {output_video}")
+        return str(output_video)
+    
     def run_full_analysis(self):
         print("Starting video denoising pipeline")
         print("="*60)
@@ -462,7 +968,8 @@ class Denoising_Generator:
                 'video_name': self.video_name,
                 'skipped': True,
                 'reason': 'Noise level below threshold',
-                'noise_level': noise_level
+                'noise_level': noise_level,
+                'segments': self.segments
             }
         
         print("\n[1/4] Configuring denoiser")
@@ -489,14 +996,26 @@ class Denoising_Generator:
 
 class Video_Enhancement_Pipeline:
     
-    def __init__(self, video_path: str):
+    def __init__(self, video_path: str, live_path: Optional[str] = None,
+                 scheduler: Optional[Preset_Scheduler] = None):
         self.video_path = video_path
         path = Path(video_path)
         self.video_name = path.stem
+        self.scheduler = scheduler
         
-        self.upscaler = Upscaling_Generator(video_path)
-        self.interpolator = Interpolation_Generator(video_path)
-        self.denoiser = Denoising_Generator(video_path)
+        self.upscaler = Upscaling_Generator(video_path, live_path=live_path, scheduler=scheduler)
+        self.interpolator = Interpolation_Generator(video_path, scheduler=scheduler)
+        self.denoiser = Denoising_Generator(video_path, scheduler=scheduler)
+    
+    def plan_encodes(self):
+        """Reserves deadline time for the encodes that follow denoising."""
+        info = probe_video(self.video_path)
+        target_fps = self.interpolator.target_fps
+        frames = int(info['duration'] * max(info['fps'], target_fps))
+        size = (info['width'], info['height'])
+        if info['fps'] < target_fps:
+            self.scheduler.plan("interpolate", [size], frames)
+        self.scheduler.plan("upscale", [(size[0] * self.upscaler.scale, size[1] * self.upscaler.scale)], frames)
     
     def run_full_enhancement(self):
         print("\n" + "="*60)
@@ -506,6 +1025,8 @@ class Video_Enhancement_Pipeline:
         
         current_video = self.video_path
         results = {'original_video': self.video_path}
+        if self.scheduler is not None:
+            self.plan_encodes()
         
         print("\n[PHASE 1] Checking noise level")
         needs_denoising, noise_level = self.denoiser.check_noise_level()
@@ -1,11 +1,28 @@
 import pytest
+import subprocess
+import numpy as np
+import torch
+from src.utility_classes.audio_processing import Audio_Source
+from src.utility_classes.caption_cache import Caption_Cache, audio_fingerprint
 from src.utility_classes.caption_generation import Caption_Generator, TranscriptSegment
+from src.utility_classes.model_registry import Whisper_Model_Registry, get_model_registry
+from src.utility_classes.transcription_backends import benchmark_backends, create_backend
+
+
+@pytest.fixture(autouse=True)
+def clear_model_registry():
+    get_model_registry().clear()
+    yield
+    get_model_registry().clear()
+
 
 class TestCaptionGenerator:
     
     @pytest.fixture
-    def captioneer(self, mock_video_path):
-        return Caption_Generator(mock_video_path)
+    def captioneer(self, mock_video_path, tmp_path):
+        captioneer = Caption_Generator(mock_video_path)
+        captioneer.captions_root = tmp_path
+        return captioneer
 
     @pytest.mark.parametrize("seconds,expected", [
         (3661.5, "01:01:01,500"),
@@ -65,12 +82,359 @@ class TestCaptionGenerator:
         assert segments[0].text == "Test caption"
 
     def test_full_pipeline_flow(self, captioneer, mocker):
-        mocker.patch.object(captioneer, 'extract_audio', return_value="test.wav")
-        mocker.patch.object(captioneer, 'transcribe_audio', return_value=[])
+        extract = mocker.patch.object(captioneer, 'extract_audio', return_value="test.wav")
+        mocker.patch.object(captioneer, 'transcribe_source', return_value=[])
         mocker.patch.object(captioneer, 'generate_srt', return_value="test.srt")
         mocker.patch.object(captioneer, 'generate_vtt', return_value="test.vtt")
-        mocker.patch('os.remove')
-        mocker.patch('os.path.exists', return_value=True)
         res = captioneer.run_full_analysis()
         assert res['srt_path'] == "test.srt"
         assert res['vtt_path'] == "test.vtt"
+        extract.assert_not_called()
+
+    def test_transcribe_source_offsets_windows(self, captioneer, mocker):
+        mock_model = mocker.Mock()
+        mock_model.transcribe.return_value = {
+            'segments': [{'start': 1.0, 'end': 2.0, 'text': ' Hi'}]
+        }
+        mocker.patch('whisper.load_model', return_value=mock_model)
+        captioneer.skip_non_speech = False
+        source = mocker.Mock()
+        source.windows.return_value = iter([(0.0, np.zeros(16000 * 3, np.float32)),
+                                            (1200.0, np.zeros(16000 * 3, np.float32))])
+        segments = captioneer.transcribe_source(source)
+        assert [(s.start, s.end) for s in segments] == [(1.0, 2.0), (1201.0, 1202.0)]
+        assert isinstance(mock_model.transcribe.call_args[0][0], np.ndarray)
+
+    def test_chunked_transcription_stitches_offsets(self, mock_video_path, mocker, tmp_path):
+        mock_model = mocker.Mock()
+        mock_model.transcribe.return_value = {
+            'segments': [{'start': 1.0, 'end': 3.0, 'text': ' Chunk'}]
+        }
+        mocker.patch('whisper.load_model', return_value=mock_model)
+        captioneer = Caption_Generator(mock_video_path, chunked=True, workers=1, skip_non_speech=False)
+        captioneer.captions_root = tmp_path
+        
+        audio = np.full(16000 * 70, 0.1, dtype=np.float32)
+        audio[16000 * 25:16000 * 26] = 0.0
+        audio[16000 * 50:16000 * 51] = 0.0
+        segments = captioneer.transcribe_chunked(audio, offset=100.0)
+        
+        assert mock_model.transcribe.call_count == 3
+        assert [round(s.start) for s in segments] == [101, 126, 151]
+        path = captioneer.generate_srt(segments)
+        with open(path) as f:
+            assert "\n00:02:06," in f.read()
+
+    def test_non_speech_is_not_transcribed(self, captioneer, mocker):
+        mock_model = mocker.Mock()
+        mock_model.transcribe.return_value = {'segments': []}
+        mocker.patch('whisper.load_model', return_value=mock_model)
+        audio = np.concatenate([np.zeros(16000 * 5), _music(20), _voice(10), np.zeros(16000 * 5)])
+        source = mocker.Mock()
+        source.windows.return_value = iter([(0.0, audio.astype(np.float32))])
+        
+        captioneer.transcribe_source(source)
+        
+        assert mock_model.transcribe.call_count == 1
+        transcribed = mock_model.transcribe.call_args[0][0]
+        assert 10 * 16000 <= len(transcribed) <= 12 * 16000
+        assert captioneer.skipped_seconds > 25
+
+    def test_segments_clamped_to_audio(self, captioneer, mocker):
+        mock_model = mocker.Mock()
+        mock_model.transcribe.return_value = {
+            'segments': [{'start': 0.5, 'end': 31.0, 'text': ' Overrun'}]
+        }
+        mocker.patch('whisper.load_model', return_value=mock_model)
+        segments = captioneer.transcribe_audio(np.zeros(16000 * 10, np.float32), offset=5.0)
+        assert (segments[0].start, segments[0].end) == (5.5, 15.0)
+
+    def test_cache_hit_skips_transcription(self, captioneer, mocker, tmp_path):
+        captioneer.cache = Caption_Cache(tmp_path / "cache")
+        mocker.patch('src.utility_classes.caption_generation.audio_fingerprint', return_value="packets:abc")
+        transcribe = mocker.patch.object(captioneer, 'transcribe_source',
+                                         return_value=[TranscriptSegment(0.0, 1.5, "Cached")])
+        
+        first = captioneer.run_full_analysis()
+        second = captioneer.run_full_analysis()
+        
+        assert transcribe.call_count == 1
+        assert (first['cache_hit'], second['cache_hit']) == (False, True)
+        with open(second['srt_path']) as f:
+            assert "00:00:00,000 --> 00:00:01,500\nCached" in f.read()
+        
+        captioneer.model_size = "small"
+        assert captioneer.run_full_analysis()['cache_hit'] is False
+
+    def test_cache_separates_streaming_from_unsplit_runs(self, captioneer, mocker, tmp_path):
+        captioneer.cache = Caption_Cache(tmp_path / "cache")
+        mocker.patch('src.utility_classes.caption_generation.audio_fingerprint', return_value="packets:abc")
+        mocker.patch.object(captioneer, 'stream_segments', return_value=iter([TranscriptSegment(0.0, 1.0, "Split")]))
+        transcribe = mocker.patch.object(captioneer, 'transcribe_source',
+                                         return_value=[TranscriptSegment(0.0, 1.0, "Whole")])
+        
+        assert captioneer.run_streaming_analysis()['cache_hit'] is False
+        assert captioneer.run_full_analysis()['cache_hit'] is False
+        assert transcribe.call_count == 1
+        
+        # A chunked full run splits at silences exactly like streaming does
+        captioneer.chunked = True
+        assert captioneer.run_full_analysis()['cache_hit'] is True
+
+    def test_worker_pool_reused_across_windows(self, mock_video_path, mocker):
+        pool = mocker.Mock()
+        pool.submit.side_effect = lambda fn, chunk, offset: mocker.Mock(
+            result=mocker.Mock(return_value=[TranscriptSegment(offset, offset + 1.0, "Chunk")]))
+        executor = mocker.patch('src.utility_classes.caption_generation.ProcessPoolExecutor', return_value=pool)
+        captioneer = Caption_Generator(mock_video_path, chunked=True, workers=2, skip_non_speech=False,
+                                       use_cache=False)
+        source = mocker.Mock()
+        source.windows.return_value = iter([(0.0, np.full(16000 * 3, 0.1, np.float32)),
+                                            (1200.0, np.full(16000 * 3, 0.1, np.float32))])
+        
+        segments = list(captioneer.stream_segments(source))
+        
+        assert [s.start for s in segments] == [0.0, 1200.0]
+        executor.assert_called_once()
+        pool.shutdown.assert_called_once_with()
+
+    def test_streaming_captions_written_before_job_ends(self, captioneer, mocker):
+        mock_model = mocker.Mock()
+        mock_model.transcribe.side_effect = [
+            {'segments': [{'start': 0.0, 'end': 2.0, 'text': ' First'}]},
+            {'segments': [{'start': 0.0, 'end': 2.0, 'text': ' Second'}]}
+        ]
+        mocker.patch('whisper.load_model', return_value=mock_model)
+        source = mocker.Mock()
+        source.windows.return_value = iter([(0.0, np.zeros(16000 * 45, np.float32))])
+        mocker.patch('src.utility_classes.caption_generation.Audio_Source', return_value=source)
+        captioneer.cache = None
+        captioneer.skip_non_speech = False
+        
+        seen = []
+        def on_segment(segment):
+            with open(captioneer.captions_root / "srt_captions" / "test_video.srt") as f:
+                seen.append((segment.text, f.read().count(" --> ")))
+        
+        result = captioneer.run_streaming_analysis(callback=on_segment)
+        
+        assert seen == [("First", 1), ("Second", 2)]
+        assert result['segment_count'] == 2
+        with open(result['vtt_path']) as f:
+            content = f.read()
+        assert content.startswith("WEBVTT\n\n")
+        assert "00:00:19.980 --> 00:00:21.980\nSecond" in content
+
+
+class TestCaptionCache:
+
+    def test_lru_eviction(self, tmp_path):
+        import os
+        cache = Caption_Cache(tmp_path, max_entries=2)
+        for i, key in enumerate(["a", "b"]):
+            cache.put(key, [])
+            os.utime(tmp_path / f"{key}.json", (i, i))
+        assert cache.get("a") is not None
+        cache.put("c", [])
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+
+    def test_concurrent_writers_use_separate_temp_files(self, mocker, tmp_path):
+        import json
+        cache = Caption_Cache(tmp_path)
+        dump = json.dump
+        
+        def dump_while_another_job_writes(obj, f):
+            # A second job stores the same key while this one is half-way through its file
+            if obj['segments'] == ["first"]:
+                cache.put("key", ["second"])
+            dump(obj, f)
+        mocker.patch('src.utility_classes.caption_cache.json.dump', side_effect=dump_while_another_job_writes)
+        
+        cache.put("key", ["first"])
+        
+        assert cache.get("key")['segments'] == ["first"]
+        assert [path.name for path in tmp_path.iterdir()] == ["key.json"]
+
+    def test_key_depends_on_options(self):
+        base = Caption_Cache.make_key("packets:1", {'model_size': 'base'})
+        assert base == Caption_Cache.make_key("packets:1", {'model_size': 'base'})
+        assert base != Caption_Cache.make_key("packets:1", {'model_size': 'small'})
+        assert base != Caption_Cache.make_key("packets:2", {'model_size': 'base'})
+
+    def test_fingerprint_never_decodes_audio(self, mocker):
+        run = mocker.patch('subprocess.run', return_value=mocker.Mock(stdout="SHA256=abc\n"))
+        assert audio_fingerprint("clip.mkv") == "packets:abc"
+        assert run.call_args.args[0][run.call_args.args[0].index("-c") + 1] == "copy"
+        
+        run.side_effect = subprocess.CalledProcessError(1, "ffmpeg")
+        assert audio_fingerprint("silent.mp4") is None
+        assert run.call_count == 2
+
+
+class TestTranscriptionBackends:
+
+    def test_create_backend_validates(self):
+        with pytest.raises(ValueError):
+            create_backend("nope")
+        with pytest.raises(ValueError):
+            create_backend("whisper", compute_type="int8")
+        with pytest.raises(ValueError):
+            create_backend("whisper-int8", device="cuda")
+        with pytest.raises(ValueError):
+            create_backend("whisper", device="cpu", compute_type="float16")
+        assert create_backend("whisper", device="cuda", compute_type="float16").compute_type == "float16"
+
+    def test_int8_backend_uses_quantized_registry_entry(self, mock_video_path, mocker):
+        mock_model = mocker.Mock()
+        mock_model.transcribe.return_value = {'segments': [{'start': 0.0, 'end': 1.0, 'text': ' Hi'}]}
+        mocker.patch('whisper.load_model', return_value=mock_model)
+        quantize = mocker.patch('src.utility_classes.model_registry.quantize_whisper_int8', return_value=mock_model)
+        captioneer = Caption_Generator(mock_video_path, backend="whisper-int8", threads=2)
+        segments = captioneer.transcribe_audio(np.zeros(16000 * 2, np.float32))
+        assert segments == [TranscriptSegment(0.0, 1.0, "Hi")]
+        quantize.assert_called_once()
+        assert get_model_registry().loaded() == [("base", "cpu", "int8")]
+
+    def test_benchmark_reports_rtf(self, mocker):
+        mock_model = mocker.Mock()
+        mock_model.transcribe.return_value = {'segments': []}
+        mocker.patch('whisper.load_model', return_value=mock_model)
+        mocker.patch('src.utility_classes.transcription_backends.WhisperModel', None)
+        results = benchmark_backends(np.zeros(16000 * 4, np.float32), configs=[
+            {'backend': 'whisper'}, {'backend': 'ctranslate2'}
+        ])
+        assert results[0]['audio_seconds'] == 4.0
+        assert results[0]['rtf'] >= 0
+        assert results[1]['error'] == "not available"
+
+
+def _voice(seconds, sample_rate=16000):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    phase = 2 * np.pi * np.cumsum(140 + 20 * np.sin(2 * np.pi * 0.5 * t)) / sample_rate
+    harmonics = sum(np.sin(k * phase) / k for k in range(1, 12))
+    syllables = np.sin(2 * np.pi * 4 * t) > -0.2
+    return 0.2 * harmonics * syllables
+
+
+def _music(seconds, sample_rate=16000):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return 0.15 * sum(np.sin(2 * np.pi * f * t) for f in (220, 277, 330, 440))
+
+
+class TestAudioSource:
+
+    def test_detect_speech_regions(self):
+        from src.utility_classes.audio_processing import detect_speech_regions
+        rng = np.random.default_rng(0)
+        audio = np.concatenate([
+            np.zeros(16000 * 5), _music(20), _voice(10), 0.05 * rng.normal(size=16000 * 5), _voice(5)
+        ]).astype(np.float32)
+        
+        regions = [(start / 16000, end / 16000) for start, end in detect_speech_regions(audio)]
+        assert len(regions) == 2
+        assert regions[0][0] == pytest.approx(25, abs=1) and regions[0][1] == pytest.approx(35, abs=1)
+        assert regions[1][0] == pytest.approx(40, abs=1) and regions[1][1] == pytest.approx(45, abs=1)
+
+    def test_split_at_silences(self):
+        from src.utility_classes.audio_processing import split_at_silences
+        rng = np.random.default_rng(0)
+        audio = rng.normal(0, 0.3, 16000 * 95).astype(np.float32)
+        for pause in (22, 47, 74):
+            audio[16000 * pause:16000 * pause + 8000] = 0.0
+        
+        ranges = split_at_silences(audio)
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(audio)
+        assert all(end - start <= 29 * 16000 for start, end in ranges)
+        for (_, end), pause in zip(ranges[:-1], (22, 47, 74)):
+            assert pause * 16000 <= end <= pause * 16000 + 8000
+
+    def test_windows_are_bounded_float32(self, mocker):
+        import io
+        pcm = (np.arange(5000, dtype=np.int16) - 2500).tobytes()
+        process = mocker.Mock()
+        process.stdout = io.BytesIO(pcm)
+        process.stderr = io.BytesIO(b"")
+        process.poll.return_value = 0
+        process.wait.return_value = 0
+        popen = mocker.patch('subprocess.Popen', return_value=process)
+        
+        source = Audio_Source("clip.mp4", sample_rate=1000, window_seconds=2.0)
+        windows = list(source.windows())
+        
+        assert [offset for offset, _ in windows] == [0.0, 2.0, 4.0]
+        assert [len(audio) for _, audio in windows] == [2000, 2000, 1000]
+        assert windows[0][1].dtype == np.float32
+        assert windows[0][1][0] == -2500 / 32768.0
+        assert source.duration == 5.0
+        assert "s16le" in popen.call_args[0][0]
+
+    def test_windows_raise_on_ffmpeg_failure(self, mocker):
+        import io
+        process = mocker.Mock()
+        process.stdout = io.BytesIO(b"")
+        process.stderr = io.BytesIO(b"no audio stream")
+        process.poll.return_value = 1
+        process.wait.return_value = 1
+        mocker.patch('subprocess.Popen', return_value=process)
+        with pytest.raises(RuntimeError):
+            list(Audio_Source("clip.mp4").windows())
+
+
+class TestWhisperModelRegistry:
+
+    def test_model_reused_across_generators(self, mock_video_path, mocker):
+        load = mocker.patch('whisper.load_model', return_value=mocker.Mock())
+        first = Caption_Generator(mock_video_path)
+        second = Caption_Generator(mock_video_path)
+        first._load_model()
+        second._load_model()
+        assert load.call_count == 1
+        assert first.model is second.model
+
+    def test_keyed_on_device_and_dtype(self, mocker):
+        load = mocker.patch('whisper.load_model', side_effect=lambda *a, **k: mocker.Mock())
+        registry = Whisper_Model_Registry(idle_timeout=None)
+        a = registry.acquire("base", "cpu", "float32")
+        b = registry.acquire("base", "cpu", "float16")
+        assert a is not b
+        assert registry.acquire("base", "cpu", "float32") is a
+        assert load.call_count == 2
+
+    def test_idle_eviction(self, mocker):
+        mocker.patch('whisper.load_model', return_value=mocker.Mock())
+        registry = Whisper_Model_Registry(idle_timeout=10.0)
+        registry.acquire("base")
+        assert registry.evict_idle(now=0.0) == []
+        import time
+        assert registry.evict_idle(now=time.monotonic() + 11.0) == [("base", "cpu", "float32")]
+        assert registry.loaded() == []
+        registry.clear()
+
+    def test_mmap_load_matches_regular_load(self, tmp_path):
+        import whisper
+        from whisper.model import ModelDimensions, Whisper
+        dims = ModelDimensions(n_mels=80, n_audio_ctx=8, n_audio_state=16, n_audio_head=2, n_audio_layer=1,
+                               n_vocab=64, n_text_ctx=8, n_text_state=16, n_text_head=2, n_text_layer=2)
+        checkpoint = tmp_path / "tiny.pt"
+        torch.manual_seed(0)
+        state = {k: torch.randn_like(v) * 0.1 for k, v in Whisper(dims).state_dict().items()}
+        torch.save({'dims': dims.__dict__, 'model_state_dict': state}, checkpoint)
+        
+        registry = Whisper_Model_Registry(idle_timeout=None, mmap_weights=True)
+        mapped = registry.acquire(str(checkpoint))
+        regular = whisper.load_model(str(checkpoint), device="cpu")
+        
+        assert not any(t.is_meta for t in list(mapped.parameters()) + list(mapped.buffers()))
+        mel = torch.randn(1, 80, 16)
+        tokens = torch.tensor([[1, 2, 3]])
+        assert torch.allclose(mapped(mel, tokens), regular(mel, tokens))
+
+    def test_mmap_falls_back_without_private_whisper_helpers(self, mocker, monkeypatch):
+        import whisper
+        monkeypatch.delattr(whisper, "_download")
+        model = mocker.Mock()
+        load = mocker.patch('whisper.load_model', return_value=model)
+        registry = Whisper_Model_Registry(idle_timeout=None, mmap_weights=True, download_root="models")
+        assert registry.acquire("base") is model
+        load.assert_called_once_with("base", device="cpu", download_root="models")
@@ -1,20 +1,38 @@
 import pytest
 import shutil
-from src.utility_classes.video_enchancers import Upscaling_Generator, Interpolation_Generator, Denoising_Generator
+import cv2
+from pathlib import Path
+from src.utility_classes.video_enchancers import Upscaling_Generator, Interpolation_Generator, Denoising_Generator, Tile_Change_Detector
+from src.utility_classes.frame_io import Frame_Writer, matroska_raw_frame, matroska_raw_header, probe_video
+from src.utility_classes.interpolation_backends import (Backend_Throughput_Cache, RIFE_NCNN_Backend, Torch_RIFE_Backend,
+                                                        build_frame_schedule)
+from src.utility_classes.preset_scheduler import Preset_Calibration, Preset_Scheduler
 
 class TestEnhancement:
     
+    @pytest.fixture(autouse=True)
+    def staging_root(self, tmp_path, monkeypatch):
+        # Staged frames would otherwise go to the real tmpfs (or next to the sources)
+        monkeypatch.setattr('src.utility_classes.frame_staging.TMPFS_ROOT', tmp_path / "shm")
+    
     @pytest.fixture
-    def upscaler(self, mock_video_path):
-        return Upscaling_Generator(mock_video_path)
+    def upscaler(self, mock_video_path, tmp_path):
+        upscaler = Upscaling_Generator(mock_video_path)
+        upscaler.upscaling_root = tmp_path
+        return upscaler
         
     @pytest.fixture
-    def interpolator(self, mock_video_path):
-        return Interpolation_Generator(mock_video_path)
+    def interpolator(self, mock_video_path, tmp_path):
+        interpolator = Interpolation_Generator(mock_video_path,
+                                               throughput_cache=Backend_Throughput_Cache(str(tmp_path / "throughput.json")))
+        interpolator.interpolation_root = tmp_path
+        return interpolator
 
     @pytest.fixture
-    def denoiser(self, mock_video_path):
-        return Denoising_Generator(mock_video_path)
+    def denoiser(self, mock_video_path, tmp_path):
+        denoiser = Denoising_Generator(mock_video_path)
+        denoiser.denoising_root = tmp_path
+        return denoiser
 
     def test_upscale_missing_binary(self, upscaler, mocker):
         mocker.patch('shutil.which', return_value=None)
@@ -29,7 +47,8 @@ class TestEnhancement:
         
     def test_upscale_run_full_skip(self, upscaler, mocker):
         mocker.patch.object(upscaler, 'load_model')
-        mocker.patch.object(upscaler, 'extract_frames', return_value="frames_dir")
+        mocker.patch('src.utility_classes.video_enchancers.probe_video', return_value={'width': 2, 'height': 2})
+        mocker.patch.object(upscaler, 'iter_frame_chunks', return_value=(chunk for chunk in []))
         mocker.patch.object(upscaler, 'batch_process_gpu', return_value=None)
         res = upscaler.run_full_analysis()
         assert res['skipped'] is True
@@ -40,17 +59,179 @@ class TestEnhancement:
         u = Upscaling_Generator(mock_video_path, model_name=model_name)
         assert u.model_name == model_name
 
+    def test_tile_detector_flags_only_changed_tiles(self):
+        import numpy as np
+        detector = Tile_Change_Detector(tile_size=16, tolerance=2)
+        frame = np.zeros((32, 48, 3), dtype=np.uint8)
+        assert detector.changed_tiles(frame).all()
+        
+        noisy = frame.copy()
+        noisy[0:16, 0:16] = 1
+        assert not detector.changed_tiles(noisy).any()
+        
+        moved = frame.copy()
+        moved[20, 40] = 200
+        changed = detector.changed_tiles(moved)
+        assert changed.shape == (2, 3)
+        assert changed.sum() == 1 and changed[1, 2]
+
+    def test_static_tiles_reuse_previous_upscale(self, mock_video_path, mocker, tmp_path):
+        import cv2
+        import numpy as np
+        upscaler = Upscaling_Generator(mock_video_path, tile_size=16, tile_halo=4)
+        mocker.patch('src.utility_classes.video_enchancers.select_staging_root', return_value=tmp_path)
+        
+        def upscale_tiles(frames_dir, output_dir):
+            Path(output_dir).mkdir(parents=True)
+            for tile in Path(frames_dir).glob("*.bmp"):
+                upscaled = cv2.resize(cv2.imread(str(tile)), None, fx=4, fy=4, interpolation=cv2.INTER_NEAREST)
+                cv2.imwrite(str(Path(output_dir) / f"{tile.stem}.png"), upscaled)
+            return output_dir
+        mocker.patch.object(upscaler, 'batch_process_gpu', side_effect=upscale_tiles)
+        rng = np.random.default_rng(0)
+        first = rng.integers(0, 255, (32, 40, 3), dtype=np.uint8)
+        second = first.copy()
+        second[2:6, 34:38] = 0
+        
+        upscaler._reset_tile_counters()
+        detector = Tile_Change_Detector(upscaler.tile_size, upscaler.tile_tolerance)
+        result = upscaler.upscale_chunk([("frame_000001", first), ("frame_000002", second)], 0, detector)
+        assert [len(entry['tiles']) for entry in result['plan']] == [6, 1]
+        assert upscaler.tile_stats['tile_skip_fraction'] == pytest.approx(5 / 12)
+        
+        composed = [frame.copy() for _, frame in upscaler._chunk_frames(result, {})]
+        expected = cv2.resize(second, None, fx=4, fy=4, interpolation=cv2.INTER_NEAREST)
+        assert np.array_equal(composed[1], expected)
+
+    def test_frame_writer_sends_vfr_timestamps(self, mocker):
+        import numpy as np
+        mock_popen = mocker.patch('subprocess.Popen')
+        mock_popen.return_value.wait.return_value = 0
+        writer = Frame_Writer("out.mp4", 2, 2, "30/1", pix_fmt="bgr24",
+                              timestamps=[1.0, 1.0 + 1 / 30, 1.1, 1.5], audio_source="source.mp4")
+        with writer:
+            for value in range(5):
+                writer.write(np.full((2, 2, 3), value, dtype=np.uint8))
+        
+        command = mock_popen.call_args.args[0]
+        assert command[command.index("-f") + 1] == "matroska"
+        assert command[command.index("-fps_mode") + 1] == "passthrough"
+        assert "1:a:0?" in command and command[command.index("-c:a") + 1] == "copy"
+        assert writer.frames_written == 5
+        stdin_writes = [call.args[0] for call in mock_popen.return_value.stdin.write.call_args_list]
+        assert stdin_writes[0] == matroska_raw_header(2, 2, "bgr24")
+        # Past the probed timestamps the last frame interval continues
+        assert stdin_writes[1:] == [matroska_raw_frame(bytes([value]) * 12, timestamp)
+                                    for value, timestamp in enumerate([0.0, 1 / 30, 0.1, 0.5, 0.9])]
+
+    def test_vfr_detection_tolerates_rounded_durations(self, mocker):
+        import json
+        def probe(avg):
+            stream = {'width': 2, 'height': 2, 'r_frame_rate': "30000/1001", 'avg_frame_rate': avg, 'duration': "10"}
+            mocker.patch('subprocess.run', return_value=mocker.Mock(stdout=json.dumps({'streams': [stream]})))
+            return probe_video("in.mp4")['variable_frame_rate']
+        
+        assert probe("30000/1001") is False
+        assert probe("2997/100") is False
+        assert probe("24/1") is True
+
+    def test_frame_writer_tees_live_stream(self):
+        writer = Frame_Writer("out.mp4", 2, 2, "30/1", live_path="live.ts")
+        command = writer._build_command()
+        assert command[command.index("-map") + 1] == "0:v:0"
+        assert command[command.index("-f", command.index("-pix_fmt", 10)) + 1] == "tee"
+        assert command[-1] == "[f=mp4]out.mp4|[f=mpegts:onfail=ignore]live.ts"
+
+    def test_upscaler_streams_chunks_into_encoder(self, upscaler, mocker):
+        import numpy as np
+        frames = [(f"frame_{i:06d}", np.full((2, 2, 3), i, dtype=np.uint8)) for i in range(5)]
+        upscaler.chunk_frames = 2
+        mocker.patch.object(upscaler, 'iter_frame_chunks',
+                            return_value=iter([frames[0:2], frames[2:4], frames[4:5]]))
+        mocker.patch.object(upscaler, 'upscale_chunk',
+                            side_effect=lambda chunk, index, detector: {'chunk': chunk})
+        mocker.patch.object(upscaler, '_chunk_frames',
+                            side_effect=lambda result, state: iter(result['chunk']))
+        
+        chunks = upscaler.iter_frame_chunks({'width': 2, 'height': 2})
+        first = upscaler.upscale_chunk(next(chunks), 0, None)
+        streamed = list(upscaler.stream_upscaled_frames(first, chunks, None))
+        assert [int(frame[0, 0, 0]) for frame in streamed] == [0, 1, 2, 3, 4]
+
+    def test_upscaler_stages_one_chunk_at_a_time(self, upscaler, mocker, tmp_path):
+        import numpy as np
+        reader = mocker.patch('src.utility_classes.video_enchancers.Frame_Reader')
+        reader.return_value.__enter__.return_value = iter(
+            [np.full((2, 2, 3), i, dtype=np.uint8) for i in range(5)])
+        staging = mocker.patch('src.utility_classes.video_enchancers.select_staging_root', return_value=tmp_path)
+        mocker.patch.object(upscaler, 'batch_process_gpu', return_value=None)
+        upscaler.chunk_frames = 2
+        
+        chunks = list(upscaler.iter_frame_chunks({'width': 2, 'height': 2}))
+        upscaler.upscale_chunk(chunks[0], 0, None)
+        
+        assert [[name for name, _ in chunk] for chunk in chunks] == [
+            ["frame_000001", "frame_000002"], ["frame_000003", "frame_000004"], ["frame_000005"]]
+        assert reader.call_args.kwargs['pix_fmt'] == "bgr24"
+        assert [call.args[1] for call in staging.call_args_list] == [2 * 12, 2 * 12 * 16]
+
     def test_interpolate_missing_binary(self, interpolator, mocker):
         mocker.patch('shutil.which', return_value=None)
-        res = interpolator.generate_intermediate_frames("frames", 100)
-        assert res is None
+        names = [backend.name for backend in interpolator.available_backends("models")]
+        assert "rife-ncnn-vulkan" not in names
         
-    def test_interpolate_existing_binary(self, interpolator, mocker, mock_frames_dir):
+    def test_interpolate_existing_binary(self, mocker, mock_frames_dir, tmp_path):
         mocker.patch('shutil.which', return_value="/usr/bin/rife")
         mocker.patch('subprocess.run')
-        res = interpolator.generate_intermediate_frames(mock_frames_dir, 10)
+        backend = RIFE_NCNN_Backend(work_root=str(tmp_path))
+        assert backend.is_available()
+        res = backend.generate_intermediate_frames(mock_frames_dir, str(tmp_path / "out"), 10)
         assert res is not None
 
+    def test_frame_schedule_doubles_frame_rate(self):
+        schedule = list(build_frame_schedule(4, 30, 60))
+        assert schedule == [(0, 0.0), (0, 0.5), (1, 0.0), (1, 0.5), (2, 0.0), (2, 0.5), (3, 0.0)]
+
+    def test_rife_stream_keeps_output_order(self, tmp_path, mocker):
+        import numpy as np
+        backend = Torch_RIFE_Backend(str(tmp_path / "flownet.pkl"), batch_size=2)
+        mocker.patch.object(
+            backend, 'interpolate_batch',
+            side_effect=lambda first, second, steps: [(a + b) // 2 for a, b in zip(first, second)]
+        )
+        frames = [np.full((2, 2, 3), value, dtype=np.uint8) for value in (0, 10, 20)]
+        writer = mocker.Mock()
+        
+        backend._stream(iter(frames), 3, 30, 60, writer)
+        
+        written = [int(call.args[0][0, 0, 0]) for call in writer.write.call_args_list]
+        assert written == [0, 5, 10, 15, 20]
+
+    def test_select_backend_uses_measured_throughput(self, interpolator, mocker):
+        slow, fast = mocker.Mock(), mocker.Mock()
+        slow.name, fast.name = "slow", "fast"
+        slow.measure_throughput.return_value = 5.0
+        fast.measure_throughput.return_value = 50.0
+        mocker.patch.object(interpolator, 'available_backends', return_value=[slow, fast])
+        cut = mocker.patch('src.utility_classes.video_enchancers.cut_sample_clip', return_value="sample.mp4")
+        info = {'width': 1280, 'height': 720, 'fps': 30.0, 'frame_count': 300}
+        
+        backend = interpolator.select_backend("models", info)
+        assert backend is fast
+        assert interpolator.backend_throughput == {"slow": 5.0, "fast": 50.0}
+        cut.assert_called_once()
+        assert slow.measure_throughput.call_args.args[:2] == fast.measure_throughput.call_args.args[:2]
+        assert slow.measure_throughput.call_args.args[0] == "sample.mp4"
+        assert slow.measure_throughput.call_args.args[1]['frame_count'] == 32
+        
+        # A second run on the same host and resolution reuses the measurements
+        slow.measure_throughput.reset_mock()
+        fast.measure_throughput.reset_mock()
+        assert interpolator.select_backend("models", info) is fast
+        slow.measure_throughput.assert_not_called()
+        fast.measure_throughput.assert_not_called()
+        assert cut.call_count == 1
+
     def test_check_fps_logic(self, interpolator, mocker):
         mock_cap = mocker.Mock()
         mocker.patch('cv2.VideoCapture', return_value=mock_cap)
@@ -70,32 +251,190 @@ class TestEnhancement:
         needs, fps = interpolator.check_fps()
         assert needs is False
 
-    def test_check_noise_level_high(self, denoiser, mocker):
+    def _mock_capture(self, mocker, frame, frame_count=300, fps=30.0):
         mock_cap = mocker.Mock()
-        import numpy as np
-        frame = np.zeros((100, 100, 3), dtype=np.uint8)
+        mock_cap.get.side_effect = lambda prop: {
+            cv2.CAP_PROP_FRAME_COUNT: frame_count, cv2.CAP_PROP_FPS: fps
+        }.get(prop, 0)
         mock_cap.read.return_value = (True, frame)
         mocker.patch('cv2.VideoCapture', return_value=mock_cap)
+        return mock_cap
+
+    def test_check_noise_level_high(self, denoiser, mocker):
+        import numpy as np
+        rng = np.random.default_rng(0)
+        noise = rng.normal(0, 8, (96, 96, 3))
+        frame = np.clip(128 + noise, 0, 255).astype(np.uint8)
+        self._mock_capture(mocker, frame)
         
-        mock_laplacian = mocker.Mock()
-        mock_laplacian.var.return_value = 150.0
-        mocker.patch('cv2.Laplacian', return_value=mock_laplacian)
+        needs, level = denoiser.check_noise_level()
+        assert needs is True
+        assert level > denoiser.noise_threshold
+        assert all(seg['strength'] for seg in denoiser.segments)
+        assert "enable='between(t," in denoiser.build_filter()
+
+    def test_check_noise_level_low(self, denoiser, mocker):
+        import numpy as np
+        # A sharp but clean edge pattern: high Laplacian variance, no noise
+        frame = np.zeros((96, 96, 3), dtype=np.uint8)
+        frame[:, ::8] = 255
+        self._mock_capture(mocker, frame)
         
         needs, level = denoiser.check_noise_level()
         assert needs is False
-        assert level > 100
+        assert level < denoiser.noise_threshold
+        assert denoiser.build_filter() == ""
 
-    def test_check_noise_level_low(self, denoiser, mocker):
-        mock_cap = mocker.Mock()
+    def test_noise_sigma_estimate(self):
         import numpy as np
-        frame = np.zeros((100, 100, 3), dtype=np.uint8)
-        mock_cap.read.return_value = (True, frame)
-        mocker.patch('cv2.VideoCapture', return_value=mock_cap)
+        rng = np.random.default_rng(1)
+        gradient = np.tile(np.linspace(0, 200, 128, dtype=np.float32), (128, 1))
+        frames = np.stack([gradient + rng.normal(0, sigma, gradient.shape) for sigma in (0.0, 3.0, 10.0)])
         
-        mock_laplacian = mocker.Mock()
-        mock_laplacian.var.return_value = 50.0
-        mocker.patch('cv2.Laplacian', return_value=mock_laplacian)
+        sigmas = Denoising_Generator.estimate_noise_sigma(frames)
+        assert sigmas[0] < 0.5
+        assert abs(sigmas[1] - 3.0) < 0.5
+        assert abs(sigmas[2] - 10.0) < 1.0
+
+    def test_filter_gates_only_noisy_segments(self, denoiser):
+        strength = denoiser._strength_for_sigma(5.0)
+        denoiser.segments = [
+            {'start': 0.0, 'end': 10.0, 'sigma': 0.5, 'strength': None},
+            {'start': 10.0, 'end': 20.0, 'sigma': 5.0, 'strength': strength},
+            {'start': 20.0, 'end': 30.0, 'sigma': 5.0, 'strength': strength},
+        ]
+        vf = denoiser.build_filter()
+        assert vf.count("hqdn3d=") == 1
+        assert "between(t,10.000,30.000)" in vf
+
+    def test_clean_video_is_not_reencoded(self, denoiser, mocker):
+        run = mocker.patch('subprocess.run')
+        denoiser.segments = [{'start': 0.0, 'end': 10.0, 'sigma': 0.5, 'strength': None}]
+        
+        assert denoiser.output_clean_video() == denoiser.video_path
+        run.assert_not_called()
+
+    SOURCE_INFO = {'codec': "h264", 'profile': "Main", 'level': 30, 'pix_fmt': "yuv420p",
+                   'width': 320, 'height': 240, 'frame_count': 900, 'duration': 30.0}
+
+    def _mock_spliceable_source(self, denoiser, mocker, piece_info=None):
+        strength = denoiser._strength_for_sigma(5.0)
+        denoiser.segments = [
+            {'start': start, 'end': start + 3.0, 'sigma': 5.0 if 9.0 <= start < 21.0 else 0.5,
+             'strength': strength if 9.0 <= start < 21.0 else None}
+            for start in range(0, 30, 3)
+        ]
+        mocker.patch('src.utility_classes.video_enchancers.probe_video',
+                     side_effect=lambda path: self.SOURCE_INFO if path == denoiser.video_path
+                     else (piece_info or self.SOURCE_INFO))
+        mocker.patch('src.utility_classes.video_enchancers.probe_keyframe_times',
+                     return_value=[float(t) for t in range(0, 30, 2)])
+        mocker.patch('src.utility_classes.video_enchancers.probe_frame_timestamps',
+                     return_value=[i / 30 for i in range(900)])
+
+    def test_only_noisy_pieces_are_reencoded(self, denoiser, mocker):
+        self._mock_spliceable_source(denoiser, mocker)
+        run = mocker.patch('subprocess.run')
+        
+        denoiser.output_clean_video()
+        
+        copy_first, denoise, copy_last, concat = [call.args[0] for call in run.call_args_list]
+        assert copy_first[copy_first.index("-ss") + 1] == "0.000000"
+        assert copy_first[copy_first.index("-frames:v") + 1] == "240" and "copy" in copy_first
+        assert denoise[denoise.index("-ss") + 1] == "8.000000" and denoise[denoise.index("-t") + 1] == "14.000000"
+        assert "between(t,1.000,13.000)" in denoise[denoise.index("-vf") + 1]
+        assert denoise[denoise.index("-profile:v") + 1] == "main" and denoise[denoise.index("-level:v") + 1] == "3.0"
+        assert denoise[denoise.index("-pix_fmt") + 1] == "yuv420p"
+        assert copy_last[copy_last.index("-ss") + 1] == "22.000000"
+        assert copy_last[copy_last.index("-frames:v") + 1] == "240"
+        assert concat[concat.index("-f") + 1] == "concat" and concat[concat.index("-c") + 1] == "copy"
+
+    def test_mismatched_parameters_fall_back_to_full_encode(self, denoiser, mocker):
+        self._mock_spliceable_source(denoiser, mocker, piece_info=dict(self.SOURCE_INFO, level=31))
+        run = mocker.patch('subprocess.run')
+        
+        output = denoiser.output_clean_video()
+        
+        commands = [call.args[0] for call in run.call_args_list]
+        assert "concat" not in commands[-1]
+        assert commands[-1][commands[-1].index("-i") + 1] == denoiser.video_path
+        assert "enable='between(t,9.000,21.000)'" in commands[-1][commands[-1].index("-vf") + 1]
+        assert commands[-1][-1] == output
+
+    def test_unknown_profile_is_not_spliced(self, denoiser, mocker):
+        self._mock_spliceable_source(denoiser, mocker)
+        mocker.patch.dict(self.SOURCE_INFO, {'profile': "Extended"})
+        keyframes = mocker.patch('src.utility_classes.video_enchancers.probe_keyframe_times')
+        run = mocker.patch('subprocess.run')
+        
+        denoiser.output_clean_video()
+        
+        keyframes.assert_not_called()
+        assert run.call_count == 1
+
+    def test_long_source_is_denoised_end_to_end(self, denoiser, mocker):
+        import numpy as np
+        # One hour, 60 samples: only one 10s segment in six holds a sample
+        rng = np.random.default_rng(0)
+        frames = [np.clip(128 + rng.normal(0, 6 + i % 3, (64, 64)), 0, 255).astype(np.uint8) for i in range(60)]
+        mocker.patch.object(denoiser, 'sample_frames',
+                            return_value=(frames, np.linspace(0, 3599, 60), 3600.0))
+        
+        needs, _ = denoiser.check_noise_level()
         
-        needs, level = denoiser.check_noise_level()
         assert needs is True
-        assert level < 100
+        assert len(denoiser.segments) == 360 and all(seg['strength'] for seg in denoiser.segments)
+        assert all(a['end'] == b['start'] for a, b in zip(denoiser.segments, denoiser.segments[1:]))
+        vf = denoiser.build_filter()
+        strengths = {tuple(seg['strength'].values()) for seg in denoiser.segments}
+        assert vf.count("hqdn3d=") == len(strengths) < 10
+        assert "between(t,0.000," in vf and ",3600.000)" in vf
+        pieces = denoiser.plan_pieces([float(t) for t in range(0, 3600, 2)], [], 3600.0)
+        assert pieces == [{'start': 0.0, 'end': 3600.0, 'denoise': True}]
+
+
+class TestPresetScheduler:
+
+    class FixedCalibration:
+        # frames per second at 1920x1080; each slower preset halves the speed
+        def fps(self, preset, width, height):
+            from src.utility_classes.preset_scheduler import X264_PRESETS
+            return 400.0 / 2 ** X264_PRESETS.index(preset) * 1920 * 1080 / (width * height)
+
+    def test_calibration_measured_once_and_cached(self, mocker, tmp_path):
+        measure = mocker.patch('src.utility_classes.preset_scheduler.measure_preset_fps', return_value=100.0)
+        cache = tmp_path / "calibration.json"
+        
+        calibration = Preset_Calibration(cache)
+        assert calibration.fps("medium", 1920, 1080) == 100.0
+        assert calibration.fps("medium", 1920, 960) == 112.5
+        assert Preset_Calibration(cache).fps("medium", 1920, 1080) == 100.0
+        assert measure.call_count == 1
+
+    def test_slowest_preset_meeting_deadline(self):
+        scheduler = Preset_Scheduler(100.0, calibration=self.FixedCalibration(), safety_margin=1.0)
+        # 600 frames: medium (12.5 fps) takes 48s, slow 96s, slower 192s
+        assert scheduler.preset_for("ladder", [(1920, 1080)], 600) == "slow"
+        
+        scheduler = Preset_Scheduler(100.0, calibration=self.FixedCalibration(), safety_margin=1.0)
+        scheduler.plan("ladder", [(1920, 1080)], 600)
+        assert scheduler.preset_for("denoise", [(1920, 1080)], 600) == "medium"
+        assert scheduler.decisions['denoise']['preset'] == "medium"
+        assert "ladder" in scheduler.planned
+
+    def test_fastest_preset_when_deadline_unreachable(self):
+        scheduler = Preset_Scheduler(0.001, calibration=self.FixedCalibration())
+        assert scheduler.preset_for("ladder", [(1920, 1080)], 60000) == "ultrafast"
+
+    def test_no_deadline_keeps_default_preset(self, mocker, mock_video_path, tmp_path):
+        mocker.patch('src.utility_classes.video_enchancers.probe_video',
+                     return_value={'codec': "vp9", 'width': 640, 'height': 360, 'frame_count': 240})
+        run = mocker.patch('subprocess.run')
+        denoiser = Denoising_Generator(mock_video_path, scheduler=Preset_Scheduler())
+        denoiser.denoising_root = tmp_path
+        denoiser.segments = [{'start': 0.0, 'end': 8.0, 'sigma': 5.0, 'strength': denoiser._strength_for_sigma(5.0)}]
+        
+        denoiser.output_clean_video()
+        
+        command = run.call_args[0][0]
+        assert command[command.index("-preset") + 1] == "medium"
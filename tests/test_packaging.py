@@ -1,10 +1,17 @@
+import os
 import pytest
 from src.utility_classes.packaging_generator import HLS_Packaging_Generator
 
+
+def _source_info(duration, fps=60.0, variable_frame_rate=False, frame_count=None):
+    return {'duration': duration, 'fps': fps, 'variable_frame_rate': variable_frame_rate,
+            'frame_count': frame_count if frame_count is not None else int(duration * fps)}
+
 class TestPackaging:
     
     @pytest.fixture
-    def packager(self, mock_video_path):
+    def packager(self, mock_video_path, mocker):
+        mocker.patch('src.utility_classes.packaging_generator.probe_video', return_value=_source_info(24.0))
         return HLS_Packaging_Generator(mock_video_path)
         
     def test_create_hls_package_call(self, packager, mocker):
@@ -23,3 +30,591 @@ class TestPackaging:
         variants = packager.adaptive_bitrate_encoding("final.mp4", str(variants_dir))
         assert len(variants) > 0
         assert variants[0]['resolution'] == "1920x1080"
+
+    def test_single_pass_ladder_command(self, packager, mocker, tmp_path):
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=True)
+        run = mocker.patch('subprocess.run')
+        packager.ffmpeg_master_playlist = True
+        packager.shared_audio = False
+        
+        variants = packager.adaptive_bitrate_encoding("final.mp4", str(tmp_path))
+        
+        assert run.call_count == 1
+        command = run.call_args[0][0]
+        assert command.count("-i") == 1
+        graph = command[command.index("-filter_complex") + 1]
+        assert graph.startswith("[0:v]split=4[v0][v1][v2][v3]")
+        assert "[v3]scale=640x360:flags=lanczos[out3]" in graph
+        assert command[command.index("-var_stream_map") + 1].split() == [
+            "v:0,a:0,name:1080p", "v:1,a:1,name:720p", "v:2,a:2,name:480p", "v:3,a:3,name:360p"
+        ]
+        assert "-master_pl_name" in command
+        assert variants[1]['playlist'] == str(tmp_path / "720p" / "playlist.m3u8")
+
+    def test_shared_audio_ladder_is_video_only(self, packager, mocker, tmp_path):
+        probe = mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=True)
+        run = mocker.patch('subprocess.run')
+        
+        packager.adaptive_bitrate_encoding("final.mp4", str(tmp_path))
+        
+        command = run.call_args[0][0]
+        assert "-an" in command and "0:a:0" not in command
+        assert command[command.index("-var_stream_map") + 1].split()[0] == "v:0,name:1080p"
+        probe.assert_not_called()
+
+    @pytest.mark.parametrize("codec, expected", [("aac", ["-c:a", "copy"]), ("opus", ["-c:a", "aac", "-b:a", "128k"])])
+    def test_audio_rendition_encoded_once(self, packager, mocker, tmp_path, codec, expected):
+        mocker.patch('src.utility_classes.packaging_generator.probe_audio',
+                     return_value={'codec': codec, 'bitrate': 96000, 'channels': 2})
+        run = mocker.patch('subprocess.run')
+        
+        rendition = packager.encode_audio_rendition("source.mp4", str(tmp_path))
+        
+        command = run.call_args[0][0]
+        start = command.index("-c:a")
+        assert command[start:start + len(expected)] == expected
+        assert rendition['playlist'] == str(tmp_path / "audio" / "playlist.m3u8")
+        assert rendition['bitrate'] == ("96k" if codec == "aac" else "128k")
+
+    def test_segment_parallel_audio_starts_with_video(self, packager, mocker, tmp_path):
+        from src.utility_classes.segment_encoder import Segment_Parallel_Encoder
+        mocker.patch('src.utility_classes.packaging_generator.probe_audio',
+                     return_value={'codec': "aac", 'bitrate': 128000, 'channels': 2})
+        run = mocker.patch('subprocess.run')
+        packager.segment_parallel = True
+        first_pts = lambda command: float(command[command.index("-output_ts_offset") + 1])
+        
+        packager.encode_audio_rendition("source.mp4", str(tmp_path))
+        encoder = Segment_Parallel_Encoder("source.mp4", str(tmp_path), ["720p"], 60.0,
+                                           lambda input_args, hls_args, segment, playlist: input_args + hls_args)
+        
+        assert first_pts(run.call_args[0][0]) == first_pts(encoder.chunk_command(encoder.plan_chunks()[0]))
+        packager.segment_parallel = False
+        packager.encode_audio_rendition("source.mp4", str(tmp_path))
+        assert "-output_ts_offset" not in run.call_args[0][0]
+
+    def test_master_manifest_references_audio_group(self, packager, tmp_path):
+        variants = packager._variant_info(str(tmp_path / "variants"), encoded=False)[:1]
+        audio = {'name': "audio", 'bitrate': "128k", 'playlist': str(tmp_path / "audio" / "playlist.m3u8")}
+        
+        master = packager.generate_master_manifest(str(tmp_path), variants, audio)
+        
+        with open(master) as f:
+            content = f.read()
+        assert '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio"' in content and 'URI="audio/playlist.m3u8"' in content
+        assert "BANDWIDTH=5128000,RESOLUTION=1920x1080,AUDIO=\"audio\"" in content
+
+    def test_relocate_ffmpeg_master(self, packager, tmp_path):
+        variants_dir = tmp_path / "variants"
+        variants_dir.mkdir()
+        (variants_dir / "master.m3u8").write_text(
+            "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1000\n720p/playlist.m3u8\n"
+        )
+        master = packager.relocate_ffmpeg_master(str(tmp_path), str(variants_dir))
+        with open(master) as f:
+            assert "variants/720p/playlist.m3u8" in f.read()
+        assert not (variants_dir / "master.m3u8").exists()
+
+    def test_single_source_skips_merge_and_mezzanine(self, packager, mocker, mock_video_path):
+        merge = mocker.patch.object(packager, 'ffmpeg_merge')
+        mezzanine = mocker.patch.object(packager, 'create_final_enhanced_video')
+        ladder = mocker.patch.object(packager, 'adaptive_bitrate_encoding', return_value=[])
+        mocker.patch.object(packager, 'generate_master_manifest', return_value="master.m3u8")
+        mocker.patch.object(packager, 'encode_audio_rendition', return_value=None)
+        
+        result = packager.run_full_analysis()
+        
+        merge.assert_not_called()
+        mezzanine.assert_not_called()
+        assert ladder.call_args[0][0] == mock_video_path
+        assert ladder.call_args[0][2] == HLS_Packaging_Generator.ENHANCEMENT_FILTER
+        assert result['final_video'] is None
+
+    def test_mezzanine_written_on_request(self, packager, mocker):
+        packager.write_mezzanine = True
+        mocker.patch.object(packager, 'create_final_enhanced_video', return_value="mezz.mp4")
+        ladder = mocker.patch.object(packager, 'adaptive_bitrate_encoding', return_value=[])
+        mocker.patch.object(packager, 'generate_master_manifest', return_value="master.m3u8")
+        mocker.patch.object(packager, 'encode_audio_rendition', return_value=None)
+        
+        result = packager.run_full_analysis()
+        
+        assert ladder.call_args[0][0] == "mezz.mp4"
+        assert ladder.call_args[0][2] is None
+        assert result['final_video'] == "mezz.mp4"
+
+    def test_cmaf_ladder_command(self, packager, mocker, tmp_path):
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        run = mocker.patch('subprocess.run')
+        packager.cmaf = True
+        
+        packager.adaptive_bitrate_encoding("final.mp4", str(tmp_path))
+        
+        command = run.call_args[0][0]
+        assert command[command.index("-hls_segment_type") + 1] == "fmp4"
+        assert command[command.index("-hls_fmp4_init_filename") + 1] == "init_%v.mp4"
+        assert command[command.index("-hls_segment_filename") + 1].endswith("segment_%03d.m4s")
+
+    def test_dash_manifest_shares_hls_segments(self, packager, tmp_path):
+        packager.cmaf = True
+        variant_info = []
+        for name, resolution in (("720p", "1280x720"), ("360p", "640x360")):
+            variant_dir = tmp_path / "variants" / name
+            variant_dir.mkdir(parents=True)
+            (variant_dir / f"init_{name}.mp4").write_bytes(b"....avcC\x01\x64\x00\x1f....mp4a")
+            (variant_dir / "playlist.m3u8").write_text(
+                f'#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-MAP:URI="init_{name}.mp4"\n'
+                "#EXTINF:6.000000,\nsegment_000.m4s\n#EXTINF:2.500000,\nsegment_001.m4s\n#EXT-X-ENDLIST\n"
+            )
+            variant_info.append({'name': name, 'resolution': resolution, 'bitrate': '1000k',
+                                 'playlist': str(variant_dir / "playlist.m3u8")})
+        
+        mpd = packager.generate_dash_manifest(str(tmp_path), variant_info)
+        
+        with open(mpd) as f:
+            content = f.read()
+        assert 'mediaPresentationDuration="PT8.500S"' in content
+        assert 'codecs="avc1.64001f,mp4a.40.2"' in content
+        assert '<Initialization sourceURL="variants/360p/init_360p.mp4"/>' in content
+        assert '<SegmentURL media="variants/720p/segment_001.m4s"/>' in content
+        assert '<S d="2500"/>' in content
+
+    def test_single_file_ladder_command(self, packager, mocker, tmp_path):
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        run = mocker.patch('subprocess.run')
+        packager.single_file = True
+        packager.segment_parallel = True
+        
+        packager.adaptive_bitrate_encoding("final.mp4", str(tmp_path))
+        
+        assert run.call_count == 1
+        command = run.call_args[0][0]
+        assert command[command.index("-hls_flags") + 1] == "single_file"
+        assert command[command.index("-hls_segment_filename") + 1] == str(tmp_path / "%v" / "stream.ts")
+        assert packager._hls_flag_args(["temp_file"]) == ["-hls_flags", "single_file"]
+
+    def test_output_sink_publishes_only_closed_segments(self, packager, mocker):
+        packager.output_sink = mocker.Mock()
+        assert packager._hls_flag_args() == ["-hls_flags", "temp_file"]
+        assert packager._hls_flag_args(["temp_file"]) == ["-hls_flags", "temp_file"]
+        packager.single_file = True
+        assert packager._hls_flag_args() == ["-hls_flags", "single_file"]
+
+    def test_master_manifest_uses_measured_byterange_media(self, packager, tmp_path):
+        packager.single_file = True
+        variant_dir = tmp_path / "variants" / "1080p"
+        variant_dir.mkdir(parents=True)
+        (variant_dir / "playlist.m3u8").write_text(
+            "#EXTM3U\n#EXT-X-VERSION:4\n#EXTINF:6.000000,\n#EXT-X-BYTERANGE:1500000@0\nstream.ts\n"
+            "#EXTINF:4.000000,\n#EXT-X-BYTERANGE:500000\nstream.ts\n#EXT-X-ENDLIST\n"
+        )
+        # One TS packet carrying a PES with an H.264 SPS (High profile, level 4.0)
+        pes = b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + b"\x00" * 5 + b"\x00\x00\x00\x01\x67\x64\x00\x28"
+        packet = b"\x47\x41\x00\x10" + pes
+        (variant_dir / "stream.ts").write_bytes(packet + b"\xff" * (188 - len(packet)))
+        variants = packager._variant_info(str(tmp_path / "variants"), encoded=False)[:1]
+        
+        master = packager.generate_master_manifest(str(tmp_path), variants)
+        
+        with open(master) as f:
+            content = f.read()
+        assert "#EXT-X-VERSION:4" in content
+        assert 'BANDWIDTH=2000000,AVERAGE-BANDWIDTH=1600000,CODECS="avc1.640028",RESOLUTION=1920x1080' in content
+
+    def test_scene_cuts_force_keyframes_on_every_rung(self, packager, mocker, tmp_path):
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        mocker.patch('src.utility_classes.packaging_generator.probe_video', return_value=_source_info(24.0))
+        run = mocker.patch('subprocess.run')
+        packager.analysis_metrics = {'scene_cuts': [{'time': 7.0, 'score': 0.9}, {'time': 16.0, 'score': 0.6},
+                                                    {'time': 20.0, 'score': 0.1}]}
+        
+        packager.adaptive_bitrate_encoding("final.mp4", str(tmp_path))
+        
+        command = run.call_args[0][0]
+        assert packager.segment_starts == [0.0, 7.0, 11.5, 16.0]
+        assert command[command.index("-hls_time") + 1] == "1"
+        assert "-keyint_min" not in command
+        for i in range(len(packager.encoding_profiles)):
+            assert command[command.index(f"-force_key_frames:v:{i}") + 1] == "0.000,7.000,11.500,16.000"
+
+
+    def test_gop_follows_probed_frame_rate(self, packager, mocker, tmp_path):
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        mocker.patch('src.utility_classes.packaging_generator.probe_video', return_value=_source_info(24.0, fps=25.0))
+        run = mocker.patch('subprocess.run')
+        packager.scheduler = mocker.Mock(preset_for=mocker.Mock(return_value="fast"))
+        
+        packager.adaptive_bitrate_encoding("final.mp4", str(tmp_path))
+        
+        command = run.call_args[0][0]
+        assert command[command.index("-g") + 1] == command[command.index("-keyint_min") + 1] == "25"
+        assert packager.scheduler.preset_for.call_args[0][2] == 600
+        
+        packager.adaptive_bitrate_encoding("source.mp4", str(tmp_path), packager.ENHANCEMENT_FILTER)
+        
+        command = run.call_args[0][0]
+        assert command[command.index("-g") + 1] == "60"
+        assert packager.scheduler.preset_for.call_args[0][2] == 1440
+
+    def test_variable_frame_rate_gop_uses_average_rate(self, packager, mocker, tmp_path):
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        mocker.patch('src.utility_classes.packaging_generator.probe_video', return_value=_source_info(
+            24.0, fps=90000.0, variable_frame_rate=True, frame_count=720
+        ))
+        run = mocker.patch('subprocess.run')
+        packager.analysis_metrics = {'scene_cuts': [{'time': 7.0, 'score': 0.9}]}
+        
+        packager.adaptive_bitrate_encoding("final.mp4", str(tmp_path))
+        
+        command = run.call_args[0][0]
+        assert command[command.index("-g") + 1] == str(11 * 30)
+
+
+class TestSegmentEncoder:
+
+    def test_queue_claims_each_job_once(self, tmp_path):
+        from src.utility_classes.segment_encoder import Segment_Work_Queue
+        queue = Segment_Work_Queue(tmp_path)
+        queue.submit("run_00000", {'command': ["true"]})
+        queue.submit("run_00001", {'command': ["true"]})
+        
+        first = queue.claim("a")
+        second = queue.claim("b")
+        assert {first['job_id'], second['job_id']} == {"run_00000", "run_00001"}
+        assert queue.claim("c") is None
+        
+        queue.complete(first)
+        queue.complete(second, error="boom")
+        assert queue.count("done", "run") == 1
+        assert queue.failures("run")[0]['error'] == "boom"
+
+    def test_stale_claims_are_requeued(self, tmp_path):
+        import os
+        from src.utility_classes.segment_encoder import Segment_Work_Queue
+        queue = Segment_Work_Queue(tmp_path)
+        queue.submit("job", {'command': ["true"]})
+        queue.claim("crashed-node")
+        os.utime(tmp_path / "claimed" / "job.json", (0, 0))
+        assert queue.requeue_stale(lease_seconds=60) == ["job"]
+        assert queue.claim("rescuer")['job_id'] == "job"
+
+    def test_chunks_are_segment_aligned(self, tmp_path):
+        from src.utility_classes.segment_encoder import Segment_Parallel_Encoder, TS_OFFSET_PAD
+        build = lambda input_args, hls_args, segment, playlist: input_args + hls_args + [segment, playlist]
+        encoder = Segment_Parallel_Encoder("in.mp4", str(tmp_path), ["720p"], 75.0, build,
+                                           hls_time=6, chunk_segments=5)
+        chunks = encoder.plan_chunks()
+        assert [(c['start'], c['start_number']) for c in chunks] == [(0, 0), (30, 5), (60, 10)]
+        command = encoder.chunk_command(chunks[1])
+        assert command[:4] == ["-ss", "30", "-i", "in.mp4"]
+        assert command[command.index("-t") + 1] == "30"
+        assert command[command.index("-output_ts_offset") + 1] == str(30 + TS_OFFSET_PAD)
+        assert command[command.index("-force_key_frames:v:0") + 1] == "0.000,6.000,12.000,18.000,24.000"
+        assert encoder.plan_segment_runs([4, 5])[0]['keyframes'] == [0, 6]
+
+    def test_chunk_gop_follows_source_frame_rate(self, mocker, mock_video_path, tmp_path):
+        packager = HLS_Packaging_Generator(mock_video_path, segment_parallel=True, scene_keyframes=False)
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        mocker.patch('src.utility_classes.packaging_generator.probe_video',
+                     return_value=_source_info(45.0, fps=30000 / 1001))
+        commands = []
+        mocker.patch('src.utility_classes.packaging_generator.Segment_Parallel_Encoder.encode', autospec=True,
+                     side_effect=lambda encoder: commands.extend(map(encoder.chunk_command, encoder.plan_chunks())))
+        
+        packager.adaptive_bitrate_encoding(mock_video_path, str(tmp_path))
+        
+        # 30-frame GOPs run 6.006 s per five, so each segment start is forced rather than left to the GOP
+        assert len(commands) == 2
+        for command in commands:
+            assert command[command.index("-g") + 1] == "30"
+            for i in range(len(packager.encoding_profiles)):
+                assert command[command.index(f"-force_key_frames:v:{i}") + 1] == "0.000,6.000,12.000,18.000,24.000"
+
+    @pytest.mark.parametrize("duration, cuts, expected", [
+        (24.0, [7.0, 16.0], [0.0, 7.0, 11.5, 16.0]),
+        (20.5, [7.0, 19.5], [0.0, 7.0, 13.75]),
+        (24.0, [], [0.0, 6.0, 12.0, 18.0])
+    ])
+    def test_plan_segment_starts(self, duration, cuts, expected):
+        from src.utility_classes.segment_encoder import plan_segment_starts
+        assert plan_segment_starts(duration, cuts) == expected
+
+    def test_scene_chunks_force_relative_keyframes(self, tmp_path):
+        from src.utility_classes.segment_encoder import Segment_Parallel_Encoder
+        build = lambda input_args, hls_args, segment, playlist: input_args + hls_args + [segment, playlist]
+        encoder = Segment_Parallel_Encoder("in.mp4", str(tmp_path), ["720p", "360p"], 24.0, build,
+                                           chunk_segments=2, segment_starts=[0.0, 7.0, 11.5, 16.0])
+        chunks = encoder.plan_chunks()
+        assert [(c['start'], c['duration'], c['start_number']) for c in chunks] == [(0.0, 11.5, 0), (11.5, 12.5, 2)]
+        command = encoder.chunk_command(chunks[1])
+        assert command[command.index("-force_key_frames:v:0") + 1] == "0.000,4.500"
+        assert command[command.index("-force_key_frames:v:1") + 1] == "0.000,4.500"
+
+    def test_stitch_playlists(self, tmp_path):
+        from src.utility_classes.segment_encoder import stitch_playlists
+        header = "#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:{}\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+        (tmp_path / "chunk_00000.m3u8").write_text(
+            header.format(0) + "#EXTINF:6.000000,\nsegment_00000.ts\n#EXT-X-ENDLIST\n")
+        (tmp_path / "chunk_00001.m3u8").write_text(
+            header.format(1) + "#EXTINF:6.000000,\nsegment_00001.ts\n#EXTINF:2.500000,\nsegment_00002.ts\n#EXT-X-ENDLIST\n")
+        
+        playlist = stitch_playlists(tmp_path, ["chunk_00000.m3u8", "chunk_00001.m3u8"])
+        
+        with open(playlist) as f:
+            content = f.read()
+        assert content.count("#EXTINF") == 3
+        assert content.count("#EXT-X-ENDLIST") == 1
+        assert "#EXT-X-MEDIA-SEQUENCE:0" in content
+        assert content.index("segment_00000.ts") < content.index("segment_00002.ts")
+        assert not (tmp_path / "chunk_00000.m3u8").exists()
+
+    def test_stitch_repeats_changed_init_segments(self, tmp_path):
+        from src.utility_classes.segment_encoder import stitch_playlists
+        for index in range(2):
+            (tmp_path / f"chunk_{index:05d}.m3u8").write_text(
+                f'#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-MAP:URI="init_chunk_{index:05d}.mp4"\n'
+                f"#EXTINF:6.000000,\nsegment_{index:05d}.m4s\n#EXT-X-ENDLIST\n"
+            )
+        
+        playlist = stitch_playlists(tmp_path, ["chunk_00000.m3u8", "chunk_00001.m3u8"])
+        
+        with open(playlist) as f:
+            lines = f.read().splitlines()
+        assert "#EXT-X-VERSION:7" in lines
+        assert lines.index('#EXT-X-MAP:URI="init_chunk_00001.mp4"') > lines.index("segment_00000.m4s")
+
+
+class TestBitrateLadder:
+
+    @pytest.fixture
+    def packager(self, mock_video_path):
+        return HLS_Packaging_Generator(mock_video_path)
+
+    def _probe(self, mocker, height):
+        mocker.patch('src.utility_classes.bitrate_ladder.probe_video',
+                     return_value={'height': height, 'width': height * 16 // 9, 'duration': 30.0})
+
+    def test_rungs_above_source_dropped(self, mocker):
+        from src.utility_classes.bitrate_ladder import Bitrate_Ladder_Generator
+        self._probe(mocker, 360)
+        ladder = Bitrate_Ladder_Generator("in.mp4", probe_encodes=False).build()
+        assert [rung['name'] for rung in ladder] == ["360p", "240p"]
+
+    def test_analysis_metrics_scale_estimates(self, mocker):
+        from src.utility_classes.bitrate_ladder import Bitrate_Ladder_Generator
+        self._probe(mocker, 1080)
+        static = {'metrics': {'motion': {'classification': "Static/Low Motion"},
+                              'complexity': {'classification': "Simple/Low Complexity"}}}
+        sports = {'metrics': {'motion': {'classification': "High Motion"},
+                              'complexity': {'classification': "High Complexity"}}}
+        low = Bitrate_Ladder_Generator("in.mp4", static, probe_encodes=False).build()
+        high = Bitrate_Ladder_Generator("in.mp4", sports, probe_encodes=False).build()
+        assert int(low[0]['bitrate'][:-1]) < 4500 < int(high[0]['bitrate'][:-1])
+
+    def test_probe_encodes_prune_redundant_rungs(self, mocker):
+        from src.utility_classes.bitrate_ladder import Bitrate_Ladder_Generator
+        self._probe(mocker, 1080)
+        rates = {1080: 3000, 720: 2600, 480: 1500, 360: 1300, 240: 600}
+        generator = Bitrate_Ladder_Generator("in.mp4")
+        mocker.patch.object(generator, 'probe_rung', side_effect=lambda rung, start, duration, reference: {
+            'bitrate': rates[rung['height']], 'psnr': rung['height'] / 20})
+        
+        ladder = generator.build()
+        
+        assert [(rung['name'], rung['bitrate']) for rung in ladder] == [
+            ("1080p", "3000k"), ("360p", "1300k"), ("240p", "600k")
+        ]
+
+    def test_rungs_without_quality_gain_pruned(self, mocker):
+        from src.utility_classes.bitrate_ladder import Bitrate_Ladder_Generator
+        self._probe(mocker, 1080)
+        probes = {1080: (4000, 41.5), 720: (2000, 41.0), 480: (900, 37.0), 360: (500, 36.5), 240: (250, 33.0)}
+        generator = Bitrate_Ladder_Generator("in.mp4")
+        mocker.patch.object(generator, 'probe_rung', side_effect=lambda rung, start, duration, reference: dict(
+            zip(('bitrate', 'psnr'), probes[rung['height']])))
+        
+        ladder = generator.build()
+        
+        # 480p buys 0.5 dB over 360p; 1080p buys 0.5 dB over 720p and, as the top rung, replaces it
+        assert [rung['name'] for rung in ladder] == ["1080p", "360p", "240p"]
+
+    def test_ladder_capped_by_original_and_probed_through_prefilter(self, mocker):
+        from src.utility_classes.bitrate_ladder import Bitrate_Ladder_Generator
+        mocker.patch('src.utility_classes.bitrate_ladder.probe_video', side_effect=lambda path: {
+            'height': 2160 if path == "upscaled.mp4" else 720, 'width': 0, 'duration': 30.0})
+        run = mocker.patch('subprocess.run', side_effect=[
+            mocker.Mock(stdout=b"\0" * 1000), mocker.Mock(stderr=b"PSNR y:40.1 u:42.0 v:42.3 average:40.800000 min:39")
+        ] * 4)
+        generator = Bitrate_Ladder_Generator("upscaled.mp4", source_video="source.mp4", prefilter="fps=60")
+        
+        ladder = generator.build()
+        
+        assert ladder[0]['name'] == "720p"
+        encode, measure = run.call_args_list[0].args[0], run.call_args_list[1].args[0]
+        assert encode[encode.index("-i") + 1] == "upscaled.mp4"
+        assert encode[encode.index("-vf") + 1] == "fps=60,scale=1280x720:flags=lanczos"
+        graph = measure[measure.index("-filter_complex") + 1]
+        assert "[1:v]fps=60,scale=1280x720:flags=lanczos" in graph and "psnr" in graph
+        assert run.call_args_list[1].kwargs['input'] == b"\0" * 1000
+
+    def test_content_aware_packaging_uses_built_ladder(self, packager, mocker):
+        packager.content_aware = True
+        ladder = [{'resolution': '640x360', 'bitrate': '700k', 'name': '360p'}]
+        build = mocker.patch('src.utility_classes.packaging_generator.Bitrate_Ladder_Generator')
+        build.return_value.build.return_value = ladder
+        encode = mocker.patch.object(packager, 'adaptive_bitrate_encoding', return_value=[])
+        mocker.patch.object(packager, 'generate_master_manifest', return_value="master.m3u8")
+        mocker.patch.object(packager, 'encode_audio_rendition', return_value=None)
+        
+        packager.run_full_analysis()
+        
+        assert packager.encoding_profiles == ladder
+        assert build.call_args.kwargs['prefilter'] == packager.ENHANCEMENT_FILTER
+        encode.assert_called_once()
+
+
+class TestSegmentIndex:
+
+    def test_source_hashes_grouped_by_segment(self, mocker):
+        from src.utility_classes.segment_index import source_segment_hashes
+        framehash = "#tb 0: 1/2\n#stream#, dts, pts, duration, size, hash\n" + "".join(
+            f"0, {pts}, {pts}, 1, 100, {'ab' if pts != 13 else 'cd'}\n" for pts in range(20)
+        )
+        mocker.patch('subprocess.run', return_value=mocker.Mock(stdout=framehash))
+        
+        hashes = source_segment_hashes("in.mp4", 6)
+        
+        assert len(hashes) == 2
+        assert hashes[0] != hashes[1]
+
+    def test_changed_segments(self, tmp_path):
+        from src.utility_classes.segment_index import Segment_Hash_Index
+        store = Segment_Hash_Index(tmp_path / "segment_index.json")
+        entries = [{'duration': 6.0, 'uri': f"segment_{i:05d}_g0.ts", 'map': None} for i in range(3)]
+        store.save("params", ["a", "b", "c"], {'720p': entries})
+        index = store.load()
+        
+        assert Segment_Hash_Index.changed_segments(index, "params", ["a", "x", "c"], ["720p"]) == [1]
+        assert Segment_Hash_Index.changed_segments(index, "other", ["a", "b", "c"], ["720p"]) is None
+        assert Segment_Hash_Index.changed_segments(index, "params", ["a", "b"], ["720p"]) is None
+
+    def test_incremental_reencodes_changed_runs_only(self, mocker, mock_video_path, tmp_path):
+        from src.utility_classes.segment_index import Segment_Hash_Index, encode_params_hash
+        packager = HLS_Packaging_Generator(mock_video_path, incremental=True)
+        packager.encoding_profiles = packager.encoding_profiles[3:]
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        mocker.patch('src.utility_classes.packaging_generator.probe_video', return_value=_source_info(24.0))
+        mocker.patch('src.utility_classes.packaging_generator.source_segment_hashes',
+                     return_value=["a", "x", "y", "d"])
+        variant_dir = tmp_path / "360p"
+        variant_dir.mkdir()
+        entries = []
+        for i in range(4):
+            (variant_dir / f"segment_{i:05d}_g0.ts").write_bytes(b"")
+            entries.append({'duration': 6.0, 'uri': f"segment_{i:05d}_g0.ts", 'map': None})
+        params = encode_params_hash({'command': packager.build_ladder_command(["-i", "SOURCE"], ".", None, False)})
+        Segment_Hash_Index(tmp_path / "segment_index.json").save(params, ["a", "b", "c", "d"], {'360p': entries})
+        
+        def run_chunks(encoder, chunks):
+            assert [(c['start'], c['duration'], c['start_number']) for c in chunks] == [(6, 12, 1)]
+            for chunk in chunks:
+                (variant_dir / chunk['playlist']).write_text(
+                    "#EXTM3U\n#EXTINF:6.000000,\nsegment_00001_g1.ts\n#EXTINF:6.000000,\nsegment_00002_g1.ts\n"
+                )
+        mocker.patch('src.utility_classes.packaging_generator.Segment_Parallel_Encoder.run_chunks',
+                     autospec=True, side_effect=run_chunks)
+        
+        packager.adaptive_bitrate_encoding(mock_video_path, str(tmp_path))
+        
+        with open(variant_dir / "playlist.m3u8") as f:
+            uris = [line for line in f.read().splitlines() if line.startswith("segment_")]
+        assert uris == ["segment_00000_g0.ts", "segment_00001_g1.ts", "segment_00002_g1.ts", "segment_00003_g0.ts"]
+        assert not (variant_dir / "segment_00001_g0.ts").exists()
+        assert Segment_Hash_Index(tmp_path / "segment_index.json").load()['generation'] == 1
+
+    def test_reencoded_segments_start_with_reused_audio(self, mocker, mock_video_path, tmp_path):
+        from src.utility_classes.segment_encoder import TS_OFFSET_PAD
+        from src.utility_classes.segment_index import Segment_Hash_Index, encode_params_hash
+        packager = HLS_Packaging_Generator(mock_video_path, incremental=True)
+        packager.encoding_profiles = packager.encoding_profiles[3:]
+        mocker.patch('src.utility_classes.packaging_generator.probe_has_audio', return_value=False)
+        mocker.patch('src.utility_classes.packaging_generator.probe_video', return_value=_source_info(18.0))
+        mocker.patch('src.utility_classes.packaging_generator.probe_audio', return_value={'codec': "aac", 'bitrate': 128000})
+        mocker.patch('src.utility_classes.packaging_generator.source_segment_hashes', return_value=["a", "x", "c"])
+        variant_dir = tmp_path / "360p"
+        variant_dir.mkdir()
+        entries = [{'duration': 6.0, 'uri': f"segment_{i:05d}_g0.ts", 'map': None} for i in range(3)]
+        for entry in entries:
+            (variant_dir / entry['uri']).write_bytes(b"")
+        params = encode_params_hash({'command': packager.build_ladder_command(["-i", "SOURCE"], ".", None, False)})
+        Segment_Hash_Index(tmp_path / "segment_index.json").save(params, ["a", "b", "c"], {'360p': entries})
+        commands = []
+        
+        def run_chunks(encoder, chunks):
+            for chunk in chunks:
+                commands.append(encoder.chunk_command(chunk))
+                (variant_dir / chunk['playlist']).write_text("#EXTM3U\n#EXTINF:6.000000,\nsegment_00001_g1.ts\n")
+        mocker.patch('src.utility_classes.packaging_generator.Segment_Parallel_Encoder.run_chunks',
+                     autospec=True, side_effect=run_chunks)
+        audio_run = mocker.patch('subprocess.run')
+        
+        packager.adaptive_bitrate_encoding(mock_video_path, str(tmp_path))
+        packager.encode_audio_rendition(mock_video_path, str(tmp_path))
+        
+        # Segment 1 is re-encoded at 6 s; the reused audio put 6 s of media at the same timestamp
+        [command] = commands
+        audio_command = audio_run.call_args[0][0]
+        video_start = float(command[command.index("-output_ts_offset") + 1]) - float(command[command.index("-ss") + 1])
+        assert video_start == float(audio_command[audio_command.index("-output_ts_offset") + 1]) == TS_OFFSET_PAD
+        with open(variant_dir / "playlist.m3u8") as f:
+            uris = [line for line in f.read().splitlines() if line.startswith("segment_")]
+        assert uris == ["segment_00000_g0.ts", "segment_00001_g1.ts", "segment_00002_g0.ts"]
+
+
+class TestProgressivePackaging:
+
+    @pytest.fixture
+    def packager(self, mock_video_path):
+        return HLS_Packaging_Generator(mock_video_path)
+
+    def test_master_published_before_encode_and_flipped_to_vod(self, packager, mocker, tmp_path):
+        hls_dir, variants_dir = tmp_path, tmp_path / "variants"
+        mocker.patch.object(packager, 'create_hls_package', return_value=(str(hls_dir), str(variants_dir)))
+        
+        def encode(command, **kwargs):
+            assert (hls_dir / "master.m3u8").exists()
+            assert command[command.index("-hls_playlist_type") + 1] == "event"
+            assert command[command.index("-i") - 1] == "mpegts"
+            for profile in packager.encoding_profiles:
+                (variants_dir / profile['name']).mkdir(parents=True)
+                (variants_dir / profile['name'] / "playlist.m3u8").write_text(
+                    "#EXTM3U\n#EXT-X-PLAYLIST-TYPE:EVENT\n#EXTINF:6.000000,\nsegment_000.ts\n"
+                )
+        mocker.patch('subprocess.run', side_effect=encode)
+        
+        result = packager.run_progressive("live.ts", has_audio=False)
+        
+        with open(result['variants'][0]['playlist']) as f:
+            lines = f.read().splitlines()
+        assert "#EXT-X-PLAYLIST-TYPE:VOD" in lines
+        assert lines[-1] == "#EXT-X-ENDLIST"
+
+    def test_close_live_input_releases_waiting_reader(self, packager):
+        import threading
+        import time
+        live_path = packager.create_live_input()
+        received = []
+        
+        def reader():
+            with open(live_path, 'rb') as f:
+                received.append(f.read())
+        
+        thread = threading.Thread(target=reader)
+        thread.start()
+        time.sleep(0.2)
+        packager.close_live_input(live_path)
+        thread.join(timeout=5)
+        
+        assert not thread.is_alive()
+        assert received == [b""]
+        assert not os.path.exists(live_path)
@@ -47,4 +47,42 @@ class TestPipeline:
         assert "mov_text" in cmd
         assert str(tmp_path) in cmd[-1] or "combined" in cmd[-1]
 
+    def test_progressive_falls_back_to_file_packaging(self, mock_video_path, mocker):
+        pipeline = VideoPipeline(mock_video_path, progressive=True)
+        packager = mocker.patch('src.main.HLS_Packaging_Generator').return_value
+        packager.create_live_input.return_value = "live.ts"
+        packager.run_progressive.side_effect = RuntimeError("no live stream")
+        mocker.patch('src.main.probe_has_audio', return_value=True)
+        enhance = mocker.patch.object(pipeline, '_run_enhancement', return_value="enhanced.mp4")
+        fallback = mocker.patch.object(pipeline, '_run_packaging')
+        
+        assert pipeline._run_progressive_packaging() == "enhanced.mp4"
+        
+        enhance.assert_called_once_with("live.ts")
+        packager.close_live_input.assert_called_once_with("live.ts")
+        fallback.assert_called_once_with("enhanced.mp4")
 
+    def test_captioning_uses_backend_options(self, mock_video_path, mocker):
+        pipeline = VideoPipeline(mock_video_path, caption_backend="whisper-int8", compute_type="int8",
+                                 caption_threads=4)
+        captions = mocker.patch('src.main.Caption_Generator')
+        
+        pipeline._run_captioning()
+        
+        captions.assert_called_once_with(mock_video_path, model_size="base", backend="whisper-int8",
+                                         device="cpu", compute_type="int8", threads=4)
+
+    def test_preload_warms_the_requested_backend(self, mock_video_path, mocker):
+        # src.main imports the package as utility_classes, so its registry is that module's
+        from utility_classes.model_registry import get_model_registry
+        pipeline = VideoPipeline(mock_video_path, caption_backend="whisper-int8")
+        mocker.patch('whisper.load_model', return_value=mocker.Mock())
+        model = mocker.Mock()
+        mocker.patch('utility_classes.model_registry.quantize_whisper_int8', return_value=model)
+        get_model_registry().clear()
+        
+        pipeline.preload_caption_models(["base"])
+        
+        assert get_model_registry().loaded() == [("base", "cpu", "int8")]
+        assert get_model_registry().acquire("base", "cpu", "int8") is model
+        get_model_registry().clear()
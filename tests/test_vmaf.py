@@ -13,9 +13,9 @@ class TestVMAF:
         
     def test_parsing_logic_mock(self, vmaf, mocker):
         mocker.patch('subprocess.run')
-        mocker.patch.object(vmaf, 'calculate_vmaf', return_value=("path.json", 95.5))
-        mocker.patch.object(vmaf, 'calculate_psnr', return_value=("log", 40.0))
-        mocker.patch.object(vmaf, 'calculate_ssim', return_value=("log", 0.98))
+        mocker.patch.object(vmaf, 'calculate_quality_metrics', return_value={
+            'log_path': "path.json", 'vmaf': 95.5, 'vmaf_min': 90.0, 'psnr': 40.0, 'ssim': 0.98, 'ms_ssim': 0.99
+        })
         mocker.patch.object(vmaf, 'generate_vmaf_report', return_value=({}, "", {'metrics': {'vmaf': {'status': 'good'}, 'psnr': {'status': 'good'}, 'ssim': {'status': 'good'}}}))
         
         res = vmaf.run_full_analysis()
@@ -30,10 +30,45 @@ class TestVMAF:
         pass
 
     def test_no_metrics_default(self, vmaf, mocker):
-        mocker.patch.object(vmaf, 'calculate_vmaf', return_value=("path.json", 0))
-        mocker.patch.object(vmaf, 'calculate_psnr', return_value=("log", 0))
-        mocker.patch.object(vmaf, 'calculate_ssim', return_value=("log", 0))
+        mocker.patch.object(vmaf, 'calculate_quality_metrics', return_value={
+            'log_path': "path.json", 'vmaf': 0, 'vmaf_min': 0, 'psnr': 0, 'ssim': 0, 'ms_ssim': 0
+        })
         mocker.patch.object(vmaf, 'generate_vmaf_report', return_value=({}, "", {'metrics': {'vmaf': {'status': 'bad'}, 'psnr': {'status': 'bad'}, 'ssim': {'status': 'bad'}}}))
         
         res = vmaf.run_full_analysis()
         assert res['vmaf_score'] == 0
+
+    def test_single_pass_metrics_graph(self, vmaf, mocker):
+        run = mocker.patch('subprocess.run')
+        vmaf.extra_metrics = ["ssim=stats_file=ssim.log"]
+        mocker.patch.object(vmaf, 'parse_metrics_log', return_value={
+            'vmaf': 95.0, 'vmaf_min': 90.0, 'psnr': 40.0, 'ssim': 0.98, 'ms_ssim': 0.99
+        })
+        
+        vmaf.calculate_quality_metrics()
+        
+        assert run.call_count == 1
+        command = run.call_args[0][0]
+        assert command.count("-i") == 2
+        graph = command[command.index("-filter_complex") + 1]
+        assert graph.count("split=2") == 2
+        assert "feature='name=psnr|name=float_ssim|name=float_ms_ssim'" in graph
+        assert "[main1][ref1]ssim=stats_file=ssim.log[metric1]" in graph
+        assert command[command.index("-map") + 1] == "[vmaf]"
+
+    def test_parse_metrics_log(self, tmp_path):
+        log = tmp_path / "vmaf.json"
+        frame = {'vmaf': 90.0, 'psnr_y': 40.0, 'psnr_cb': 40.0, 'psnr_cr': 40.0, 'float_ssim': 0.97,
+                 'float_ms_ssim': 0.99}
+        log.write_text(json.dumps({
+            'frames': [{'frameNum': 0, 'metrics': frame}, {'frameNum': 1, 'metrics': dict(frame, vmaf=94.0)}],
+            'pooled_metrics': {'vmaf': {'min': 90.0, 'mean': 92.0}, 'float_ssim': {'mean': 0.97},
+                               'float_ms_ssim': {'mean': 0.99}}
+        }))
+        
+        metrics = VMAF_Calculator.parse_metrics_log(str(log))
+        
+        assert metrics['vmaf'] == 92.0 and metrics['vmaf_min'] == 90.0
+        assert metrics['psnr'] == pytest.approx(40.0)
+        assert metrics['ssim'] == 0.97 and metrics['ms_ssim'] == 0.99
+        assert [frame['vmaf'] for frame in metrics['frames']] == [90.0, 94.0]